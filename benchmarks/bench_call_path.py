@@ -0,0 +1,27 @@
+"""
+Benchmark the per-call overhead of `LmFunction.__call__`, without any network request.
+
+Usage:
+    python benchmarks/bench_call_path.py [number of calls]
+"""
+import sys
+import time
+from unittest import mock
+
+from slambda.contrib.sentiment import sentiment
+
+RESP = {'choices': [{'message': {'content': 'positive'}}]}
+
+
+def run(n=20000):
+    with mock.patch('openai.ChatCompletion.create', return_value=RESP):
+        sentiment('warm up')
+        start = time.perf_counter()
+        for _ in range(n):
+            sentiment('The food is great, and the service is friendly.')
+        elapsed = time.perf_counter() - start
+    print(f"{n} calls in {elapsed:.3f}s, {elapsed / n * 1e6:.1f}us per call, {n / elapsed:.0f} calls/s")
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
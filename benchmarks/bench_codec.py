@@ -0,0 +1,46 @@
+"""
+Benchmark json codecs on large list outputs, similar to what `extract_wiki_links` returns.
+
+Usage:
+    python benchmarks/bench_codec.py [number of items]
+"""
+import sys
+import timeit
+
+from slambda.codec import CODECS
+from slambda.core import Definition, FunctionOutputConfig
+from slambda import codec as codec_module
+
+
+def make_output(n):
+    return [
+        {
+            "name": f"entity {i}",
+            "url": f"https://en.wikipedia.org/wiki/Entity_{i}",
+            "score": i / 7,
+        }
+        for i in range(n)
+    ]
+
+
+def run(n=10000, repeat=20):
+    output = make_output(n)
+    text = codec_module.JsonCodec().render(output)
+    config = FunctionOutputConfig(cast_to_json=True)
+    print(f"{n} items, {len(text) / 1024:.1f} KiB")
+    print(f"{'codec':<8}{'loads':>12}{'dumps':>12}{'cast':>12}")
+    for name in CODECS:
+        try:
+            codec = codec_module.create_codec(name)
+        except ImportError:
+            print(f"{name:<8}{'not installed':>36}")
+            continue
+        codec_module.set_codec(codec)
+        loads = min(timeit.repeat(lambda: codec.loads(text), number=1, repeat=repeat))
+        dumps = min(timeit.repeat(lambda: codec.dumps(output), number=1, repeat=repeat))
+        cast = min(timeit.repeat(lambda: Definition.cast_lm_output(config, text), number=1, repeat=repeat))
+        print(f"{name:<8}{loads * 1000:>10.2f}ms{dumps * 1000:>10.2f}ms{cast * 1000:>10.2f}ms")
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
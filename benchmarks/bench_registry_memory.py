@@ -0,0 +1,52 @@
+"""
+Benchmark the memory used by many per-customer functions, with and without compact definitions.
+
+Usage:
+    python benchmarks/bench_registry_memory.py [number of functions]
+"""
+import gc
+import sys
+import tracemalloc
+
+from slambda import Example
+from slambda.core import LmFunction
+from slambda.registry import FunctionRegistry
+
+INSTRUCTION = 'Classify the sentiment of the review, answer with positive, negative or neutral.'
+EXAMPLES = [
+    ('The food is great, and the service is friendly.', 'positive'),
+    ('We waited an hour and the soup was cold.', 'negative'),
+    ('It is a restaurant.', 'neutral'),
+]
+
+
+def build(n: int, compact: bool) -> FunctionRegistry:
+    registry = FunctionRegistry(compact=compact)
+    for i in range(n):
+        # every customer gets its own function with the same instruction and mostly the same examples.
+        examples = [Example(input=x, output=y) for x, y in EXAMPLES]
+        examples.append(Example(input=f'Customer {i % 100} review.', output='neutral'))
+        registry.add(LmFunction.create(INSTRUCTION, examples=examples, name=f'customer-{i}'))
+    return registry
+
+
+def measure(n: int, compact: bool) -> int:
+    gc.collect()
+    tracemalloc.start()
+    registry = build(n, compact)
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert len(registry) == n
+    return current
+
+
+def run(n=10000):
+    full = measure(n, compact=False)
+    compact = measure(n, compact=True)
+    print(f"{n} functions, full: {full / 2 ** 20:.1f}MB ({full / n:.0f}B per function), "
+          f"compact: {compact / 2 ** 20:.1f}MB ({compact / n:.0f}B per function), {full / compact:.1f}x")
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
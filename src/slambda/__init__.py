@@ -1,2 +1,16 @@
 from .core import LmFunction, Definition, Example, LmOutputCastingError
 from .gpt import Role, Message, GptApiOptions
+from .hedging import HedgingPolicy
+from .metrics import metrics
+from .scheduler import Scheduler, Priority
+from .limiter import AdaptiveLimiter
+from .circuit import CircuitBreaker, CircuitOpenError
+from .deadline import Deadline, DeadlineExceededError
+from .registry import FunctionRegistry
+from .pipeline import Pipeline
+from .fanout import fanout, afanout
+from .fusion import FusedFunction
+from .transport import set_default_transport
+from .credentials import Credential, CredentialPool
+from .routing import Endpoint, EndpointRouter
+from .usage import Budget, BudgetExceededError, usage_tracker
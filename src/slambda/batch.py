@@ -0,0 +1,90 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, Iterator, Optional
+
+
+@dataclass
+class BatchItem:
+    """
+    Result of one input in a batch.
+
+    Args:
+        index: position of the input in the batch.
+        input: the input value.
+        output: function output, None if the call failed.
+        error: the exception raised by the call, None if it succeeded.
+    """
+    index: int
+    input: Any
+    output: Any = None
+    error: Optional[BaseException] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def call_with_input(fn: Callable, fn_input: Any, **ctrl_kws):
+    """
+    Call `fn` with a function input value: a dict is passed as keyword arguments, None as no argument,
+    anything else as the single positional argument.
+    """
+    if fn_input is None:
+        return fn(**ctrl_kws)
+    elif isinstance(fn_input, dict):
+        return fn(**fn_input, **ctrl_kws)
+    else:
+        return fn(fn_input, **ctrl_kws)
+
+
+def run_batch(
+        fn: Callable[[Any], Any],
+        inputs: Iterable,
+        concurrency: int = 8,
+        max_pending: Optional[int] = None,
+) -> Iterator[BatchItem]:
+    """
+    Apply `fn` to every input concurrently, and yield results in input order.
+
+    Inputs are consumed lazily and at most `max_pending` of them are in flight or waiting to be yielded,
+    so memory usage does not depend on the number of inputs. Closing the iterator early cancels inputs that
+    are not started, and waits for the calls in flight.
+
+    :param fn: function called with each input.
+    :param inputs: an iterable of inputs.
+    :param concurrency: number of worker threads.
+    :param max_pending: max number of inputs read ahead, default to 4 * concurrency.
+    :return: iterator of `BatchItem`.
+    """
+    if concurrency < 1:
+        raise ValueError('concurrency must be at least 1')
+    if max_pending is None:
+        max_pending = 4 * concurrency
+    max_pending = max(max_pending, concurrency)
+
+    def run(index, value) -> BatchItem:
+        try:
+            return BatchItem(index=index, input=value, output=fn(value))
+        except Exception as e:
+            return BatchItem(index=index, input=value, error=e)
+
+    window = deque()
+    it = enumerate(inputs)
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='slambda-batch')
+    try:
+        exhausted = False
+        while True:
+            while not exhausted and len(window) < max_pending:
+                try:
+                    index, value = next(it)
+                except StopIteration:
+                    exhausted = True
+                    break
+                window.append(executor.submit(run, index, value))
+            if len(window) == 0:
+                return
+            yield window.popleft().result()
+    finally:
+        # inputs not started yet are dropped when the iterator is closed early.
+        executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,167 @@
+import abc
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .codec import get_codec
+
+TRANSPORT_KEYS = ('request_timeout', 'api_key', 'api_base', 'api_type', 'api_version', 'organization')
+"""
+Call arguments that only affect how a request is sent, not its response. They are not part of request fingerprints.
+"""
+
+
+def request_fingerprint(call_args: Dict[str, Any]) -> str:
+    """
+    A stable hash of a ChatCompletion request, used as cache key.
+    :param call_args: keyword arguments of `openai.ChatCompletion.create`.
+    """
+    data = {k: v for k, v in call_args.items() if k not in TRANSPORT_KEYS}
+    # use json instead of the configured codec, keys must be the same with every codec.
+    return hashlib.sha256(json.dumps(data, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+class ResponseCache(abc.ABC):
+    """
+    Cache of ChatCompletion responses, keyed by `request_fingerprint`.
+    """
+
+    @abc.abstractmethod
+    def get(self, key: str) -> Optional[Dict]:
+        pass
+
+    @abc.abstractmethod
+    def set(self, key: str, resp: Dict):
+        pass
+
+    @abc.abstractmethod
+    def delete(self, key: str):
+        pass
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Dict]:
+        """
+        Look up many keys at once, missing keys are not in the returned dict.
+        """
+        ret = {}
+        for key in keys:
+            resp = self.get(key)
+            if resp is not None:
+                ret[key] = resp
+        return ret
+
+    def set_many(self, items: Iterable[Tuple[str, Dict]]) -> int:
+        """
+        Insert many responses at once.
+        :return: number of inserted responses.
+        """
+        n = 0
+        for key, resp in items:
+            self.set(key, resp)
+            n += 1
+        return n
+
+
+class MemoryCache(ResponseCache):
+    """
+    In-memory LRU cache.
+    """
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            resp = self._data.get(key)
+            if resp is not None:
+                self._data.move_to_end(key)
+            return resp
+
+    def set(self, key: str, resp: Dict):
+        with self._lock:
+            self._data[key] = resp
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SqliteCache(ResponseCache):
+    """
+    Persistent cache stored in a sqlite database, it can be shared by processes on the same machine.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._codec = get_codec()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, resp TEXT NOT NULL, created REAL NOT NULL)'
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute('SELECT resp FROM responses WHERE key = ?', (key,)).fetchone()
+        return None if row is None else self._codec.loads(row[0])
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Dict]:
+        keys = list(keys)
+        ret = {}
+        # sqlite limits the number of parameters of a statement.
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT key, resp FROM responses WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+            for key, resp in rows:
+                ret[key] = self._codec.loads(resp)
+        return ret
+
+    def set(self, key: str, resp: Dict):
+        self.set_many([(key, resp)])
+
+    def set_many(self, items: Iterable[Tuple[str, Dict]], batch_size: int = 1000) -> int:
+        n = 0
+        batch: List[Tuple[str, str, float]] = []
+        for key, resp in items:
+            batch.append((key, self._codec.dumps(resp), time.time()))
+            if len(batch) >= batch_size:
+                n += self._insert(batch)
+                batch = []
+        if batch:
+            n += self._insert(batch)
+        return n
+
+    def _insert(self, batch) -> int:
+        with self._lock:
+            self._conn.executemany('INSERT OR REPLACE INTO responses (key, resp, created) VALUES (?, ?, ?)', batch)
+            self._conn.commit()
+        return len(batch)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,139 @@
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from .codec import get_codec
+
+
+class CheckpointMismatchError(Exception):
+    """
+    This exception will be thrown if a checkpoint is resumed with a different job configuration.
+    """
+
+    def __init__(self, key, expected, actual):
+        self.key = key
+        self.expected = expected
+        self.actual = actual
+        super().__init__(f"checkpoint was created with {key}={expected!r}, got {actual!r}")
+
+
+class Checkpoint:
+    """
+    Durable record of batch job progress, backed by a sqlite database.
+
+    Every processed record is stored with its index, whether it succeeded, and its result row. Writes are
+    committed every `commit_every` records or `commit_interval` seconds, whichever comes first, so a crashed job
+    loses at most that much work. Resuming a job skips records that succeeded, and re-runs failed ones.
+    """
+
+    def __init__(self, path: str, commit_every: int = 1000, commit_interval: float = 1.0):
+        """
+
+        :param path: sqlite database path, it will be created if it does not exist.
+        :param commit_every: commit after this many records.
+        :param commit_interval: commit after this many seconds.
+        """
+        self.path = path
+        self.commit_every = commit_every
+        self.commit_interval = commit_interval
+        self._codec = get_codec()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS results (idx INTEGER PRIMARY KEY, ok INTEGER NOT NULL, row TEXT NOT NULL)'
+        )
+        self._conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+        self._conn.commit()
+        self._uncommitted = 0
+        self._last_commit = time.monotonic()
+
+    def check_meta(self, **meta):
+        """
+        Store job configuration on the first run, and verify it matches when the job is resumed.
+        :raise CheckpointMismatchError: if a stored value is different.
+        """
+        with self._lock:
+            for key, value in meta.items():
+                encoded = self._codec.dumps(value)
+                row = self._conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+                if row is None:
+                    self._conn.execute('INSERT INTO meta (key, value) VALUES (?, ?)', (key, encoded))
+                elif row[0] != encoded:
+                    raise CheckpointMismatchError(key, self._codec.loads(row[0]), value)
+            self._conn.commit()
+
+    def meta(self) -> Dict[str, Any]:
+        """
+        Job configuration stored by `check_meta`.
+        """
+        with self._lock:
+            rows = self._conn.execute('SELECT key, value FROM meta').fetchall()
+        return {key: self._codec.loads(value) for key, value in rows}
+
+    def is_done(self, index: int) -> bool:
+        """
+        True if record `index` was processed successfully.
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT ok FROM results WHERE idx = ?', (index,)).fetchone()
+        return row is not None and row[0] == 1
+
+    def record(self, index: int, ok: bool, row: Dict[str, Any]):
+        """
+        Record the result row of record `index`.
+        """
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO results (idx, ok, row) VALUES (?, ?, ?)',
+                (index, int(ok), self._codec.dumps(row))
+            )
+            self._uncommitted += 1
+            if self._uncommitted >= self.commit_every or \
+                    time.monotonic() - self._last_commit >= self.commit_interval:
+                self._commit()
+
+    def _commit(self):
+        self._conn.commit()
+        self._uncommitted = 0
+        self._last_commit = time.monotonic()
+
+    def commit(self):
+        with self._lock:
+            self._commit()
+
+    def counts(self) -> Tuple[int, int]:
+        """
+        :return: number of succeeded and failed records.
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT COALESCE(SUM(ok), 0), COUNT(*) FROM results').fetchone()
+        return row[0], row[1] - row[0]
+
+    def iter_rows(self, batch_size: int = 1000) -> Iterator[Tuple[int, bool, Dict[str, Any]]]:
+        """
+        Iterate over all recorded rows in record index order.
+        """
+        last: Optional[int] = -1
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    'SELECT idx, ok, row FROM results WHERE idx > ? ORDER BY idx LIMIT ?', (last, batch_size)
+                ).fetchall()
+            if len(rows) == 0:
+                return
+            for idx, ok, row in rows:
+                yield idx, ok == 1, self._codec.loads(row)
+            last = rows[-1][0]
+
+    def close(self):
+        with self._lock:
+            self._commit()
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
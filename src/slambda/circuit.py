@@ -0,0 +1,233 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from enum import Enum
+from typing import Callable, Dict, List, Optional
+
+import openai
+
+from .deadline import DeadlineExceededError
+from .metrics import metrics as default_metrics, MetricsRegistry
+
+
+class CircuitState(str, Enum):
+    """
+    State of a circuit.
+    """
+    CLOSED = 'closed'
+    """
+    requests are sent normally.
+    """
+    OPEN = 'open'
+    """
+    requests are rejected immediately.
+    """
+    HALF_OPEN = 'half_open'
+    """
+    a limited number of probe requests are sent to check if the upstream recovered.
+    """
+
+
+_STATE_VALUES = {CircuitState.CLOSED: 0, CircuitState.HALF_OPEN: 1, CircuitState.OPEN: 2}
+
+
+class CircuitOpenError(Exception):
+    """
+    This exception will be thrown if a request is rejected because its circuit is open.
+    """
+
+    def __init__(self, key: str, retry_after: float):
+        """
+
+        :param key: circuit key.
+        :param retry_after: number of seconds before the circuit accepts probe requests.
+        """
+        self.key = key
+        self.retry_after = retry_after
+        super().__init__(f"circuit {key} is open, retry after {retry_after:.1f} seconds")
+
+
+def is_upstream_failure(error: BaseException) -> bool:
+    """
+    True if the error indicates that the upstream is unhealthy, invalid requests are not upstream failures.
+    A deadline exceeded is an upstream failure only if the upstream did not answer in time, deadlines
+    exhausted while queueing, waiting for the limiter or before a request is sent are not.
+    """
+    if isinstance(error, DeadlineExceededError):
+        return error.stage == 'request' and isinstance(error.__cause__, (TimeoutError, openai.error.Timeout))
+    if isinstance(error, (openai.error.InvalidRequestError, openai.error.AuthenticationError,
+                          openai.error.PermissionError)):
+        return False
+    return isinstance(error, (openai.error.OpenAIError, TimeoutError, ConnectionError))
+
+
+StateListener = Callable[[str, CircuitState, CircuitState], None]
+
+
+class _Circuit:
+    def __init__(self, window: int):
+        self.state = CircuitState.CLOSED
+        self.outcomes = deque(maxlen=window)
+        self.opened_at = 0.0
+        self.probes = 0
+        self.probe_successes = 0
+
+
+class CircuitBreaker:
+    """
+    Fail fast when an upstream (model/endpoint) is unhealthy, each key has its own circuit.
+
+    * CLOSED: outcomes of the last `window` requests are tracked, when at least `min_calls` were observed and
+      the failure rate reaches `failure_rate`, the circuit opens.
+    * OPEN: requests are rejected with `CircuitOpenError` for `open_seconds`, then the circuit is half-open.
+    * HALF_OPEN: up to `half_open_max_calls` probe requests are let through, other requests are rejected.
+      The circuit closes once all probes succeed, and opens again if any of them fails.
+
+    Only errors accepted by `is_failure` count as failures (by default upstream errors, not invalid requests).
+
+    State changes are sent to listeners registered with `add_listener`, and recorded as metrics
+    (labeled by `circuit`):
+        * circuit_state: 0 closed, 1 half open, 2 open.
+        * circuit_transition: number of transitions, labeled by new `state`.
+        * circuit_rejected: number of rejected requests.
+    """
+
+    def __init__(
+            self,
+            failure_rate: float = 0.5,
+            min_calls: int = 20,
+            window: int = 100,
+            open_seconds: float = 30.0,
+            half_open_max_calls: int = 1,
+            is_failure: Callable[[BaseException], bool] = is_upstream_failure,
+            metrics: Optional[MetricsRegistry] = None,
+    ):
+        """
+
+        :param failure_rate: failure rate (0-1] that opens the circuit.
+        :param min_calls: min number of observed requests before the circuit can open.
+        :param window: number of recent requests used to compute failure rate.
+        :param open_seconds: how long the circuit stays open before probing.
+        :param half_open_max_calls: number of probe requests in half-open state.
+        :param is_failure: decide if an exception counts as a failure.
+        :param metrics: metrics registry, default to `slambda.metrics.metrics`.
+        """
+        if not (0 < failure_rate <= 1):
+            raise ValueError('failure_rate must be in (0, 1]')
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.open_seconds = open_seconds
+        self.half_open_max_calls = half_open_max_calls
+        self.is_failure = is_failure
+        self.metrics = metrics if metrics is not None else default_metrics
+
+        self._lock = threading.Lock()
+        self._circuits: Dict[str, _Circuit] = {}
+        self._listeners: List[StateListener] = []
+
+    def add_listener(self, listener: StateListener):
+        """
+        Register a callback called with (key, old state, new state) on every state change.
+        """
+        self._listeners.append(listener)
+
+    def _circuit(self, key: str) -> _Circuit:
+        c = self._circuits.get(key)
+        if c is None:
+            c = _Circuit(self.window)
+            self._circuits[key] = c
+        return c
+
+    def state(self, key: str) -> CircuitState:
+        events = []
+        with self._lock:
+            c = self._circuit(key)
+            self._maybe_half_open(key, c, events)
+            state = c.state
+        self._notify(events)
+        return state
+
+    def _transition(self, key: str, c: _Circuit, state: CircuitState, events: list):
+        old = c.state
+        c.state = state
+        if state == CircuitState.OPEN:
+            c.opened_at = time.monotonic()
+        elif state == CircuitState.HALF_OPEN:
+            c.probes = 0
+            c.probe_successes = 0
+        elif state == CircuitState.CLOSED:
+            c.outcomes.clear()
+        self.metrics.set('circuit_state', _STATE_VALUES[state], circuit=key)
+        self.metrics.inc('circuit_transition', circuit=key, state=state.value)
+        events.append((key, old, state))
+
+    def _maybe_half_open(self, key: str, c: _Circuit, events: list):
+        if c.state == CircuitState.OPEN and time.monotonic() - c.opened_at >= self.open_seconds:
+            self._transition(key, c, CircuitState.HALF_OPEN, events)
+
+    def _notify(self, events):
+        for key, old, new in events:
+            for listener in self._listeners:
+                listener(key, old, new)
+
+    def allow(self, key: str):
+        """
+        Check if a request can be sent.
+        :raise CircuitOpenError: if the circuit is open, or half-open with all probes in flight.
+        """
+        events = []
+        try:
+            with self._lock:
+                c = self._circuit(key)
+                self._maybe_half_open(key, c, events)
+                if c.state == CircuitState.CLOSED:
+                    return
+                if c.state == CircuitState.HALF_OPEN and c.probes < self.half_open_max_calls:
+                    c.probes += 1
+                    return
+                self.metrics.inc('circuit_rejected', circuit=key)
+                retry_after = max(0.0, self.open_seconds - (time.monotonic() - c.opened_at))
+                raise CircuitOpenError(key, retry_after)
+        finally:
+            self._notify(events)
+
+    def record(self, key: str, error: Optional[BaseException] = None):
+        """
+        Record the outcome of a request allowed by `allow`.
+        """
+        failed = error is not None and self.is_failure(error)
+        events = []
+        with self._lock:
+            c = self._circuit(key)
+            if c.state == CircuitState.HALF_OPEN:
+                if failed:
+                    self._transition(key, c, CircuitState.OPEN, events)
+                elif error is None:
+                    c.probe_successes += 1
+                    if c.probe_successes >= self.half_open_max_calls:
+                        self._transition(key, c, CircuitState.CLOSED, events)
+                else:
+                    # not an upstream failure, let another probe through.
+                    c.probes -= 1
+            elif c.state == CircuitState.CLOSED:
+                c.outcomes.append(failed)
+                n = len(c.outcomes)
+                if n >= self.min_calls and sum(c.outcomes) / n >= self.failure_rate:
+                    self._transition(key, c, CircuitState.OPEN, events)
+        self._notify(events)
+
+    @contextmanager
+    def call(self, key: str):
+        """
+        Guard the with block with the circuit of `key`.
+        :raise CircuitOpenError: if the circuit is open.
+        """
+        self.allow(key)
+        try:
+            yield
+        except BaseException as e:
+            self.record(key, e)
+            raise
+        self.record(key)
@@ -0,0 +1,160 @@
+"""
+Command line interface.
+
+Usage:
+    slambda list [package]
+    slambda serve slambda.contrib --port 8080
+    slambda run slambda.contrib.writing.grammar:fix_grammar -i input.csv --input-field text -o output.csv
+    cat reviews.txt | slambda run slambda.contrib.sentiment:sentiment --input-format text --output-format jsonl
+"""
+import argparse
+import copy
+import sys
+from typing import Any, Dict, List, Optional
+
+import openai
+
+from .cache import SqliteCache
+from .codec import get_codec
+from .discovery import list_functions, resolve_function
+from .files import FORMATS, process_file
+from .fusion import is_fusable
+from .microbatch import MicroBatcher
+from .serve import serve
+from .usage import Budget
+
+
+def parse_override(values: List[str]) -> Dict[str, Any]:
+    """
+    Parse `key=value` pairs, values are parsed as json if possible, e.g. `temperature=0.5`, `stop=["\\n"]`.
+    """
+    override = {}
+    codec = get_codec()
+    for value in values:
+        if '=' not in value:
+            raise ValueError(f'override must be in key=value format, got {value}')
+        key, raw = value.split('=', 1)
+        try:
+            override[key] = codec.loads(raw)
+        except ValueError:
+            override[key] = raw
+    return override
+
+
+def run_command(args) -> int:
+    fn = resolve_function(args.function)
+    if args.api_base is not None:
+        openai.api_base = args.api_base
+    if args.cache is not None:
+        # do not change the shared function object.
+        fn = copy.copy(fn)
+        fn.cache = SqliteCache(args.cache)
+
+    override = parse_override(args.set)
+    if args.retries is not None:
+        override['cast_retries'] = args.retries
+    if args.timeout is not None:
+        override['timeout'] = args.timeout
+    budget = None
+    if args.max_total_tokens is not None or args.max_cost is not None:
+        budget = Budget(max_tokens=args.max_total_tokens, max_cost=args.max_cost, name='job')
+        override['budget'] = budget
+    ctrl_kws = {'__override': override} if override else {}
+
+    stats = process_file(
+        fn, args.input, args.output,
+        input_field=args.input_field,
+        output_field=args.output_field,
+        input_format=args.input_format or ('jsonl' if args.input == '-' else None),
+        output_format=args.output_format or ('jsonl' if args.output == '-' else None),
+        concurrency=args.concurrency,
+        raise_on_error=args.fail_fast,
+        checkpoint=args.checkpoint,
+        flush=args.output == '-',
+        **ctrl_kws
+    )
+    print(f'{stats.total} records, {stats.succeeded} succeeded, {stats.failed} failed', file=sys.stderr)
+    if budget is not None:
+        spent = budget.spent()
+        print(f'{spent.total_tokens} tokens, ${spent.cost:.4f} spent', file=sys.stderr)
+    return 0 if stats.failed == 0 else 1
+
+
+def list_command(args) -> int:
+    for ref, fn in list_functions(args.package):
+        print(f'{ref}\t{fn.definition.instruction.splitlines()[0]}')
+    return 0
+
+
+def serve_command(args) -> int:
+    if args.api_base is not None:
+        openai.api_base = args.api_base
+    functions = {}
+    for package in args.packages:
+        for ref, fn in list_functions(package):
+            name = ref.split(':')[-1]
+            if name in functions:
+                raise ValueError(f'duplicated function name {name}: {ref}')
+            if args.batch_size > 1 and is_fusable(fn):
+                fn = MicroBatcher(fn, max_batch_size=args.batch_size, max_wait=args.batch_wait / 1000)
+            functions[name] = fn
+    print(f'serving {len(functions)} functions on http://{args.host}:{args.port}', file=sys.stderr)
+    serve(functions, args.host, args.port, max_pending=args.max_pending, max_workers=args.workers,
+          playground=args.playground, allow_origin=args.allow_origin)
+    return 0
+
+
+def create_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='slambda', description='slambda command line interface')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p = commands.add_parser('list', help='list functions of a package')
+    p.add_argument('package', nargs='?', default='slambda.contrib', help='module or package name')
+    p.set_defaults(handler=list_command)
+
+    p = commands.add_parser('run', help='run a function over every record of a file or stdin')
+    p.add_argument('function', help='function reference, e.g. slambda.contrib.sentiment:sentiment')
+    p.add_argument('-i', '--input', default='-', help="input file, '-' for stdin (default)")
+    p.add_argument('-o', '--output', default='-', help="output file, '-' for stdout (default)")
+    p.add_argument('--input-format', choices=FORMATS, help='input format, detected from file extension by default')
+    p.add_argument('--output-format', choices=FORMATS, help='output format, detected from file extension by default')
+    p.add_argument('--input-field', help='record field used as function input')
+    p.add_argument('--output-field', default='output', help='field of the function output')
+    p.add_argument('-c', '--concurrency', type=int, default=8, help='number of concurrent calls')
+    p.add_argument('--cache', help='sqlite response cache path')
+    p.add_argument('--retries', type=int, help='number of retries when the output cannot be cast to json')
+    p.add_argument('--timeout', type=float, help='time budget of every call in seconds')
+    p.add_argument('--max-total-tokens', type=int, help='stop sending requests once this many tokens are used')
+    p.add_argument('--max-cost', type=float, help='stop sending requests once this many USD are spent')
+    p.add_argument('--set', action='append', default=[], metavar='KEY=VALUE',
+                   help='override a parameter of every call, e.g. --set temperature=0, can be repeated')
+    p.add_argument('--api-base', help='send requests to this API base url')
+    p.add_argument('--checkpoint', help='checkpoint path, the job can be resumed if it is interrupted')
+    p.add_argument('--fail-fast', action='store_true', help='stop at the first failed record')
+    p.set_defaults(handler=run_command)
+
+    p = commands.add_parser('serve', help='serve functions over HTTP')
+    p.add_argument('packages', nargs='*', default=['slambda.contrib'], help='modules or packages to serve')
+    p.add_argument('--host', default='127.0.0.1')
+    p.add_argument('--port', type=int, default=8080)
+    p.add_argument('--max-pending', type=int, default=64, help='calls in flight above this are rejected with 503')
+    p.add_argument('--workers', type=int, default=32, help='number of threads running function calls')
+    p.add_argument('--batch-size', type=int, default=1,
+                   help='pack up to this many concurrent calls of a unary function into one request')
+    p.add_argument('--batch-wait', type=float, default=5,
+                   help='max milliseconds a call waits for its batch')
+    p.add_argument('--playground', action='store_true',
+                   help='serve /playground/run, which runs posted definitions and streams their tokens')
+    p.add_argument('--allow-origin', help='allow browser requests from this origin, e.g. http://localhost:3000')
+    p.add_argument('--api-base', help='send requests to this API base url')
+    p.set_defaults(handler=serve_command)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = create_parser().parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
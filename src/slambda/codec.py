@@ -0,0 +1,120 @@
+import json
+import os
+from typing import Any, Optional, Union
+
+
+class JsonCodec:
+    """
+    Encode and decode json, the default implementation uses python's `json` module.
+
+    * `loads` decodes json text.
+    * `dumps` encodes compact json text, used for cache entries, logs and batch files.
+    * `render` encodes json with `json.dumps` default formatting, used where the text is part of a prompt
+      (e.g. example outputs), so prompts stay identical whichever codec is installed.
+    """
+    name = 'json'
+
+    def loads(self, s: Union[str, bytes]) -> Any:
+        return json.loads(s)
+
+    def dumps(self, obj: Any, sort_keys: bool = False) -> str:
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), sort_keys=sort_keys)
+
+    def render(self, obj: Any) -> str:
+        return json.dumps(obj)
+
+
+class OrjsonCodec(JsonCodec):
+    """
+    Codec backed by [orjson](https://github.com/ijl/orjson).
+    """
+    name = 'orjson'
+
+    def __init__(self):
+        import orjson
+        self._orjson = orjson
+
+    def loads(self, s: Union[str, bytes]) -> Any:
+        try:
+            return self._orjson.loads(s)
+        except self._orjson.JSONDecodeError:
+            # orjson is stricter than json (e.g. NaN), fallback before reporting an error.
+            return json.loads(s)
+
+    def dumps(self, obj: Any, sort_keys: bool = False) -> str:
+        option = self._orjson.OPT_NON_STR_KEYS
+        if sort_keys:
+            option |= self._orjson.OPT_SORT_KEYS
+        return self._orjson.dumps(obj, option=option).decode('utf-8')
+
+
+class UjsonCodec(JsonCodec):
+    """
+    Codec backed by [ujson](https://github.com/ultrajson/ultrajson).
+    """
+    name = 'ujson'
+
+    def __init__(self):
+        import ujson
+        self._ujson = ujson
+
+    def loads(self, s: Union[str, bytes]) -> Any:
+        try:
+            return self._ujson.loads(s)
+        except ValueError:
+            return json.loads(s)
+
+    def dumps(self, obj: Any, sort_keys: bool = False) -> str:
+        return self._ujson.dumps(obj, ensure_ascii=False, sort_keys=sort_keys)
+
+
+CODECS = {
+    'orjson': OrjsonCodec,
+    'ujson': UjsonCodec,
+    'json': JsonCodec,
+}
+"""
+Available codecs, in order of preference.
+"""
+
+_codec: Optional[JsonCodec] = None
+
+
+def create_codec(name: Optional[str] = None) -> JsonCodec:
+    """
+    Create a codec by name, if name is None, use the fastest installed one.
+    :param name: one of `CODECS`
+    """
+    if name is not None:
+        if name not in CODECS:
+            raise ValueError(f'unknown json codec: {name}, must be one of {list(CODECS)}')
+        return CODECS[name]()
+
+    for codec_cls in CODECS.values():
+        try:
+            return codec_cls()
+        except ImportError:
+            continue
+    return JsonCodec()
+
+
+def get_codec() -> JsonCodec:
+    """
+    Return the codec used by slambda. It can be selected with the `SLAMBDA_JSON_CODEC` environment variable,
+    otherwise the fastest installed one is used.
+    """
+    global _codec
+    if _codec is None:
+        _codec = create_codec(os.environ.get('SLAMBDA_JSON_CODEC') or None)
+    return _codec
+
+
+def set_codec(codec: Union[str, JsonCodec]):
+    """
+    Change the codec used by slambda.
+    :param codec: a codec name or a `JsonCodec` instance.
+    """
+    global _codec
+    if isinstance(codec, str):
+        codec = create_codec(codec)
+    _codec = codec
@@ -1,15 +1,32 @@
+import asyncio
+import functools
+import hashlib
 import json
+import sys
+import threading
 import warnings
+from collections import OrderedDict
 from dataclasses import dataclass
 
 import openai
 
-from typing import Optional, List, Union, Dict, Tuple
-from pydantic import BaseModel, Field
+from typing import Optional, List, Union, Dict, Tuple, Iterable, Iterator
+from pydantic import BaseModel, Field, PrivateAttr
 from enum import Enum
 
-from .gpt import Message, GptApiOptions
-from .utils import extract_required_keywords, try_parse_json
+from .batch import run_batch, call_with_input
+from .cache import ResponseCache, request_fingerprint
+from .circuit import CircuitBreaker
+from .codec import get_codec
+from .deadline import Deadline
+from .gpt import Message, GptApiOptions, Role, WireMessage, wire_message
+from .hedging import HedgingPolicy
+from .limiter import AdaptiveLimiter
+from .metrics import metrics
+from .scheduler import Scheduler, Priority
+from .transport import Transport, get_default_transport
+from .usage import Budget, metered_stream, usage_tracker
+from .utils import extract_required_keywords, intern_strings, try_parse_json
 
 FunctionInput = Union[str, Dict]
 FunctionOutput = Union[str, List, Dict]
@@ -110,8 +127,16 @@ class FunctionOutputConfig(BaseModel):
     This class determine what kinds of output should be returned for a function
     Args:
         cast_to_json: cast the output str as json.
+        repair_json: if True, try cheap local repairs (code fences, leading prose, trailing commas, single quotes)
+                     before failing to cast the output, see `slambda.utils.repair_json`.
+        repair_truncated: if True, `repair_json` also closes truncated output, incomplete trailing items of
+                          arrays are dropped.
+        cast_retries: number of times the request will be re-sent if the output still cannot be cast to json.
     """
     cast_to_json: bool = False
+    repair_json: bool = True
+    repair_truncated: bool = False
+    cast_retries: int = 0
 
 
 class Example(BaseModel):
@@ -269,7 +294,8 @@ class Definition(BaseModel):
         instruction: what will this function do.
         examples: example input/output pairs.
         name: an optional name of this function.
-        message_stack: created message stack to be sent to ChatCompletion API.
+        message_stack: created message stack to be sent to ChatCompletion API, None for compact definitions,
+                       see `to_compact`.
         input_config: this determine what input arguments are allowed
         output_config: this determine if the output of this function is a string or json object.
         default_args: If this value is not None, this function can be called with no arguments, and
@@ -282,7 +308,7 @@ class Definition(BaseModel):
     instruction: str
     examples: List[Example]
 
-    message_stack: List[Message]
+    message_stack: Optional[List[Message]] = None
 
     input_config: FunctionInputConfig
     output_config: FunctionOutputConfig
@@ -298,6 +324,89 @@ class Definition(BaseModel):
 
     name: Optional[str] = None
 
+    _wire_stack: Optional[Tuple[WireMessage, ...]] = PrivateAttr(default=None)
+    _wire_stack_src: Optional[Tuple[Tuple[str, str, Optional[str]], ...]] = PrivateAttr(default=None)
+    _fingerprint: Optional[str] = PrivateAttr(default=None)
+
+    @property
+    def compact(self) -> bool:
+        return self.message_stack is None
+
+    def messages(self) -> List[Message]:
+        """
+        The message stack, derived from instruction and examples if this definition is compact.
+        """
+        if self.message_stack is not None:
+            return self.message_stack
+        return self._derive_messages()
+
+    def _derive_messages(self) -> List[Message]:
+        return Definition.create_message_stack(
+            instruction=self.instruction,
+            examples=self.examples,
+            input_config=self.input_config,
+            output_config=self.output_config,
+            default_args=self.default_args,
+            required_args=self.required_args,
+            message_template=self.message_template,
+        )
+
+    def to_compact(self) -> 'Definition':
+        """
+        A copy of this definition that does not keep `message_stack`, it is derived from the examples when needed
+        and shared by compact definitions with the same content, see `COMPACT_STACK_CACHE_SIZE`.
+        Strings of instruction and examples are interned, so they are shared by definitions too.
+        Compact definitions should not be modified.
+
+        :raise ValueError: if `message_stack` was modified and cannot be derived from the examples.
+        """
+        if self.message_stack is not None:
+            derived = [m.to_wire() for m in self._derive_messages()]
+            if derived != [m.to_wire() for m in self.message_stack]:
+                raise ValueError('message_stack does not match instruction and examples, it cannot be compacted')
+        examples = [
+            Example.model_construct(input=intern_strings(e.input), output=intern_strings(e.output))
+            for e in self.examples
+        ]
+        ret = self.model_copy(deep=True, update=dict(
+            instruction=sys.intern(self.instruction),
+            examples=examples,
+            message_stack=None,
+            message_template=intern_strings(self.message_template),
+        ))
+        ret._wire_stack = None
+        ret._wire_stack_src = None
+        ret._fingerprint = None
+        return ret
+
+    def wire_message_stack(self) -> Tuple[WireMessage, ...]:
+        """
+        `message_stack` in the format sent to ChatCompletion API. It is computed once and shared by every call
+        until the content of `message_stack` changes, so the returned messages must not be modified.
+        """
+        if self.message_stack is None:
+            return _compact_wire_stack(self)
+        src = tuple((m.role, m.content, m.name) for m in self.message_stack)
+        if self._wire_stack is None or self._wire_stack_src != src:
+            self._wire_stack = tuple(m.to_wire() for m in self.message_stack)
+            self._wire_stack_src = src
+        return self._wire_stack
+
+    def fingerprint(self) -> str:
+        """
+        A stable hash of everything that affects the output of this function, `name` is not included.
+        A compact definition has the same fingerprint as the original one.
+        """
+        if self._fingerprint is not None:
+            return self._fingerprint
+        data = self.model_dump(mode='json', exclude={'name'})
+        if self.message_stack is None:
+            data['message_stack'] = [m.model_dump(mode='json') for m in self.messages()]
+        fingerprint = hashlib.sha256(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+        if self.message_stack is None:
+            self._fingerprint = fingerprint
+        return fingerprint
+
     @staticmethod
     def create_message_stack(
             instruction: str,
@@ -380,7 +489,7 @@ class Definition(BaseModel):
     def render_output_example(output_config: FunctionOutputConfig, example_output: FunctionOutput) -> str:
         if output_config.cast_to_json:
             if isinstance(example_output, list) or isinstance(example_output, dict):
-                return json.dumps(example_output)
+                return get_codec().render(example_output)
             else:
                 raise ValueError("example output must be a dict or list, or set fn_output_type.cast_to_json to False")
         else:
@@ -392,7 +501,8 @@ class Definition(BaseModel):
     @staticmethod
     def cast_lm_output(output_config: FunctionOutputConfig, llm_output: str) -> Union[List, Dict]:
         if output_config.cast_to_json:
-            json_value, parsed = try_parse_json(llm_output)
+            json_value, parsed = try_parse_json(llm_output, repair=output_config.repair_json,
+                                                truncated=output_config.repair_truncated)
             if parsed:
                 return json_value
             else:
@@ -430,6 +540,30 @@ class Definition(BaseModel):
         )
 
 
+COMPACT_STACK_CACHE_SIZE = 1024
+"""
+Number of message stacks of compact definitions kept in memory, least recently used stacks are derived again.
+"""
+
+_compact_stacks: OrderedDict = OrderedDict()
+_compact_stacks_lock = threading.Lock()
+
+
+def _compact_wire_stack(definition: Definition) -> Tuple[WireMessage, ...]:
+    key = definition.fingerprint()
+    with _compact_stacks_lock:
+        stack = _compact_stacks.get(key)
+        if stack is not None:
+            _compact_stacks.move_to_end(key)
+            return stack
+    stack = tuple(m.to_wire() for m in definition.messages())
+    with _compact_stacks_lock:
+        _compact_stacks[key] = stack
+        while len(_compact_stacks) > COMPACT_STACK_CACHE_SIZE:
+            _compact_stacks.popitem(last=False)
+    return stack
+
+
 class LmFunction:
     """
     A text function that call be called, the preferred way to create such function is using one of
@@ -452,13 +586,92 @@ class LmFunction:
                     * logit_bias
                     * user
                 (see here for details)[https://platform.openai.com/docs/api-reference/chat/create]
+                and the following slambda options:
+                    * cast_retries: see `FunctionOutputConfig.cast_retries`
+                    * priority: scheduling priority class, see `slambda.scheduler.Priority`
+                    * tenant: scheduling flow for fair queuing, default to the function key
+                    * timeout: see `GptApiOptions.timeout`, `slambda.deadline.DeadlineExceededError` is raised
+                      when the budget is exhausted
+                    * budget: a `slambda.usage.Budget` checked and charged in addition to the function budget,
+                      e.g. the budget of a batch job
     __return_resp_obj: if set to true, the response from ChatCompletion API will be returned directly                
     """
 
     definition: Definition
+    hedging: Optional[HedgingPolicy]
+    """
+    hedging: if provided, slow requests will be hedged with a duplicate request, see `slambda.hedging.HedgingPolicy`.
+    """
+    scheduler: Optional[Scheduler]
+    """
+    scheduler: if provided, requests wait for a slot of this scheduler, see `slambda.scheduler.Scheduler`.
+    """
+    priority: Priority
+    """
+    priority: default scheduling priority class of this function.
+    """
+    limiter: Optional[AdaptiveLimiter]
+    """
+    limiter: if provided, the number of requests in flight per model is limited adaptively,
+             see `slambda.limiter.AdaptiveLimiter`.
+    """
+    circuit_breaker: Optional[CircuitBreaker]
+    """
+    circuit_breaker: if provided, requests fail fast while their model/endpoint is unhealthy,
+                     see `slambda.circuit.CircuitBreaker`. The endpoint is the `api_base` of the request, the circuit
+                     is checked before the transport runs, so endpoints picked by the transport (e.g.
+                     `slambda.routing.EndpointRouter` or a credential pool) share one circuit per model.
+    """
+    cache: Optional[ResponseCache]
+    """
+    cache: if provided, responses are cached by request and served from cache, including while the circuit is open,
+           see `slambda.cache.ResponseCache`.
+    """
+    transport: Optional[Transport]
+    """
+    transport: if provided, requests are sent with this transport instead of the default one,
+               see `slambda.transport` and `slambda.replay`.
+    """
+    budget: Optional[Budget]
+    """
+    budget: if provided, calls are refused or throttled once this budget is spent, see `slambda.usage.Budget`.
+    """
+    usage_key: Optional[str]
+    """
+    usage_key: key of this function in usage accounting, default to `key`.
+    """
 
-    def __init__(self, definition):
+    def __init__(
+            self,
+            definition,
+            hedging: Optional[HedgingPolicy] = None,
+            scheduler: Optional[Scheduler] = None,
+            priority: Priority = Priority.DEFAULT,
+            limiter: Optional[AdaptiveLimiter] = None,
+            circuit_breaker: Optional[CircuitBreaker] = None,
+            cache: Optional[ResponseCache] = None,
+            transport: Optional[Transport] = None,
+            budget: Optional[Budget] = None,
+    ):
         self.definition = definition
+        self.hedging = hedging
+        self.scheduler = scheduler
+        self.priority = priority
+        self.limiter = limiter
+        self.circuit_breaker = circuit_breaker
+        self.cache = cache
+        self.transport = transport
+        self.budget = budget
+        self.usage_key = None
+
+    @property
+    def key(self) -> str:
+        """
+        Key used to identify this function in metrics and per-function state.
+        """
+        if self.definition.name is not None:
+            return self.definition.name
+        return f"fn-{id(self):x}"
 
     @staticmethod
     def create(
@@ -472,6 +685,8 @@ class LmFunction:
             message_template: Optional[str] = None,
             required_args: Optional[List[str]] = None,
             gpt_opts: Optional[GptApiOptions] = None,
+            cast_retries: int = 0,
+            compact: bool = False,
     ):
         """
         Create a LmFunction based on instruction and examples.
@@ -487,6 +702,8 @@ class LmFunction:
         :param required_args: list of required keyword args. If this value is missing and message_template is provided,
                               we will calculate required_args based on message_template.
         :param gpt_opts: inference parameters for ChatCompletion API.
+        :param cast_retries: number of times the request will be re-sent if the output cannot be cast to json.
+        :param compact: if True, the definition is stored without its message stack, see `Definition.to_compact`.
         :return: function created.
         """
 
@@ -506,6 +723,8 @@ class LmFunction:
         if gpt_opts is None:
             gpt_opts = GptApiOptions()
 
+        fn_output_type.cast_retries = cast_retries
+
         message_stack = Definition.create_message_stack(
             instruction=instruction,
             examples=examples,
@@ -533,6 +752,9 @@ class LmFunction:
             gpt_opts=gpt_opts,
         )
 
+        if compact:
+            t = t.to_compact()
+
         return LmFunction(t)
 
     def __call__(self, *args, **kwargs):
@@ -543,6 +765,36 @@ class LmFunction:
         :param kwargs:
         :return:
         """
+        call_args_dict, ctrl_kws, override_params = self._prepare(args, kwargs)
+        n = call_args_dict.get('n')
+        stream = call_args_dict.get('stream')
+
+        deadline = Deadline(override_params.get('timeout', self.definition.gpt_opts.timeout))
+
+        return_resp_obj = ctrl_kws.get('__return_resp_obj', False) or stream is True
+        if return_resp_obj:
+            return self._create_completion(call_args_dict, override_params, deadline)
+
+        cast_retries = override_params.get('cast_retries', self.definition.output_config.cast_retries)
+        attempt = 0
+        while True:
+            deadline.check('retry' if attempt > 0 else 'request')
+            resp = self._create_completion(call_args_dict, override_params, deadline)
+            try:
+                return self._cast_resp(resp, n)
+            except LmOutputCastingError:
+                if self.cache is not None:
+                    self.cache.delete(request_fingerprint(call_args_dict))
+                if attempt >= cast_retries:
+                    raise
+                attempt += 1
+                metrics.inc('cast_retry', function=self.key)
+
+    def _prepare(self, args, kwargs) -> Tuple[Dict, Dict, Dict]:
+        """
+        Split reserved keywords, render messages and build the ChatCompletion call arguments.
+        :return: call arguments, reserved keywords, and override parameters.
+        """
         all_kwargs = kwargs
         kwargs = {}
         ctrl_kws = {}
@@ -583,16 +835,16 @@ class LmFunction:
                 else:
                     raise ValueError('received more than 1 positional arguments.')
 
-        messages = [m for m in self.definition.message_stack]
+        messages = list(self.definition.wire_message_stack())
 
         if extra_msgs is not None:
             for m in extra_msgs:
                 if not isinstance(m, Message):
                     raise ValueError('message in extra_messages must be an instance of slambda.Message')
-                messages.append(m)
+                messages.append(m.to_wire())
 
         messages.append(
-            Message.user(Definition.render_input(
+            wire_message(Role.user, Definition.render_input(
                 self.definition.input_config,
                 fn_input_args,
                 self.definition.default_args,
@@ -616,9 +868,7 @@ class LmFunction:
         user = override_params.get('user', self.definition.gpt_opts.user)
 
         call_args_dict = dict(
-            messages=[
-                m.model_dump(exclude_none=True, mode='json') for m in messages
-            ],
+            messages=messages,
             model=model,
             n=n,
             temperature=temperature,
@@ -633,15 +883,124 @@ class LmFunction:
         )
 
         call_args_dict = {k: v for k, v in call_args_dict.items() if v is not None}
-        resp = openai.ChatCompletion.create(**call_args_dict)
+        return call_args_dict, ctrl_kws, override_params
 
-        return_resp_obj = ctrl_kws.get('__return_resp_obj', False) or stream is True
-        if return_resp_obj:
-            return resp
+    def request_args(self, *args, **kwargs) -> Dict:
+        """
+        Keyword arguments of `openai.ChatCompletion.create` for a call with these arguments, without sending it.
+        """
+        return self._prepare(args, kwargs)[0]
+
+    async def acall(self, *args, **kwargs):
+        """
+        Async version of `__call__`, the call runs in the default executor of the running event loop.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(self, *args, **kwargs))
 
+    def _cast_resp(self, resp, n: Optional[int]):
         if n is None or n == 1:
             ret = resp['choices'][0]['message']['content']
             return Definition.cast_lm_output(self.definition.output_config, ret)
         else:
             return [Definition.cast_lm_output(self.definition.output_config, c['message']['content']) for c in
                     resp['choices']]
+
+    def map(self, inputs: Iterable[Optional[FunctionInput]], concurrency: int = 8, **ctrl_kws) -> Iterator:
+        """
+        Call this function on every input concurrently, outputs are returned in input order.
+        If a call failed, its exception is raised when its output is reached.
+        Unless overridden, calls are scheduled with `Priority.BATCH`.
+
+        :param inputs: str for unary functions, dict of keyword arguments for keyword functions, or None.
+        :param concurrency: number of concurrent calls.
+        :param ctrl_kws: reserved keywords passed to every call, e.g. `__override`.
+        :return: iterator of outputs.
+        """
+        ctrl_kws['__override'] = {'priority': Priority.BATCH, **ctrl_kws.get('__override', {})}
+        for item in run_batch(lambda x: call_with_input(self, x, **ctrl_kws), inputs, concurrency=concurrency):
+            if item.error is not None:
+                raise item.error
+            yield item.output
+
+    def _create_completion(self, call_args_dict: Dict, override_params: Dict, deadline: Optional[Deadline] = None):
+        """
+        Send the request to ChatCompletion API, every step is bounded by the remaining time of `deadline`.
+        """
+        if deadline is None:
+            deadline = Deadline()
+
+        cache_key = None
+        if self.cache is not None and not call_args_dict.get('stream', False):
+            cache_key = request_fingerprint(call_args_dict)
+            resp = self.cache.get(cache_key)
+            if resp is not None:
+                metrics.inc('cache_hit', function=self.key)
+                return resp
+            metrics.inc('cache_miss', function=self.key)
+
+        budgets = [b for b in (self.budget, override_params.get('budget')) if b is not None]
+        model = call_args_dict['model']
+        for budget in budgets:
+            budget.acquire(deadline.remaining(), model)
+
+        transport = self.transport if self.transport is not None else get_default_transport()
+
+        usage_key = self.usage_key if self.usage_key is not None else self.key
+
+        def charge(r):
+            usage_tracker.record(usage_key, model, r)
+            for b in budgets:
+                b.charge_response(model, r)
+
+        def request():
+            # every request is charged, including hedges that lose.
+            with deadline.bound('request'):
+                remaining = deadline.remaining()
+                if remaining is None:
+                    r = transport(**call_args_dict)
+                else:
+                    r = transport(**call_args_dict, request_timeout=remaining)
+            if call_args_dict.get('stream', False):
+                return metered_stream(r, call_args_dict, charge)
+            charge(r)
+            return r
+
+        def send():
+            if self.limiter is not None:
+                # timeouts of the request itself are converted by `request`, the rest is waiting for the limiter.
+                with deadline.bound('limiter'), self.limiter.slot(call_args_dict['model'], deadline.remaining()):
+                    return request()
+            return request()
+
+        def execute():
+            if self.hedging is not None and not call_args_dict.get('stream', False):
+                with deadline.bound('request'):
+                    return self.hedging.execute(self.key, send, timeout=deadline.remaining())
+            return send()
+
+        def schedule():
+            if self.scheduler is not None:
+                priority = override_params.get('priority', self.priority)
+                with deadline.bound('queue'), self.scheduler.slot(
+                        priority, flow=override_params.get('tenant', self.key), timeout=deadline.remaining()):
+                    return execute()
+            return execute()
+
+        if self.circuit_breaker is not None:
+            with self.circuit_breaker.call(self._circuit_key(call_args_dict)):
+                resp = schedule()
+        else:
+            resp = schedule()
+
+        if cache_key is not None:
+            self.cache.set(cache_key, resp)
+        return resp
+
+    @staticmethod
+    def _circuit_key(call_args_dict: Dict) -> str:
+        """
+        Circuit of a request, its `api_base` and model. Endpoints chosen later by the transport are not known yet.
+        """
+        api_base = call_args_dict.get('api_base') or openai.api_base
+        return f"{api_base}|{call_args_dict['model']}"
@@ -0,0 +1,294 @@
+import math
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Set
+
+import openai
+
+from .circuit import is_upstream_failure
+from .limiter import is_rate_limit_error
+from .metrics import metrics as default_metrics, MetricsRegistry
+from .transport import Transport, get_default_transport
+
+CHARS_PER_TOKEN = 4
+"""
+Rough number of characters per token, used to estimate the tokens of a request before it is sent.
+"""
+
+DEFAULT_COMPLETION_TOKENS = 256
+"""
+Estimated completion tokens of a request without `max_tokens`.
+"""
+
+
+def estimate_prompt_tokens(messages: List[Dict]) -> int:
+    """
+    Estimate the prompt tokens of ChatCompletion messages.
+    """
+    chars = sum(len(m.get('content') or '') for m in messages)
+    return math.ceil(chars / CHARS_PER_TOKEN) + 4 * len(messages)
+
+
+def estimate_tokens(call_args: Dict) -> int:
+    """
+    Estimate the total tokens (prompt and completion) of a ChatCompletion request.
+    """
+    prompt_tokens = estimate_prompt_tokens(call_args.get('messages', []))
+    completion_tokens = call_args.get('max_tokens') or DEFAULT_COMPLETION_TOKENS
+    return prompt_tokens + completion_tokens * (call_args.get('n') or 1)
+
+
+class CredentialsExhaustedError(openai.error.RateLimitError):
+    """
+    No credential of a pool had enough headroom for a request in time.
+    """
+
+
+@dataclass
+class Credential:
+    """
+    An API key and its quota.
+
+    Args:
+        api_key: the API key.
+        organization: organization of the requests sent with this key.
+        rpm: requests per minute allowed for this key, None for no limit.
+        tpm: tokens per minute allowed for this key, None for no limit.
+        name: name of the key in metrics, default to the last 4 characters of the key.
+    """
+    api_key: str
+    organization: Optional[str] = None
+    rpm: Optional[float] = None
+    tpm: Optional[float] = None
+    name: Optional[str] = None
+
+    @property
+    def label(self) -> str:
+        return self.name if self.name is not None else f'...{self.api_key[-4:]}'
+
+
+class _Bucket:
+    """
+    Token bucket refilled at `per_minute / 60` per second, holding at most `per_minute` tokens.
+    The level can go below zero when the actual usage of a request is above its estimate.
+    """
+
+    def __init__(self, per_minute: Optional[float]):
+        self.capacity = per_minute
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        if self.capacity is not None:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+    def headroom(self) -> float:
+        """
+        Fraction of the bucket available.
+        """
+        return 1.0 if self.capacity is None else self.level / self.capacity
+
+    def wait_time(self, amount: float) -> float:
+        """
+        Seconds until `amount` tokens are available.
+        """
+        if self.capacity is None or self.level >= amount:
+            return 0.0
+        if amount > self.capacity:
+            # a request larger than the quota is sent when the bucket is full.
+            amount = self.capacity
+        return (amount - self.level) * 60 / self.capacity
+
+    def take(self, amount: float):
+        if self.capacity is not None:
+            self.level -= amount
+
+
+class _KeyState:
+    def __init__(self, credential: Credential):
+        self.credential = credential
+        self.requests = _Bucket(credential.rpm)
+        self.tokens = _Bucket(credential.tpm)
+        self.failures = 0
+        self.ejected_until = 0.0
+
+    def wait_time(self, estimate: int, now: float) -> float:
+        return max(self.ejected_until - now, self.requests.wait_time(1), self.tokens.wait_time(estimate), 0.0)
+
+    def headroom(self) -> float:
+        return min(self.requests.headroom(), self.tokens.headroom())
+
+
+class CredentialPool:
+    """
+    A transport that spreads requests over several API keys.
+
+    Every key has its own requests-per-minute and tokens-per-minute buckets. A request goes to the key with the
+    most headroom among keys whose buckets can afford it (tokens are estimated with `estimate_tokens`, and
+    corrected with the `usage` of the response), and waits up to `max_wait` seconds if no key can. Its `api_key`
+    and `organization` are set by the pool.
+
+    A key that is rate limited, rejected, or failing `failure_threshold` times in a row is ejected from the
+    rotation for `eject_time` seconds (or the `Retry-After` of a rate limit response), and the request fails over
+    to another key. Invalid requests are not retried. With a `request_timeout`, time spent waiting for a key and
+    on previous keys is part of the timeout: a request fails over only while at least `min_timeout` seconds are
+    left, and a key timing out on a timeout shortened by more than `min_timeout` is not counted as failing.
+
+    Metrics (labeled by `credential`):
+        * credential_requests: number of requests sent with a key.
+        * credential_ejections: number of times a key was ejected.
+        * credential_headroom: fraction of the quota of a key available after its last request.
+
+    Example:
+        pool = CredentialPool([Credential('sk-1', rpm=3500, tpm=90000), Credential('sk-2', rpm=3500, tpm=90000)])
+        set_default_transport(pool)
+    """
+
+    def __init__(
+            self,
+            credentials: Iterable[Credential],
+            transport: Optional[Transport] = None,
+            eject_time: float = 30.0,
+            failure_threshold: int = 3,
+            max_wait: float = 60.0,
+            min_timeout: float = 1.0,
+            metrics: Optional[MetricsRegistry] = None,
+    ):
+        """
+
+        :param credentials: keys of the pool.
+        :param transport: transport sending the requests, default to the default transport when the pool
+                          is created.
+        :param eject_time: seconds a failing key stays out of the rotation.
+        :param failure_threshold: number of consecutive upstream failures that eject a key.
+        :param max_wait: max seconds to wait for a key with enough headroom.
+        :param min_timeout: min seconds of the request timeout left to fail over to another key.
+        :param metrics: metrics registry, default to `slambda.metrics.metrics`.
+        """
+        self._keys: List[_KeyState] = [_KeyState(c) for c in credentials]
+        if len(self._keys) == 0:
+            raise ValueError('at least one credential is required')
+        self.transport = transport if transport is not None else get_default_transport()
+        self.eject_time = eject_time
+        self.failure_threshold = failure_threshold
+        self.max_wait = max_wait
+        self.min_timeout = min_timeout
+        self.metrics = metrics if metrics is not None else default_metrics
+        self._cond = threading.Condition()
+
+    @property
+    def credentials(self) -> List[Credential]:
+        return [k.credential for k in self._keys]
+
+    def available(self) -> List[Credential]:
+        """
+        Keys that are not ejected.
+        """
+        now = time.monotonic()
+        with self._cond:
+            return [k.credential for k in self._keys if k.ejected_until <= now]
+
+    def _acquire(self, estimate: int, exclude: Set[int], timeout: float) -> int:
+        """
+        Wait for the key with the most headroom that can afford the request, and take its quota.
+        :return: index of the key.
+        """
+        end = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                best = None
+                wait = None
+                for i, key in enumerate(self._keys):
+                    if i in exclude:
+                        continue
+                    key.requests.refill(now)
+                    key.tokens.refill(now)
+                    w = key.wait_time(estimate, now)
+                    if w == 0 and (best is None or key.headroom() > self._keys[best].headroom()):
+                        best = i
+                    wait = w if wait is None else min(wait, w)
+                if best is not None:
+                    key = self._keys[best]
+                    key.requests.take(1)
+                    key.tokens.take(estimate)
+                    self.metrics.set('credential_headroom', key.headroom(), credential=key.credential.label)
+                    return best
+                if wait is None or now + wait > end:
+                    raise CredentialsExhaustedError(
+                        f'no credential available within {timeout} seconds for a request of {estimate} tokens')
+                self._cond.wait(wait)
+
+    def _eject(self, key: _KeyState, seconds: float):
+        key.ejected_until = time.monotonic() + seconds
+        key.failures = 0
+        self.metrics.inc('credential_ejections', credential=key.credential.label)
+
+    def _on_error(self, key: _KeyState, error: BaseException, shortened: bool = False):
+        with self._cond:
+            if is_rate_limit_error(error):
+                retry_after = None
+                headers = getattr(error, 'headers', None) or {}
+                try:
+                    retry_after = float(headers.get('retry-after', headers.get('Retry-After')))
+                except (TypeError, ValueError):
+                    pass
+                self._eject(key, retry_after if retry_after is not None else self.eject_time)
+            elif isinstance(error, (openai.error.AuthenticationError, openai.error.PermissionError)):
+                self._eject(key, self.eject_time)
+            elif shortened and isinstance(error, (TimeoutError, openai.error.Timeout)):
+                # the key was not given the full request timeout.
+                pass
+            elif is_upstream_failure(error):
+                key.failures += 1
+                if key.failures >= self.failure_threshold:
+                    self._eject(key, self.eject_time)
+            self._cond.notify_all()
+
+    def _on_success(self, key: _KeyState, estimate: int, resp):
+        with self._cond:
+            key.failures = 0
+            usage = resp.get('usage') if isinstance(resp, dict) else None
+            if usage is not None and usage.get('total_tokens'):
+                # correct the estimate with the actual usage.
+                key.tokens.take(usage['total_tokens'] - estimate)
+            self._cond.notify_all()
+
+    def __call__(self, **call_args):
+        estimate = estimate_tokens(call_args)
+        request_timeout = call_args.get('request_timeout')
+        start = time.monotonic()
+        tried: Set[int] = set()
+        while True:
+            timeout = self.max_wait
+            if request_timeout is not None:
+                remaining = request_timeout - (time.monotonic() - start)
+                # a failover keeps at least min_timeout seconds for the request.
+                timeout = min(timeout, remaining - self.min_timeout if tried else remaining)
+            index = self._acquire(estimate, tried, max(timeout, 0.0))
+            key = self._keys[index]
+            tried.add(index)
+            self.metrics.inc('credential_requests', credential=key.credential.label)
+            args = dict(call_args, api_key=key.credential.api_key)
+            shortened = False
+            if request_timeout is not None:
+                # time spent waiting for a key is part of the request timeout.
+                args['request_timeout'] = max(request_timeout - (time.monotonic() - start), 0.001)
+                shortened = request_timeout - args['request_timeout'] > self.min_timeout
+            if key.credential.organization is not None:
+                args['organization'] = key.credential.organization
+            try:
+                resp = self.transport(**args)
+            except Exception as e:
+                self._on_error(key, e, shortened)
+                failover = is_rate_limit_error(e) or is_upstream_failure(e) or \
+                    isinstance(e, (openai.error.AuthenticationError, openai.error.PermissionError))
+                if not failover or len(tried) >= len(self._keys):
+                    raise
+                if request_timeout is not None and request_timeout - (time.monotonic() - start) < self.min_timeout:
+                    raise
+                continue
+            self._on_success(key, estimate, resp)
+            return resp
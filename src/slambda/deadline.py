@@ -0,0 +1,71 @@
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+import openai
+
+
+class DeadlineExceededError(TimeoutError):
+    """
+    This exception will be thrown if a call did not complete within its timeout.
+    """
+
+    def __init__(self, timeout: float, stage: str):
+        """
+
+        :param timeout: the total time budget of the call, in seconds.
+        :param stage: where the budget ran out, e.g. 'queue', 'request', 'retry'.
+        """
+        self.timeout = timeout
+        self.stage = stage
+        super().__init__(f"deadline of {timeout} seconds exceeded ({stage})")
+
+
+class Deadline:
+    """
+    Time budget of a call, shared by every step of the call: queueing, rate limiting, retries and hedges.
+    A deadline without timeout never expires.
+    """
+
+    def __init__(self, timeout: Optional[float] = None):
+        """
+
+        :param timeout: time budget in seconds, None for no limit.
+        """
+        if timeout is not None and timeout <= 0:
+            raise ValueError('timeout must be positive')
+        self.timeout = timeout
+        self.expires_at = None if timeout is None else time.monotonic() + timeout
+
+    def remaining(self) -> Optional[float]:
+        """
+        Seconds left, None if there is no limit.
+        """
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    def check(self, stage: str):
+        """
+        :raise DeadlineExceededError: if the deadline has passed.
+        """
+        if self.expired():
+            raise DeadlineExceededError(self.timeout, stage)
+
+    @contextmanager
+    def bound(self, stage: str):
+        """
+        Convert timeouts raised in the with block to `DeadlineExceededError`, if this deadline has a timeout.
+        """
+        self.check(stage)
+        try:
+            yield
+        except DeadlineExceededError:
+            raise
+        except (TimeoutError, openai.error.Timeout) as e:
+            if self.timeout is None:
+                raise
+            raise DeadlineExceededError(self.timeout, stage) from e
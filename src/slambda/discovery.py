@@ -0,0 +1,44 @@
+import importlib
+import pkgutil
+from typing import List, Tuple
+
+from .core import LmFunction
+
+
+def resolve_function(ref: str) -> LmFunction:
+    """
+    Resolve a function from a reference string like `module:name`, e.g. `slambda.contrib.sentiment:sentiment`.
+    :param ref: module path and attribute name separated by a colon, the attribute name can be dotted.
+    :return: the function.
+    """
+    if ':' not in ref:
+        raise ValueError(f'function reference must be in module:name format, got {ref}')
+    module_name, attr = ref.split(':', 1)
+    item = importlib.import_module(module_name)
+    for part in attr.split('.'):
+        item = getattr(item, part)
+    if not isinstance(item, LmFunction):
+        raise ValueError(f'{ref} is not a LmFunction')
+    return item
+
+
+def list_functions(package: str = 'slambda.contrib') -> List[Tuple[str, LmFunction]]:
+    """
+    Find every LmFunction defined in a module, or in a package and its sub-packages.
+    :param package: module or package name.
+    :return: list of function reference and function, references can be resolved with `resolve_function`.
+    """
+    root = importlib.import_module(package)
+    module_names = [package]
+    if hasattr(root, '__path__'):
+        module_names += [m.name for m in pkgutil.walk_packages(root.__path__, prefix=f'{package}.')]
+
+    ret = []
+    for module_name in module_names:
+        module = importlib.import_module(module_name)
+        for name, item in vars(module).items():
+            # a function imported by several modules is only listed once.
+            if isinstance(item, LmFunction) and not name.startswith('_') and \
+                    not any(item is fn for _, fn in ret):
+                ret.append((f'{module_name}:{name}', item))
+    return ret
@@ -0,0 +1,115 @@
+import asyncio
+import threading
+from concurrent.futures import Executor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, Optional, Union
+
+from .batch import call_with_input
+from .core import LmFunction
+
+Functions = Union[Dict[str, Callable], Iterable[LmFunction]]
+"""
+Functions to fan out to, a dict from name to function, or LmFunctions named by their keys.
+"""
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def default_executor() -> ThreadPoolExecutor:
+    """
+    Thread pool shared by fan-out calls when no executor is provided.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix='slambda-fanout')
+        return _executor
+
+
+@dataclass
+class FanoutResult:
+    """
+    Results of calling several functions on the same input.
+
+    Args:
+        outputs: output of every function that succeeded, by name.
+        errors: the exception raised by every function that failed, by name.
+    """
+    outputs: Dict[str, Any] = field(default_factory=dict)
+    errors: Dict[str, BaseException] = field(default_factory=dict)
+
+    @property
+    def ok(self) -> bool:
+        return len(self.errors) == 0
+
+    def __getitem__(self, name: str):
+        """
+        Output of function `name`, its exception is raised if it failed.
+        """
+        if name in self.errors:
+            raise self.errors[name]
+        return self.outputs[name]
+
+
+def named_functions(functions: Functions) -> Dict[str, Callable]:
+    """
+    Functions by name, LmFunctions are named by their keys.
+    """
+    if isinstance(functions, dict):
+        return functions
+    named = {}
+    for fn in functions:
+        if fn.key in named:
+            raise ValueError(f'duplicated function {fn.key}')
+        named[fn.key] = fn
+    return named
+
+
+def fanout(functions: Functions, fn_input: Any = None, executor: Optional[Executor] = None,
+           **ctrl_kws) -> FanoutResult:
+    """
+    Call every function on the same input concurrently, the latency is the latency of the slowest call.
+
+    :param functions: a dict from name to function, or a list of LmFunctions named by their keys.
+    :param fn_input: str for unary functions, dict of keyword arguments for keyword functions, or None.
+    :param executor: executor used to run the calls, default to a shared thread pool.
+    :param ctrl_kws: reserved keywords passed to every call, e.g. `__override`.
+    :return: outputs and errors by function name.
+    """
+    executor = executor if executor is not None else default_executor()
+    futures = {
+        name: executor.submit(call_with_input, fn, fn_input, **ctrl_kws)
+        for name, fn in named_functions(functions).items()
+    }
+    ret = FanoutResult()
+    for name, future in futures.items():
+        try:
+            ret.outputs[name] = future.result()
+        except Exception as e:
+            ret.errors[name] = e
+    return ret
+
+
+async def afanout(functions: Functions, fn_input: Any = None, executor: Optional[Executor] = None,
+                  **ctrl_kws) -> FanoutResult:
+    """
+    Async version of `fanout`, the calls run in `executor` without blocking the event loop.
+    """
+    executor = executor if executor is not None else default_executor()
+    loop = asyncio.get_running_loop()
+    named = named_functions(functions)
+    results = await asyncio.gather(
+        *[loop.run_in_executor(executor, lambda fn=fn: call_with_input(fn, fn_input, **ctrl_kws))
+          for fn in named.values()],
+        return_exceptions=True
+    )
+    ret = FanoutResult()
+    for name, result in zip(named.keys(), results):
+        if isinstance(result, Exception):
+            ret.errors[name] = result
+        elif isinstance(result, BaseException):
+            raise result
+        else:
+            ret.outputs[name] = result
+    return ret
@@ -0,0 +1,324 @@
+import csv
+import io
+import os
+import sys
+from dataclasses import dataclass
+from typing import Any, Dict, IO, Iterator, Optional, Union
+
+from .batch import BatchItem, run_batch, call_with_input
+from .checkpoint import Checkpoint
+from .codec import get_codec
+from .core import LmFunction, FunctionInput, FunctionInputType
+
+Record = Union[str, Dict[str, Any]]
+
+FORMATS = ['jsonl', 'csv', 'text']
+"""
+Supported file formats:
+    * jsonl: one json value per line.
+    * csv: csv with a header row, each row is a dict.
+    * text: each line is a string.
+"""
+
+DEFAULT_BUFFER_SIZE = 1 << 20
+
+
+def detect_format(path: str) -> str:
+    """
+    Detect file format based on file extension, default to jsonl.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.csv':
+        return 'csv'
+    elif ext == '.txt':
+        return 'text'
+    return 'jsonl'
+
+
+def _check_format(fmt: str):
+    if fmt not in FORMATS:
+        raise ValueError(f'unknown file format: {fmt}, must be one of {FORMATS}')
+
+
+def _open_input(path: str, buffer_size: int) -> IO:
+    if path == '-':
+        return io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8', newline='')
+    return open(path, 'r', encoding='utf-8', newline='', buffering=buffer_size)
+
+
+def _open_output(path: str, buffer_size: int, append: bool = False) -> IO:
+    if path == '-':
+        return io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', newline='', write_through=False)
+    return open(path, 'a' if append else 'w', encoding='utf-8', newline='', buffering=buffer_size)
+
+
+def read_records(path: str, fmt: Optional[str] = None, buffer_size: int = DEFAULT_BUFFER_SIZE) -> Iterator[Record]:
+    """
+    Stream records from a file, one record at a time.
+    :param path: file path, '-' for stdin.
+    :param fmt: one of `FORMATS`, detected from file extension if not provided.
+    :param buffer_size: read buffer size in bytes.
+    :return: iterator of records.
+    """
+    fmt = fmt or detect_format(path)
+    _check_format(fmt)
+    codec = get_codec()
+    fd = _open_input(path, buffer_size)
+    try:
+        if fmt == 'csv':
+            for row in csv.DictReader(fd):
+                yield row
+        else:
+            for line in fd:
+                line = line.rstrip('\r\n')
+                if fmt == 'text':
+                    yield line
+                elif line.strip() != '':
+                    yield codec.loads(line)
+    finally:
+        if path == '-':
+            # do not close stdin
+            fd.detach()
+        else:
+            fd.close()
+
+
+def record_to_input(fn: LmFunction, record: Record, input_field: Optional[str] = None) -> Optional[FunctionInput]:
+    """
+    Map a record to the input of `fn`.
+
+    * unary function: `record[input_field]`, or the record itself if it is a string.
+    * keyword function: `record[input_field]` if provided, otherwise the fields in `required_args`
+      (extracted from `message_template`), or the whole record if the function has no required args.
+    * nullary function: always None.
+    """
+    input_config = fn.definition.input_config
+    if input_config.strict_no_args:
+        return None
+
+    if input_field is not None:
+        if not isinstance(record, dict):
+            raise ValueError(f'record must be an object to read field {input_field}')
+        if input_field not in record:
+            raise ValueError(f'{input_field} is missing in record')
+        return record[input_field]
+
+    if input_config.input_type == FunctionInputType.UNARY:
+        if isinstance(record, str):
+            return record
+        raise ValueError('input_field is required for unary functions when records are objects')
+
+    if not isinstance(record, dict):
+        raise ValueError('record must be an object for keyword functions')
+    required_args = fn.definition.required_args
+    if required_args:
+        missing = [k for k in required_args if k not in record]
+        if len(missing) > 0:
+            raise ValueError(f'{", ".join(missing)} missing in record')
+        return {k: record[k] for k in required_args}
+    return record
+
+
+class RecordWriter:
+    """
+    Write result records to a jsonl or csv file with a large write buffer.
+    In text format, only `text_field` of each row is written.
+    """
+
+    def __init__(self, path: str, fmt: Optional[str] = None, buffer_size: int = DEFAULT_BUFFER_SIZE,
+                 append: bool = False, text_field: str = 'output'):
+        self.fmt = fmt or detect_format(path)
+        _check_format(self.fmt)
+        self.text_field = text_field
+        self._is_stdout = path == '-'
+        self._fd = _open_output(path, buffer_size, append=append)
+        self._append = append
+        self._csv_writer = None
+        self._codec = get_codec()
+
+    def write(self, row: Dict[str, Any]):
+        if self.fmt == 'jsonl':
+            self._fd.write(self._codec.dumps(row))
+            self._fd.write('\n')
+        elif self.fmt == 'csv':
+            if self._csv_writer is None:
+                self._csv_writer = csv.DictWriter(self._fd, fieldnames=list(row.keys()), extrasaction='ignore')
+                if not self._append:
+                    self._csv_writer.writeheader()
+            self._csv_writer.writerow({
+                k: v if v is None or isinstance(v, str) else self._codec.dumps(v) for k, v in row.items()
+            })
+        else:
+            value = row.get(self.text_field)
+            if value is None:
+                value = ''
+            self._fd.write(value if isinstance(value, str) else self._codec.dumps(value))
+            self._fd.write('\n')
+
+    def flush(self):
+        self._fd.flush()
+
+    def close(self):
+        self._fd.flush()
+        if self._is_stdout:
+            # do not close stdout
+            self._fd.detach()
+        else:
+            self._fd.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def result_row(item: BatchItem, output_field: str = 'output', error_field: str = 'error') -> Dict[str, Any]:
+    """
+    Create the output row of a batch item, the row contains the input record, and either the output or the error.
+    """
+    record = item.input
+    if isinstance(record, dict):
+        row = dict(record)
+    else:
+        row = {'input': record}
+    row[output_field] = item.output
+    row[error_field] = None if item.error is None else f"{type(item.error).__name__}: {item.error}"
+    return row
+
+
+@dataclass
+class BatchStats:
+    """
+    Summary of a file batch run.
+    """
+    total: int = 0
+    succeeded: int = 0
+    failed: int = 0
+
+    def count(self, ok: bool):
+        self.total += 1
+        if ok:
+            self.succeeded += 1
+        else:
+            self.failed += 1
+
+
+def process_file(
+        fn: LmFunction,
+        input_path: str,
+        output_path: str,
+        input_field: Optional[str] = None,
+        output_field: str = 'output',
+        input_format: Optional[str] = None,
+        output_format: Optional[str] = None,
+        concurrency: int = 8,
+        raise_on_error: bool = False,
+        buffer_size: int = DEFAULT_BUFFER_SIZE,
+        checkpoint: Optional[str] = None,
+        flush: bool = False,
+        **ctrl_kws,
+) -> BatchStats:
+    """
+    Run `fn` over every record of a jsonl/csv/text file and write results to another file.
+
+    Records are streamed from the input file, processed concurrently, and written in input order,
+    so memory usage stays constant regardless of file size.
+    Each output row contains the input record, the function output in `output_field`, and the error message
+    in `error` if the call failed.
+
+    :param fn: function to run.
+    :param input_path: input file path, '-' for stdin.
+    :param output_path: output file path, '-' for stdout.
+    :param input_field: which field of the record is the function input, see `record_to_input`.
+    :param output_field: field name of the function output.
+    :param input_format: one of `FORMATS`, detected from file extension if not provided.
+    :param output_format: one of `FORMATS`, detected from file extension if not provided.
+    :param concurrency: number of concurrent calls.
+    :param raise_on_error: if True, stop at the first failed record and raise its error.
+    :param buffer_size: read and write buffer size in bytes.
+    :param checkpoint: path of a checkpoint database. If provided, results are durably recorded as the job
+                       progresses and the output file is written once all records are processed. Running the
+                       same job again skips records that succeeded and retries failed ones, it must have the same
+                       function, input file (path, size and format), fields and `__override`.
+                       See `slambda.checkpoint.Checkpoint`.
+    :param flush: if True, flush the output after every row, so results can be consumed as they are produced,
+                  e.g. when writing to stdout. It has no effect with `checkpoint`.
+    :param ctrl_kws: reserved keywords passed to every call, e.g. `__override`.
+    :return: number of processed, succeeded, and failed records.
+    """
+    if checkpoint is not None:
+        return _process_file_with_checkpoint(
+            fn, input_path, output_path, checkpoint,
+            input_field=input_field, output_field=output_field,
+            input_format=input_format, output_format=output_format,
+            concurrency=concurrency, raise_on_error=raise_on_error, buffer_size=buffer_size,
+            **ctrl_kws
+        )
+
+    stats = BatchStats()
+
+    def run(record):
+        return call_with_input(fn, record_to_input(fn, record, input_field), **ctrl_kws)
+
+    records = read_records(input_path, input_format, buffer_size=buffer_size)
+    with RecordWriter(output_path, output_format, buffer_size=buffer_size, text_field=output_field) as writer:
+        for item in run_batch(run, records, concurrency=concurrency):
+            if raise_on_error and item.error is not None:
+                raise item.error
+            stats.count(item.ok)
+            writer.write(result_row(item, output_field=output_field))
+            if flush:
+                writer.flush()
+    return stats
+
+
+def _process_file_with_checkpoint(
+        fn: LmFunction,
+        input_path: str,
+        output_path: str,
+        checkpoint_path: str,
+        input_field: Optional[str],
+        output_field: str,
+        input_format: Optional[str],
+        output_format: Optional[str],
+        concurrency: int,
+        raise_on_error: bool,
+        buffer_size: int,
+        **ctrl_kws,
+) -> BatchStats:
+    def run(indexed_record):
+        _, record = indexed_record
+        return call_with_input(fn, record_to_input(fn, record, input_field), **ctrl_kws)
+
+    input_format = input_format or detect_format(input_path)
+    override = ctrl_kws.get('__override') or {}
+    with Checkpoint(checkpoint_path) as cp:
+        cp.check_meta(
+            definition=fn.definition.fingerprint(),
+            input_path=input_path if input_path == '-' else os.path.abspath(input_path),
+            input_size=None if input_path == '-' else os.path.getsize(input_path),
+            input_format=input_format,
+            input_field=input_field,
+            output_field=output_field,
+            # a budget limits the job, it does not change its results.
+            override={k: v for k, v in override.items() if k != 'budget'},
+        )
+
+        records = read_records(input_path, input_format, buffer_size=buffer_size)
+        pending = ((index, record) for index, record in enumerate(records) if not cp.is_done(index))
+        for item in run_batch(run, pending, concurrency=concurrency):
+            index, record = item.input
+            row = result_row(BatchItem(index=index, input=record, output=item.output, error=item.error),
+                             output_field=output_field)
+            cp.record(index, item.ok, row)
+            if raise_on_error and item.error is not None:
+                raise item.error
+        cp.commit()
+
+        stats = BatchStats()
+        with RecordWriter(output_path, output_format, buffer_size=buffer_size, text_field=output_field) as writer:
+            for _, ok, row in cp.iter_rows():
+                stats.count(ok)
+                writer.write(row)
+        return stats
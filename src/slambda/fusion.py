@@ -0,0 +1,147 @@
+from typing import Any, Dict, List, Optional
+
+from .core import (Definition, FunctionInputConfig, FunctionInputType, FunctionOutputConfig, LmFunction,
+                   LmOutputCastingError)
+from .fanout import FanoutResult, Functions, named_functions, fanout
+from .gpt import GptApiOptions, Message
+from .metrics import metrics
+from .utils import try_parse_json
+
+FUSED_INSTRUCTION = 'Complete every task below on the given input. Answer with a single json object, ' \
+                    'its keys are the task names and its values are the answers of the tasks.'
+
+
+def is_fusable(fn: LmFunction) -> bool:
+    """
+    True if `fn` can be fused: a unary function that is called with one str argument.
+    """
+    input_config = fn.definition.input_config
+    return input_config.input_type == FunctionInputType.UNARY and not input_config.strict_no_args
+
+
+def _render_task(name: str, fn: LmFunction) -> str:
+    definition = fn.definition
+    lines = [f'Task {name}: {definition.instruction}']
+    for example in definition.examples:
+        if example.input is None:
+            continue
+        output = Definition.render_output_example(definition.output_config, example.output)
+        lines.append(f'Example input: {example.input}')
+        lines.append(f'Example answer: {output}')
+    return '\n'.join(lines)
+
+
+def _cast_value(output_config: FunctionOutputConfig, value: Any):
+    """
+    Cast the value of one task key, raise `LmOutputCastingError` if it does not match the task output type.
+    """
+    if output_config.cast_to_json:
+        if isinstance(value, str):
+            value, parsed = try_parse_json(value, repair=output_config.repair_json,
+                                           truncated=output_config.repair_truncated)
+            if not parsed:
+                raise LmOutputCastingError(llm_output=value)
+        if not isinstance(value, (dict, list)):
+            raise LmOutputCastingError(llm_output=value, message='task output is not a json object')
+        return value
+    if not isinstance(value, str):
+        raise LmOutputCastingError(llm_output=value, message='task output is not a string')
+    return value
+
+
+class FusedFunction:
+    """
+    Several unary functions answered by a single request.
+
+    The instructions and examples of the functions are combined into one prompt asking for a json object keyed
+    by function name. Every value is cast according to the output config of its function, functions whose key is
+    missing or invalid (or every function, if the fused output is not a json object) are called separately as a
+    fallback. Upstream errors of the fused request (e.g. rate limits, an open circuit, an exceeded deadline or
+    budget) are the errors of every function rather than sending them separately.
+
+    Metrics:
+        * fused_requests: number of fused requests.
+        * fused_fallback: number of fallback calls, labeled by `function`.
+    """
+
+    def __init__(
+            self,
+            functions: Functions,
+            gpt_opts: Optional[GptApiOptions] = None,
+            fallback: bool = True,
+            **components
+    ):
+        """
+
+        :param functions: a dict from name to LmFunction, or a list of LmFunctions named by their keys.
+        :param gpt_opts: inference parameters of the fused request, default to the options of the first function.
+        :param fallback: if False, functions that cannot be answered by the fused request are errors.
+        :param components: keyword arguments of the fused `LmFunction`, e.g. `cache`, `scheduler`.
+        """
+        self.functions: Dict[str, LmFunction] = named_functions(functions)
+        if len(self.functions) < 2:
+            raise ValueError('at least 2 functions are required')
+        for name, fn in self.functions.items():
+            if not is_fusable(fn):
+                raise ValueError(f'{name} is not a unary function and cannot be fused')
+        self.fallback = fallback
+        first = next(iter(self.functions.values()))
+        if gpt_opts is None:
+            gpt_opts = first.definition.gpt_opts.model_copy()
+        self.fn = LmFunction(self._create_definition(gpt_opts), **components)
+
+    def _create_definition(self, gpt_opts: GptApiOptions) -> Definition:
+        tasks = '\n\n'.join(_render_task(name, fn) for name, fn in self.functions.items())
+        instruction = f'{FUSED_INSTRUCTION}\n\n{tasks}'
+        return Definition(
+            name='+'.join(self.functions.keys()),
+            instruction=instruction,
+            examples=[],
+            message_stack=[Message.system(instruction)],
+            input_config=FunctionInputConfig.unary(False),
+            output_config=FunctionOutputConfig(cast_to_json=True),
+            gpt_opts=gpt_opts,
+        )
+
+    def __call__(self, text: str, **ctrl_kws) -> FanoutResult:
+        """
+        Call every function on `text`.
+        :param text: input of the functions.
+        :param ctrl_kws: reserved keywords passed to the fused request and fallback calls, e.g. `__override`.
+        :return: outputs and errors by function name.
+        """
+        ret = FanoutResult()
+        missing: List[str] = []
+        metrics.inc('fused_requests', function=self.fn.key)
+        try:
+            fused = self.fn(text, **ctrl_kws)
+            error = None if isinstance(fused, dict) else \
+                LmOutputCastingError(llm_output=fused, message='fused output is not a json object')
+        except LmOutputCastingError as e:
+            fused = None
+            error = e
+        except Exception as e:
+            for name in self.functions:
+                ret.errors[name] = e
+            return ret
+
+        for name, fn in self.functions.items():
+            if error is not None or name not in fused:
+                ret.errors[name] = error if error is not None else KeyError(f'{name} is missing in fused output')
+                missing.append(name)
+                continue
+            try:
+                ret.outputs[name] = _cast_value(fn.definition.output_config, fused[name])
+            except LmOutputCastingError as e:
+                ret.errors[name] = e
+                missing.append(name)
+
+        if self.fallback and missing:
+            for name in missing:
+                metrics.inc('fused_fallback', function=name)
+            separate = fanout({name: self.functions[name] for name in missing}, text, **ctrl_kws)
+            for name in missing:
+                del ret.errors[name]
+            ret.outputs.update(separate.outputs)
+            ret.errors.update(separate.errors)
+        return ret
@@ -15,6 +15,23 @@ class Role(str, Enum):
     function = 'function'
 
 
+WireMessage = Dict[str, str]
+"""
+A message in the format sent to ChatCompletion API, e.g. {'role': 'user', 'content': 'hi'}.
+"""
+
+
+def wire_message(role: Union[Role, str], content: str, name: Optional[str] = None) -> WireMessage:
+    """
+    Create a message in the wire format directly, without going through `Message`.
+    """
+    if isinstance(role, Role):
+        role = role.value
+    if name is None:
+        return {'role': role, 'content': content}
+    return {'role': role, 'content': content, 'name': name}
+
+
 class Message(BaseModel):
     """Chat Model Message.
 
@@ -27,6 +44,13 @@ class Message(BaseModel):
     content: str
     name: Optional[str] = None
 
+    def to_wire(self) -> WireMessage:
+        """
+        Convert to the format sent to ChatCompletion API,
+        equivalent to `self.model_dump(exclude_none=True, mode='json')` but much cheaper.
+        """
+        return wire_message(self.role, self.content, self.name)
+
     @staticmethod
     def user(content, name=None):
         return Message(role=Role.user, content=content, name=name)
@@ -65,6 +89,8 @@ class GptApiOptions(BaseModel):
         frequency_penalty: See [OpenAI's API Reference](https://platform.openai.com/docs/api-reference/chat/create)
         logit_bias: See [OpenAI's API Reference](https://platform.openai.com/docs/api-reference/chat/create)
         user: See [OpenAI's API Reference](https://platform.openai.com/docs/api-reference/chat/create)
+        timeout: total time budget of a call in seconds, including queueing, retries and hedges. It is not sent to
+                 the API, each request is sent with the remaining budget as its network timeout.
     """
     model: str = 'gpt-3.5-turbo'
     temperature: Optional[float] = None
@@ -77,3 +103,4 @@ class GptApiOptions(BaseModel):
     frequency_penalty: Optional[float] = None
     logit_bias: Optional[Dict[int, int]] = None
     user: Optional[str] = None
+    timeout: Optional[float] = None
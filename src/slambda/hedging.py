@@ -0,0 +1,194 @@
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+from typing import Callable, Dict, Optional, TypeVar
+
+from .metrics import metrics as default_metrics, MetricsRegistry
+
+T = TypeVar('T')
+
+
+class LatencyTracker:
+    """
+    Keep a sliding window of recently observed latencies (in seconds).
+    """
+
+    def __init__(self, window: int = 200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, latency: float):
+        with self._lock:
+            self._samples.append(latency)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """
+        Nearest-rank percentile of the window, None if no latency has been observed.
+        :param p: percentile between 0 and 100.
+        """
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) == 0:
+            return None
+        rank = max(1, math.ceil(p / 100 * len(samples)))
+        return samples[min(rank, len(samples)) - 1]
+
+
+class HedgingPolicy:
+    """
+    Hedged requests: if the first request does not respond within `delay` seconds,
+    send a duplicate request and return whichever finishes first.
+
+    The hedge delay is either static (`delay`), or adaptive (`percentile`), in which case it is
+    the given percentile of latency recently observed for the same function. Until `min_samples`
+    latencies have been observed, the static `delay` is used, and no hedge is sent if it is None.
+
+    Extra load is capped by `max_extra_load`: each request earns `max_extra_load` hedge credit and each
+    hedge spends one, so at most that fraction of requests are duplicated in the long run.
+
+    Every request runs on its own thread started right away, so the hedge delay counts from the time the
+    request is sent and concurrency is not capped by a pool. The losing request cannot be aborted, its result is
+    discarded but its latency is still observed, so the adaptive delay is not biased towards the fastest calls.
+
+    Metrics (labeled by `function`):
+        * hedge_requests: requests executed under this policy.
+        * hedge_fired: duplicate requests sent.
+        * hedge_won: duplicate requests that finished before the original one.
+        * hedge_budget_exhausted: hedges skipped because of `max_extra_load`.
+    """
+
+    def __init__(
+            self,
+            delay: Optional[float] = None,
+            percentile: Optional[float] = None,
+            min_samples: int = 20,
+            window: int = 200,
+            max_extra_load: float = 0.1,
+            metrics: Optional[MetricsRegistry] = None,
+    ):
+        """
+
+        :param delay: static hedge delay in seconds.
+        :param percentile: if provided, use this percentile (0-100) of recent latency as hedge delay.
+        :param min_samples: number of observations required before the adaptive delay is used.
+        :param window: number of recent latencies kept per function.
+        :param max_extra_load: max fraction of requests that can be hedged.
+        :param metrics: metrics registry, default to `slambda.metrics.metrics`.
+        """
+        if delay is None and percentile is None:
+            raise ValueError('either delay or percentile must be provided')
+        if percentile is not None and not (0 < percentile <= 100):
+            raise ValueError('percentile must be in (0, 100]')
+        if max_extra_load < 0:
+            raise ValueError('max_extra_load must not be negative')
+
+        self.delay = delay
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.window = window
+        self.max_extra_load = max_extra_load
+        self.metrics = metrics if metrics is not None else default_metrics
+
+        self._trackers: Dict[str, LatencyTracker] = {}
+        self._lock = threading.Lock()
+        self._credit = 1.0
+
+    def tracker(self, key: str) -> LatencyTracker:
+        with self._lock:
+            t = self._trackers.get(key)
+            if t is None:
+                t = LatencyTracker(self.window)
+                self._trackers[key] = t
+            return t
+
+    def hedge_delay(self, key: str) -> Optional[float]:
+        """
+        Current hedge delay for function `key`, None if no hedge should be sent.
+        """
+        if self.percentile is not None:
+            t = self.tracker(key)
+            if len(t) >= self.min_samples:
+                return t.percentile(self.percentile)
+        return self.delay
+
+    def _earn_credit(self):
+        with self._lock:
+            # Never accumulate more than a small burst of hedges.
+            self._credit = min(self._credit + self.max_extra_load, max(1.0, 10 * self.max_extra_load))
+
+    def _spend_credit(self) -> bool:
+        with self._lock:
+            if self._credit >= 1:
+                self._credit -= 1
+                return True
+            return False
+
+    def _start(self, send: Callable[[], T], tracker: LatencyTracker) -> Future:
+        """
+        Run `send` on a new thread, the latency of every successful call is observed, whether it wins or not.
+        """
+        future = Future()
+
+        def run():
+            future.set_running_or_notify_cancel()
+            start = time.monotonic()
+            try:
+                ret = send()
+            except BaseException as e:
+                future.set_exception(e)
+                return
+            tracker.observe(time.monotonic() - start)
+            future.set_result(ret)
+
+        threading.Thread(target=run, name='slambda-hedge', daemon=True).start()
+        return future
+
+    def execute(self, key: str, send: Callable[[], T], timeout: Optional[float] = None) -> T:
+        """
+        Execute `send`, hedging it with a duplicate call if it is slow.
+
+        :param key: function key, latency is tracked per key.
+        :param send: a callable that sends the request and returns the response.
+        :param timeout: stop waiting after this many seconds.
+        :raise TimeoutError: if no call finished before timeout.
+        :return: response of whichever call finishes first.
+        """
+        self.metrics.inc('hedge_requests', function=key)
+        self._earn_credit()
+        expires_at = None if timeout is None else time.monotonic() + timeout
+
+        tracker = self.tracker(key)
+        primary = self._start(send, tracker)
+        pending = {primary}
+
+        delay = self.hedge_delay(key)
+        if delay is not None and (timeout is None or delay < timeout):
+            done, _ = wait(pending, timeout=delay)
+            if not done:
+                if self._spend_credit():
+                    self.metrics.inc('hedge_fired', function=key)
+                    pending.add(self._start(send, tracker))
+                else:
+                    self.metrics.inc('hedge_budget_exhausted', function=key)
+
+        first_error = None
+        while pending:
+            remaining = None if expires_at is None else max(0.0, expires_at - time.monotonic())
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            if not done:
+                raise TimeoutError(f'no response within {timeout} seconds')
+            for f in done:
+                if f.exception() is not None:
+                    if first_error is None:
+                        first_error = f.exception()
+                    continue
+                if f is not primary:
+                    self.metrics.inc('hedge_won', function=key)
+                return f.result()
+
+        raise first_error
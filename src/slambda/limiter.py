@@ -0,0 +1,171 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+import openai
+
+from .metrics import metrics as default_metrics, MetricsRegistry
+
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    """
+    True if the error means the upstream is overloaded and we should slow down.
+    """
+    return isinstance(error, (openai.error.RateLimitError, openai.error.ServiceUnavailableError))
+
+
+class _ModelState:
+    def __init__(self, limit: float):
+        self.limit = limit
+        self.in_flight = 0
+        self.baseline_latency: Optional[float] = None
+        self.last_decrease = float('-inf')
+        self.cond = threading.Condition()
+
+
+class AdaptiveLimiter:
+    """
+    Adaptive concurrency limit (AIMD), with a separate limit per model.
+
+    While requests succeed with healthy latency, the limit grows by `increase` per limit-worth of completed
+    requests (i.e. about `increase` per round trip). On a rate limit error or a latency spike, the limit is
+    multiplied by `decrease`, at most once per `cooldown` seconds, so a burst of failures from requests that
+    were already in flight only counts once.
+
+    A latency spike is a latency above `latency_threshold` seconds if provided, otherwise above
+    `latency_factor` times the moving average of latency. Spikes count in the moving average with the smaller
+    weight `spike_weight`, so the average follows a lasting latency increase and the limit can grow again.
+
+    Metrics (labeled by `model`):
+        * adaptive_limit: current concurrency limit.
+        * adaptive_in_flight: requests in flight.
+        * adaptive_decrease: number of times the limit was decreased.
+    """
+
+    def __init__(
+            self,
+            initial_limit: int = 4,
+            min_limit: int = 1,
+            max_limit: int = 256,
+            increase: float = 1.0,
+            decrease: float = 0.5,
+            latency_threshold: Optional[float] = None,
+            latency_factor: float = 3.0,
+            spike_weight: float = 0.02,
+            cooldown: float = 1.0,
+            metrics: Optional[MetricsRegistry] = None,
+    ):
+        """
+
+        :param initial_limit: initial concurrency limit of every model.
+        :param min_limit: the limit never goes below this value.
+        :param max_limit: the limit never goes above this value.
+        :param increase: additive increase per round trip.
+        :param decrease: multiplicative decrease factor, between 0 and 1.
+        :param latency_threshold: latency in seconds above which the request is considered a latency spike.
+        :param latency_factor: if `latency_threshold` is not provided, a latency above this factor times the
+                               moving average is considered a latency spike.
+        :param spike_weight: weight of a latency spike in the moving average, 0 to ignore spikes.
+        :param cooldown: min number of seconds between two decreases.
+        :param metrics: metrics registry, default to `slambda.metrics.metrics`.
+        """
+        if not (1 <= min_limit <= initial_limit <= max_limit):
+            raise ValueError('limits must satisfy 1 <= min_limit <= initial_limit <= max_limit')
+        if not (0 < decrease < 1):
+            raise ValueError('decrease must be between 0 and 1')
+        self.initial_limit = initial_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_threshold = latency_threshold
+        self.latency_factor = latency_factor
+        self.spike_weight = spike_weight
+        self.cooldown = cooldown
+        self.metrics = metrics if metrics is not None else default_metrics
+
+        self._lock = threading.Lock()
+        self._states: Dict[str, _ModelState] = {}
+
+    def _state(self, model: str) -> _ModelState:
+        with self._lock:
+            state = self._states.get(model)
+            if state is None:
+                state = _ModelState(float(self.initial_limit))
+                self._states[model] = state
+                self.metrics.set('adaptive_limit', self.initial_limit, model=model)
+            return state
+
+    def limit(self, model: str) -> int:
+        """
+        Current concurrency limit of `model`.
+        """
+        return int(self._state(model).limit)
+
+    def acquire(self, model: str, timeout: Optional[float] = None):
+        """
+        Wait until the number of requests in flight for `model` is below its limit.
+        :raise TimeoutError: if no slot was available before timeout.
+        """
+        state = self._state(model)
+        with state.cond:
+            if not state.cond.wait_for(lambda: state.in_flight < int(state.limit), timeout):
+                raise TimeoutError(f'concurrency limit of {model} not available within {timeout} seconds')
+            state.in_flight += 1
+            self.metrics.set('adaptive_in_flight', state.in_flight, model=model)
+
+    def release(self, model: str, latency: float, error: Optional[BaseException] = None):
+        """
+        Release a slot, and adjust the limit based on the outcome of the request.
+        :param model: model name.
+        :param latency: request latency in seconds.
+        :param error: the exception raised by the request, if any.
+        """
+        state = self._state(model)
+        with state.cond:
+            state.in_flight -= 1
+            if error is not None:
+                if is_rate_limit_error(error):
+                    self._decrease(model, state)
+            elif self._is_spike(state, latency):
+                self._decrease(model, state)
+                if state.baseline_latency is not None:
+                    state.baseline_latency = \
+                        (1 - self.spike_weight) * state.baseline_latency + self.spike_weight * latency
+            else:
+                if state.baseline_latency is None:
+                    state.baseline_latency = latency
+                else:
+                    state.baseline_latency = 0.9 * state.baseline_latency + 0.1 * latency
+                state.limit = min(float(self.max_limit), state.limit + self.increase / state.limit)
+            self.metrics.set('adaptive_limit', int(state.limit), model=model)
+            self.metrics.set('adaptive_in_flight', state.in_flight, model=model)
+            state.cond.notify_all()
+
+    def _is_spike(self, state: _ModelState, latency: float) -> bool:
+        if self.latency_threshold is not None:
+            return latency > self.latency_threshold
+        return state.baseline_latency is not None and latency > self.latency_factor * state.baseline_latency
+
+    def _decrease(self, model: str, state: _ModelState):
+        now = time.monotonic()
+        if now - state.last_decrease < self.cooldown:
+            return
+        state.last_decrease = now
+        state.limit = max(float(self.min_limit), state.limit * self.decrease)
+        self.metrics.inc('adaptive_decrease', model=model)
+
+    @contextmanager
+    def slot(self, model: str, timeout: Optional[float] = None):
+        """
+        Hold a slot for the duration of the with block, its latency and error adjust the limit.
+        """
+        self.acquire(model, timeout)
+        start = time.monotonic()
+        try:
+            yield
+        except BaseException as e:
+            self.release(model, time.monotonic() - start, e)
+            raise
+        self.release(model, time.monotonic() - start)
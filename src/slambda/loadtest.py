@@ -0,0 +1,212 @@
+"""
+Drive a LmFunction at a target request rate or concurrency, and report throughput, latency and errors.
+
+Usage:
+    python -m slambda.loadtest slambda.contrib.sentiment:sentiment --input "I love it" --rps 50 --duration 10
+    python -m slambda.loadtest mymodule:fn --input-file inputs.jsonl --input-field text --concurrency 16 --standin
+
+With `--standin`, a local `slambda.standin` server is started and used as the API.
+"""
+import argparse
+import itertools
+import math
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterable, List, Optional
+
+import openai
+
+from .batch import call_with_input
+from .discovery import resolve_function
+from .files import read_records, record_to_input
+from .standin import StandinServer, add_config_arguments, config_from_arguments
+
+
+def percentile(values: List[float], p: float) -> float:
+    """
+    Nearest-rank percentile of sorted values.
+    """
+    if len(values) == 0:
+        return 0.0
+    rank = max(1, math.ceil(p / 100 * len(values)))
+    return values[min(rank, len(values)) - 1]
+
+
+@dataclass
+class LoadReport:
+    """
+    Result of a load test.
+
+    Args:
+        elapsed: duration of the test in seconds.
+        latencies: latency of successful calls, in seconds.
+        errors: number of failed calls by exception type.
+    """
+    elapsed: float = 0.0
+    latencies: List[float] = field(default_factory=list)
+    errors: Counter = field(default_factory=Counter)
+
+    @property
+    def requests(self) -> int:
+        return len(self.latencies) + sum(self.errors.values())
+
+    @property
+    def throughput(self) -> float:
+        """
+        Successful calls per second.
+        """
+        return len(self.latencies) / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def error_rate(self) -> float:
+        return sum(self.errors.values()) / self.requests if self.requests > 0 else 0.0
+
+    def latency(self, p: float) -> float:
+        return percentile(sorted(self.latencies), p)
+
+    def summary(self) -> str:
+        lines = [
+            f'requests: {self.requests} in {self.elapsed:.2f}s, throughput: {self.throughput:.1f}/s, '
+            f'error rate: {self.error_rate:.2%}',
+            'latency: ' + ', '.join(f'p{p}={self.latency(p) * 1000:.0f}ms' for p in (50, 90, 99)) +
+            f', max={max(self.latencies, default=0) * 1000:.0f}ms',
+        ]
+        for name, count in self.errors.most_common():
+            lines.append(f'  {name}: {count}')
+        return '\n'.join(lines)
+
+
+def run_load(
+        fn: Callable,
+        inputs: Iterable[Any],
+        concurrency: Optional[int] = None,
+        rps: Optional[float] = None,
+        duration: float = 10.0,
+        max_requests: Optional[int] = None,
+        max_workers: int = 256,
+        **ctrl_kws
+) -> LoadReport:
+    """
+    Call `fn` repeatedly for `duration` seconds or `max_requests` calls.
+
+    * concurrency: closed loop, each of `concurrency` workers sends the next call as soon as the previous one is done.
+    * rps: open loop, calls start at a fixed rate regardless of how long they take (up to `max_workers` in flight),
+      so queueing delays show up in latency, which is measured from the time a call is scheduled to start.
+
+    :param fn: the function.
+    :param inputs: function inputs, cycled through.
+    :param concurrency: number of workers of the closed loop.
+    :param rps: target request rate of the open loop.
+    :param duration: max duration of the test in seconds.
+    :param max_requests: max number of calls.
+    :param max_workers: max number of calls in flight of the open loop.
+    :param ctrl_kws: reserved keywords passed to every call, e.g. `__override`.
+    """
+    if (concurrency is None) == (rps is None):
+        raise ValueError('exactly one of concurrency and rps must be provided')
+    inputs = list(inputs)
+    if len(inputs) == 0:
+        raise ValueError('no inputs')
+
+    report = LoadReport()
+    lock = threading.Lock()
+    source = itertools.cycle(inputs)
+    sent = itertools.count()
+    start = time.monotonic()
+    end = start + duration
+
+    def next_input():
+        with lock:
+            if max_requests is not None and next(sent) >= max_requests:
+                return None, False
+            return next(source), True
+
+    def call(fn_input, scheduled: Optional[float] = None):
+        # latency of the open loop counts from the scheduled start, so time spent waiting for a worker shows up.
+        t = time.monotonic() if scheduled is None else scheduled
+        try:
+            call_with_input(fn, fn_input, **ctrl_kws)
+        except Exception as e:
+            with lock:
+                report.errors[type(e).__name__] += 1
+        else:
+            with lock:
+                report.latencies.append(time.monotonic() - t)
+
+    if concurrency is not None:
+        def worker():
+            while time.monotonic() < end:
+                fn_input, ok = next_input()
+                if not ok:
+                    return
+                call(fn_input)
+
+        threads = [threading.Thread(target=worker, name=f'slambda-load-{i}') for i in range(concurrency)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='slambda-load') as executor:
+            for i in itertools.count():
+                scheduled = start + i / rps
+                if scheduled >= end:
+                    break
+                fn_input, ok = next_input()
+                if not ok:
+                    break
+                delay = scheduled - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                executor.submit(call, fn_input, scheduled)
+
+    report.elapsed = time.monotonic() - start
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m slambda.loadtest', description='load test a LmFunction')
+    parser.add_argument('function', help='function reference, e.g. slambda.contrib.sentiment:sentiment')
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument('--concurrency', type=int, help='number of concurrent workers (closed loop)')
+    mode.add_argument('--rps', type=float, help='target requests per second (open loop)')
+    parser.add_argument('--duration', type=float, default=10.0, help='test duration in seconds')
+    parser.add_argument('--requests', type=int, default=None, help='max number of requests')
+    parser.add_argument('--input', action='append', default=[], help='function input, can be repeated')
+    parser.add_argument('--input-file', default=None, help='read inputs from a jsonl/csv/text file')
+    parser.add_argument('--input-field', default=None, help='record field used as function input')
+    parser.add_argument('--api-base', default=None, help='send requests to this API base url')
+    parser.add_argument('--standin', action='store_true', help='start a local stand-in server and use it')
+    add_config_arguments(parser, prefix='standin-')
+    args = parser.parse_args(argv)
+
+    fn = resolve_function(args.function)
+    inputs: List[Any] = list(args.input)
+    if args.input_file is not None:
+        inputs.extend(record_to_input(fn, r, args.input_field) for r in read_records(args.input_file))
+    if len(inputs) == 0:
+        inputs = [fn.definition.default_args]
+
+    server = None
+    if args.standin:
+        server = StandinServer(config=config_from_arguments(args, prefix='standin-')).start()
+        openai.api_base = server.url
+        openai.api_key = openai.api_key or 'standin'
+    elif args.api_base is not None:
+        openai.api_base = args.api_base
+
+    try:
+        report = run_load(fn, inputs, concurrency=args.concurrency, rps=args.rps, duration=args.duration,
+                          max_requests=args.requests)
+    finally:
+        if server is not None:
+            server.stop()
+    print(report.summary())
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+import threading
+from typing import Dict, Tuple
+
+MetricKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def _key(name: str, labels: Dict[str, object]) -> MetricKey:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class MetricsRegistry:
+    """
+    A small in-process metrics registry for counters and gauges.
+
+    Counters only go up (e.g. number of hedged requests), gauges hold the latest observed value
+    (e.g. current concurrency limit). Every metric is identified by a name and an optional set of labels.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[MetricKey, float] = {}
+        self._gauges: Dict[MetricKey, float] = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """
+        Increase counter `name` by `value`.
+        """
+        k = _key(name, labels)
+        with self._lock:
+            self._counters[k] = self._counters.get(k, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        """
+        Set gauge `name` to `value`.
+        """
+        k = _key(name, labels)
+        with self._lock:
+            self._gauges[k] = value
+
+    def get(self, name: str, **labels) -> float:
+        """
+        Read the current value of a counter or gauge, 0 if it was never recorded.
+        """
+        k = _key(name, labels)
+        with self._lock:
+            if k in self._counters:
+                return self._counters[k]
+            return self._gauges.get(k, 0)
+
+    def snapshot(self) -> Dict[str, list]:
+        """
+        Return all metrics as a json serializable dict.
+        """
+        with self._lock:
+            return {
+                'counters': [dict(name=n, labels=dict(ls), value=v) for (n, ls), v in self._counters.items()],
+                'gauges': [dict(name=n, labels=dict(ls), value=v) for (n, ls), v in self._gauges.items()],
+            }
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+
+
+metrics = MetricsRegistry()
+"""
+Default registry used by all slambda components.
+"""
@@ -0,0 +1,293 @@
+import asyncio
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from .batch import run_batch
+from .cache import request_fingerprint
+from .codec import get_codec
+from .core import Definition, FunctionInputConfig, FunctionOutputConfig, LmFunction, LmOutputCastingError
+from .fusion import _cast_value, _render_task, is_fusable
+from .gpt import Message
+from .metrics import metrics
+from .warmup import completion_response
+
+PACKED_CACHE_PREFIX = 'packed:'
+"""
+Prefix of the cache keys of answers from packed requests, they are not the response of the single request.
+"""
+
+PACKED_INSTRUCTION = 'Complete the task below on every input of the given json object, separately. Answer with ' \
+                     'a single json object with the same keys, its values are the answers of the inputs.'
+
+
+@dataclass
+class _Call:
+    text: str
+    ctrl_kws: Dict[str, Any]
+    request_args: Dict[str, Any]
+    future: Future = field(default_factory=Future)
+    added: float = field(default_factory=time.monotonic)
+
+
+def is_batchable(ctrl_kws: Dict[str, Any]) -> bool:
+    """
+    True if a call with these reserved keywords returns a single output that can be answered by a packed request.
+    """
+    if ctrl_kws.get('__extra_messages') or ctrl_kws.get('__return_resp_obj'):
+        return False
+    override = ctrl_kws.get('__override') or {}
+    return not override.get('stream') and override.get('n') in (None, 1)
+
+
+class MicroBatcher:
+    """
+    Collect concurrent calls of a unary function and answer them together.
+
+    The first call of a batch waits at most `max_wait` seconds for up to `max_batch_size` calls. A batch is then
+    dispatched as one cache lookup for every call, and one packed request asking for the answers of the cache
+    misses as a json object keyed by input index. Answers of the packed request are cast according to the output
+    config of the function and stored in its cache under keys prefixed with `PACKED_CACHE_PREFIX`, so they are
+    only served to batched calls. Calls whose answer is missing or invalid (or every call, if the packed output is
+    not a json object) are sent separately as a fallback. Upstream errors of the packed request are raised by
+    every call of the batch rather than sending them separately. Calls with different `__override` are batched
+    separately, and calls that cannot be packed (streams, n > 1, extra messages) are sent directly. Usage of the
+    packed requests is accounted to `fn`.
+
+    Metrics:
+        * microbatch_batches: number of dispatched batches, labeled by `function`.
+        * microbatch_calls: number of batched calls, labeled by `function`.
+        * microbatch_packed: number of packed requests, labeled by `function`.
+        * microbatch_fallback: number of fallback calls, labeled by `function`.
+
+    Example:
+        batcher = MicroBatcher(sentiment, max_batch_size=16, max_wait=0.005)
+        batcher('I love it')
+    """
+
+    def __init__(
+            self,
+            fn: LmFunction,
+            max_batch_size: int = 16,
+            max_wait: float = 0.005,
+            max_workers: int = 8,
+            fallback: bool = True,
+            **components
+    ):
+        """
+
+        :param fn: a unary function.
+        :param max_batch_size: max number of calls in a batch.
+        :param max_wait: max latency added to a call by waiting for its batch, in seconds.
+        :param max_workers: max number of batches dispatched concurrently.
+        :param fallback: if False, calls that cannot be answered by the packed request are errors.
+        :param components: keyword arguments of the packed `LmFunction`, e.g. `scheduler`, `limiter`,
+                           default to the components of `fn`.
+        """
+        if not is_fusable(fn):
+            raise ValueError(f'{fn.key} is not a unary function and cannot be batched')
+        if max_batch_size < 1:
+            raise ValueError('max_batch_size must be at least 1')
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.fallback = fallback
+        for name in ('hedging', 'scheduler', 'priority', 'limiter', 'circuit_breaker', 'transport', 'budget'):
+            components.setdefault(name, getattr(fn, name))
+        self.packed_fn = LmFunction(self._create_definition(), **components)
+        self.packed_fn.usage_key = fn.key
+        self._codec = get_codec()
+        self._queue: queue.Queue = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='slambda-microbatch')
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._closed = False
+
+    @property
+    def definition(self) -> Definition:
+        return self.fn.definition
+
+    @property
+    def key(self) -> str:
+        return self.fn.key
+
+    def _create_definition(self) -> Definition:
+        instruction = f'{PACKED_INSTRUCTION}\n\n{_render_task(self.fn.key, self.fn)}'
+        return Definition(
+            name=f'{self.fn.definition.name or self.fn.key}[packed]',
+            instruction=instruction,
+            examples=[],
+            message_stack=[Message.system(instruction)],
+            input_config=FunctionInputConfig.unary(False),
+            output_config=FunctionOutputConfig(cast_to_json=True),
+            gpt_opts=self.fn.definition.gpt_opts.model_copy(),
+        )
+
+    def submit(self, text: str, **ctrl_kws) -> Future:
+        """
+        Add a call to the next batch.
+        :return: a future of the output of the call.
+        """
+        if not is_batchable(ctrl_kws):
+            return self._executor.submit(self.fn, text, **ctrl_kws)
+        try:
+            # invalid inputs fail on their own instead of failing the batch they would join.
+            call = _Call(text, ctrl_kws, self.fn.request_args(text, **ctrl_kws))
+        except ValueError as e:
+            future = Future()
+            future.set_exception(e)
+            return future
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('the batcher is closed')
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._collect, name='slambda-microbatch', daemon=True)
+                self._thread.start()
+            self._queue.put(call)
+        return call.future
+
+    def __call__(self, text: str, **ctrl_kws):
+        return self.submit(text, **ctrl_kws).result()
+
+    async def acall(self, text: str, **ctrl_kws):
+        return await asyncio.wrap_future(self.submit(text, **ctrl_kws))
+
+    def close(self):
+        """
+        Dispatch pending calls and stop the batcher.
+        """
+        with self._lock:
+            self._closed = True
+            thread = self._thread
+            self._queue.put(None)
+        if thread is not None:
+            thread.join()
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _collect(self):
+        stopping = False
+        while not stopping:
+            call = self._queue.get()
+            if call is None:
+                return
+            batch = [call]
+            while len(batch) < self.max_batch_size:
+                remaining = call.added + self.max_wait - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            groups: Dict[str, List[_Call]] = {}
+            for item in batch:
+                override = item.ctrl_kws.get('__override') or {}
+                groups.setdefault(json.dumps(override, sort_keys=True, default=str), []).append(item)
+            for group in groups.values():
+                self._executor.submit(self._dispatch, group)
+
+    def _dispatch(self, batch: List[_Call]):
+        metrics.inc('microbatch_batches', function=self.key)
+        metrics.inc('microbatch_calls', len(batch), function=self.key)
+        try:
+            misses = self._lookup(batch)
+            if len(misses) == 1:
+                self._send(misses)
+            elif len(misses) > 1:
+                self._pack(misses)
+        except Exception as e:
+            for call in batch:
+                if not call.future.done():
+                    call.future.set_exception(e)
+
+    def _lookup(self, batch: List[_Call]) -> List[_Call]:
+        """
+        Resolve calls whose response is cached, in one cache lookup.
+        :return: calls that are not resolved.
+        """
+        cache = self.fn.cache
+        if cache is None:
+            return batch
+        keys = [request_fingerprint(c.request_args) for c in batch]
+        cached = cache.get_many(keys + [PACKED_CACHE_PREFIX + k for k in keys])
+        misses = []
+        for call, key in zip(batch, keys):
+            resp = cached.get(key) or cached.get(PACKED_CACHE_PREFIX + key)
+            if resp is None:
+                misses.append(call)
+                continue
+            try:
+                call.future.set_result(self.fn._cast_resp(resp, None))
+                metrics.inc('cache_hit', function=self.key)
+            except LmOutputCastingError:
+                misses.append(call)
+        return misses
+
+    def _send(self, batch: List[_Call]):
+        """
+        Send calls separately and concurrently.
+        """
+        for item in run_batch(lambda call: self.fn(call.text, **call.ctrl_kws), batch, concurrency=len(batch)):
+            if item.error is not None:
+                item.input.future.set_exception(item.error)
+            else:
+                item.input.future.set_result(item.output)
+
+    def _pack(self, batch: List[_Call]):
+        ctrl_kws = batch[0].ctrl_kws
+        override = dict(ctrl_kws.get('__override') or {})
+        max_tokens = override.get('max_tokens', self.fn.definition.gpt_opts.max_tokens)
+        if max_tokens is not None:
+            override['max_tokens'] = max_tokens * len(batch)
+        packed_input = self._codec.render({str(i): call.text for i, call in enumerate(batch)})
+
+        metrics.inc('microbatch_packed', function=self.key)
+        try:
+            packed = self.packed_fn(packed_input, __override=override)
+            error = None if isinstance(packed, dict) else \
+                LmOutputCastingError(llm_output=packed, message='packed output is not a json object')
+        except LmOutputCastingError as e:
+            packed = None
+            error = e
+
+        output_config = self.fn.definition.output_config
+        answered = []
+        separate = []
+        for i, call in enumerate(batch):
+            try:
+                if error is not None:
+                    raise error
+                if str(i) not in packed:
+                    raise KeyError(f'input {i} is missing in packed output')
+                output = _cast_value(output_config, packed[str(i)])
+            except Exception as e:
+                if self.fallback:
+                    separate.append(call)
+                else:
+                    call.future.set_exception(e)
+                continue
+            call.future.set_result(output)
+            answered.append((call, output))
+
+        if self.fn.cache is not None and answered:
+            self.fn.cache.set_many(
+                (PACKED_CACHE_PREFIX + request_fingerprint(call.request_args),
+                 completion_response(self.fn, output))
+                for call, output in answered
+            )
+        if separate:
+            metrics.inc('microbatch_fallback', len(separate), function=self.key)
+            self._send(separate)
@@ -0,0 +1,286 @@
+import queue
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+from .batch import call_with_input
+
+INPUT = 'input'
+"""
+Name of the pipeline input in stage references.
+"""
+
+_STOP = object()
+
+
+@dataclass
+class PipelineItem:
+    """
+    Result of one input in a pipeline.
+
+    Args:
+        index: position of the input.
+        input: the input value.
+        outputs: output of every stage that succeeded, by stage name.
+        errors: the exception raised by every stage that failed, by stage name.
+        skipped: stages that did not run because an upstream stage failed.
+    """
+    index: int
+    input: Any
+    outputs: Dict[str, Any] = field(default_factory=dict)
+    errors: Dict[str, BaseException] = field(default_factory=dict)
+    skipped: List[str] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return len(self.errors) == 0 and len(self.skipped) == 0
+
+
+class _ItemState:
+    __slots__ = ('item', 'pending', 'remaining')
+
+    def __init__(self, item: PipelineItem, pending: Dict[str, int], remaining: int):
+        self.item = item
+        self.pending = pending
+        self.remaining = remaining
+
+
+def _resolve(ref: str, values: Dict[str, Any]):
+    """
+    Resolve `stage` or `stage.field` against stage outputs.
+    """
+    name, _, key = ref.partition('.')
+    value = values[name]
+    if key:
+        if not isinstance(value, dict) or key not in value:
+            raise KeyError(f'{name} output has no field {key}')
+        value = value[key]
+    return value
+
+
+@dataclass
+class Stage:
+    """
+    A function in a pipeline.
+
+    Args:
+        name: stage name, used to reference its output.
+        fn: the function, usually a LmFunction.
+        source: the input of this stage is the output of this reference, dict outputs are passed as keyword
+                arguments and other values as the positional argument.
+        kwargs: keyword arguments of this stage, mapping from argument name to reference.
+        concurrency: number of concurrent calls of this stage.
+        queue_size: number of items waiting for this stage before upstream stages are blocked.
+        ctrl_kws: reserved keywords passed to every call, e.g. `__override`.
+
+    A reference is `input`, a stage name, or `name.field` to take a field of a json output.
+    """
+    name: str
+    fn: Callable
+    source: Optional[str] = None
+    kwargs: Optional[Dict[str, str]] = None
+    concurrency: int = 4
+    queue_size: int = 16
+    ctrl_kws: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def dependencies(self) -> List[str]:
+        refs = list(self.kwargs.values()) if self.kwargs is not None else [self.source]
+        deps = []
+        for ref in refs:
+            name = ref.partition('.')[0]
+            if name not in deps:
+                deps.append(name)
+        return deps
+
+    def call(self, values: Dict[str, Any]):
+        if self.kwargs is not None:
+            fn_input = {k: _resolve(ref, values) for k, ref in self.kwargs.items()}
+        else:
+            fn_input = _resolve(self.source, values)
+        return call_with_input(self.fn, fn_input, **self.ctrl_kws)
+
+
+class Pipeline:
+    """
+    A DAG of functions, where the output of a stage is the input of its downstream stages.
+
+    Every stage has its own workers, and an item is sent to a stage as soon as all its upstream stages are done
+    for that item, so stages overlap and the latency of an item is the latency of its slowest path.
+    Stage queues are bounded, a slow stage blocks its upstream stages instead of buffering every input.
+
+    Example:
+        pipe = Pipeline()
+        pipe.add('summary', summarize)
+        pipe.add('sentiment', sentiment, source='summary')
+        pipe.add('links', extract_wiki_links, source='summary')
+        for item in pipe.run(documents):
+            print(item.outputs['sentiment'], item.outputs['links'])
+    """
+
+    def __init__(self):
+        self.stages: Dict[str, Stage] = {}
+
+    def add(
+            self,
+            name: str,
+            fn: Callable,
+            source: Optional[str] = None,
+            kwargs: Optional[Dict[str, str]] = None,
+            concurrency: int = 4,
+            queue_size: int = 16,
+            **ctrl_kws
+    ) -> 'Pipeline':
+        """
+        Add a stage, see `Stage`. Stages can only reference the input and stages added before them.
+        If neither `source` nor `kwargs` is provided, the stage reads the pipeline input.
+        :return: this pipeline, so calls can be chained.
+        """
+        if name == INPUT or '.' in name:
+            raise ValueError(f'invalid stage name {name}')
+        if name in self.stages:
+            raise ValueError(f'stage {name} already exists')
+        if source is not None and kwargs is not None:
+            raise ValueError('source and kwargs cannot be used together')
+        if concurrency < 1:
+            raise ValueError('concurrency must be at least 1')
+        if source is None and kwargs is None:
+            source = INPUT
+        stage = Stage(name=name, fn=fn, source=source, kwargs=kwargs, concurrency=concurrency,
+                      queue_size=queue_size, ctrl_kws=ctrl_kws)
+        for dep in stage.dependencies:
+            if dep != INPUT and dep not in self.stages:
+                raise ValueError(f'stage {name} references unknown stage {dep}')
+        self.stages[name] = stage
+        return self
+
+    def __call__(self, fn_input) -> PipelineItem:
+        """
+        Run the pipeline on a single input.
+        """
+        return next(self.run([fn_input]))
+
+    def run(self, inputs: Iterable, max_pending: int = 64, ordered: bool = True) -> Iterator[PipelineItem]:
+        """
+        Run the pipeline on every input.
+
+        :param inputs: an iterable of inputs, consumed lazily.
+        :param max_pending: max number of inputs in the pipeline or waiting to be yielded.
+        :param ordered: if True, items are yielded in input order, otherwise as soon as they are done.
+        :return: iterator of `PipelineItem`.
+        """
+        if len(self.stages) == 0:
+            raise ValueError('pipeline has no stages')
+        return self._run(list(self.stages.values()), inputs, max_pending, ordered)
+
+    @staticmethod
+    def _run(stages: List[Stage], inputs: Iterable, max_pending: int, ordered: bool) -> Iterator[PipelineItem]:
+        downstream: Dict[str, List[Stage]] = {INPUT: [], **{s.name: [] for s in stages}}
+        for s in stages:
+            for dep in s.dependencies:
+                downstream[dep].append(s)
+
+        queues = {s.name: queue.Queue(maxsize=s.queue_size) for s in stages}
+        results = queue.Queue()
+        window = threading.Semaphore(max_pending)
+        closed = threading.Event()
+        lock = threading.Lock()
+
+        def put(q: queue.Queue, state: _ItemState):
+            # blocks while the queue is full, unless the pipeline is closed and the queue is no longer consumed.
+            while not closed.is_set():
+                try:
+                    q.put(state, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+
+        def finish(state: _ItemState, name: str):
+            ready = []
+            with lock:
+                if name != INPUT:
+                    state.remaining -= 1
+                for s in downstream[name]:
+                    state.pending[s.name] -= 1
+                    if state.pending[s.name] == 0:
+                        ready.append(s)
+                done = state.remaining == 0
+            for s in ready:
+                if any(dep != INPUT and dep not in state.item.outputs for dep in s.dependencies):
+                    state.item.skipped.append(s.name)
+                    finish(state, s.name)
+                else:
+                    put(queues[s.name], state)
+            if done:
+                results.put(state.item)
+
+        def work(stage: Stage):
+            q = queues[stage.name]
+            while True:
+                state = q.get()
+                if state is _STOP:
+                    return
+                if closed.is_set():
+                    continue
+                item = state.item
+                try:
+                    item.outputs[stage.name] = stage.call({INPUT: item.input, **item.outputs})
+                except Exception as e:
+                    item.errors[stage.name] = e
+                finish(state, stage.name)
+
+        def feed():
+            count = 0
+            try:
+                for index, value in enumerate(inputs):
+                    window.acquire()
+                    if closed.is_set():
+                        return
+                    state = _ItemState(
+                        PipelineItem(index=index, input=value),
+                        pending={s.name: len(s.dependencies) for s in stages},
+                        remaining=len(stages),
+                    )
+                    count += 1
+                    finish(state, INPUT)
+            except Exception as e:
+                results.put(('error', e))
+                return
+            results.put(('done', count))
+
+        threads = [threading.Thread(target=feed, name='slambda-pipeline-feed', daemon=True)]
+        for s in stages:
+            for i in range(s.concurrency):
+                threads.append(threading.Thread(target=work, args=(s,), name=f'slambda-pipeline-{s.name}-{i}',
+                                                daemon=True))
+        for t in threads:
+            t.start()
+
+        try:
+            total = None
+            yielded = 0
+            buffer: Dict[int, PipelineItem] = {}
+            while total is None or yielded < total:
+                ret = results.get()
+                if isinstance(ret, tuple):
+                    if ret[0] == 'error':
+                        raise ret[1]
+                    total = ret[1]
+                    continue
+                if not ordered:
+                    yielded += 1
+                    window.release()
+                    yield ret
+                    continue
+                buffer[ret.index] = ret
+                while yielded in buffer:
+                    item = buffer.pop(yielded)
+                    yielded += 1
+                    window.release()
+                    yield item
+        finally:
+            closed.set()
+            window.release(max_pending)
+            for s in stages:
+                for _ in range(s.concurrency):
+                    queues[s.name].put(_STOP)
@@ -0,0 +1,74 @@
+import threading
+from typing import Dict, Iterator, List, Optional, Union
+
+from .core import Definition, LmFunction
+
+
+class FunctionRegistry:
+    """
+    Store a large number of functions by name, e.g. one function per customer.
+
+    Definitions are stored compactly (see `Definition.to_compact`), `LmFunction` objects are only created when a
+    function is looked up, and they share the runtime components (scheduler, limiter, cache...) of the registry.
+    """
+
+    def __init__(self, compact: bool = True, **components):
+        """
+
+        :param compact: if True, definitions are converted with `Definition.to_compact` when they are added.
+        :param components: keyword arguments passed to `LmFunction` when a function is looked up,
+                           e.g. `scheduler`, `limiter`, `circuit_breaker`, `cache`.
+        """
+        self.compact = compact
+        self.components = components
+        self._lock = threading.Lock()
+        self._definitions: Dict[str, Definition] = {}
+
+    def add(self, fn: Union[LmFunction, Definition], name: Optional[str] = None) -> str:
+        """
+        Add a function, a function with the same name is replaced.
+        :param fn: function or definition.
+        :param name: name of the function, default to the definition name. It becomes the definition name, so
+                     the function is keyed by it in metrics, usage and scheduling.
+        :return: name of the function.
+        """
+        definition = fn.definition if isinstance(fn, LmFunction) else fn
+        if name is None:
+            name = definition.name
+        if name is None:
+            raise ValueError('function name is required')
+        if self.compact and not definition.compact:
+            definition = definition.to_compact()
+        if definition.name != name:
+            definition = definition.model_copy(update={'name': name})
+        with self._lock:
+            self._definitions[name] = definition
+        return name
+
+    def get(self, name: str) -> LmFunction:
+        """
+        :raise KeyError: if there is no function with this name.
+        """
+        return LmFunction(self._definitions[name], **self.components)
+
+    def definition(self, name: str) -> Definition:
+        return self._definitions[name]
+
+    def remove(self, name: str):
+        with self._lock:
+            self._definitions.pop(name, None)
+
+    def names(self) -> List[str]:
+        return list(self._definitions.keys())
+
+    def __getitem__(self, name: str) -> LmFunction:
+        return self.get(name)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._definitions
+
+    def __len__(self) -> int:
+        return len(self._definitions)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.names())
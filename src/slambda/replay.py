@@ -0,0 +1,141 @@
+import threading
+import time
+from typing import Dict, List, Optional
+
+import openai
+
+from .cache import TRANSPORT_KEYS, request_fingerprint
+from .codec import get_codec
+from .transport import Transport, openai_transport
+
+
+class ReplayMissError(KeyError):
+    """
+    This exception will be thrown if a request is not in the replay log.
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        super().__init__(f'request {key} is not in the replay log')
+
+
+class Recorder:
+    """
+    A transport that forwards requests to another transport, and appends every request, response and latency
+    to a JSONL log that can be served by `Replayer`.
+
+    Each line is `{"key": ..., "request": ..., "response": ..., "latency": ..., "time": ...}`, where key is the
+    `request_fingerprint` of the request. Transport arguments (api key, timeout...) are not recorded.
+    Failed and streaming requests are forwarded but not recorded.
+    """
+
+    def __init__(self, path: str, transport: Optional[Transport] = None):
+        """
+
+        :param path: log path, new records are appended.
+        :param transport: transport used to send requests, default to `openai_transport`.
+        """
+        self.path = path
+        self.transport = transport if transport is not None else openai_transport
+        self._codec = get_codec()
+        self._lock = threading.Lock()
+        self._fp = open(path, 'a', encoding='utf-8')
+
+    def __call__(self, **call_args):
+        start = time.monotonic()
+        resp = self.transport(**call_args)
+        latency = time.monotonic() - start
+        if not call_args.get('stream', False):
+            self.record(call_args, resp, latency)
+        return resp
+
+    def record(self, call_args: Dict, resp: Dict, latency: float):
+        request = {k: v for k, v in call_args.items() if k not in TRANSPORT_KEYS}
+        line = self._codec.dumps({
+            'key': request_fingerprint(request),
+            'request': request,
+            'response': resp,
+            'latency': latency,
+            'time': time.time(),
+        })
+        with self._lock:
+            self._fp.write(line + '\n')
+            self._fp.flush()
+
+    def close(self):
+        with self._lock:
+            self._fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def read_log(path: str):
+    """
+    Iterate over the records of a log written by `Recorder`, incomplete lines (e.g. a crashed writer) are skipped.
+    """
+    codec = get_codec()
+    with open(path, 'r', encoding='utf-8') as fp:
+        for line in fp:
+            if not line.strip():
+                continue
+            try:
+                yield codec.loads(line)
+            except ValueError:
+                continue
+
+
+class Replayer:
+    """
+    A transport that serves responses from logs written by `Recorder`, without network access.
+
+    Requests are matched by `request_fingerprint`, when a request was recorded several times its responses are
+    served in turn. With `reproduce_latency`, every response is delayed by its recorded latency times
+    `latency_scale`, and `openai.error.Timeout` is raised if it is above the `request_timeout` of the request,
+    so throughput and deadline experiments behave like the recorded traffic.
+    """
+
+    def __init__(self, *paths: str, reproduce_latency: bool = False, latency_scale: float = 1.0):
+        """
+
+        :param paths: log paths.
+        :param reproduce_latency: if True, delay responses by their recorded latency.
+        :param latency_scale: recorded latency is multiplied by this factor.
+        """
+        self.reproduce_latency = reproduce_latency
+        self.latency_scale = latency_scale
+        self._lock = threading.Lock()
+        self._records: Dict[str, List[Dict]] = {}
+        self._next: Dict[str, int] = {}
+        for path in paths:
+            self.load(path)
+
+    def load(self, path: str):
+        for record in read_log(path):
+            self._records.setdefault(record['key'], []).append(record)
+
+    def __len__(self):
+        return sum(len(v) for v in self._records.values())
+
+    def __call__(self, **call_args):
+        if call_args.get('stream', False):
+            raise ValueError('streaming requests cannot be replayed')
+        key = request_fingerprint(call_args)
+        with self._lock:
+            records = self._records.get(key)
+            if not records:
+                raise ReplayMissError(key)
+            i = self._next.get(key, 0)
+            self._next[key] = (i + 1) % len(records)
+        record = records[i]
+        if self.reproduce_latency:
+            latency = record['latency'] * self.latency_scale
+            timeout = call_args.get('request_timeout')
+            if isinstance(timeout, (int, float)) and latency > timeout:
+                time.sleep(timeout)
+                raise openai.error.Timeout('Request timed out')
+            time.sleep(latency)
+        return record['response']
@@ -0,0 +1,313 @@
+import random
+import statistics
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Callable, Iterable, Iterator, List, Optional, Set
+
+from .circuit import is_upstream_failure
+from .metrics import metrics as default_metrics, MetricsRegistry
+from .transport import Transport, get_default_transport
+
+
+class _TrackedStream:
+    """
+    Iterate a streamed response, `on_end` is called once when the stream ends or fails, `on_close` if it is closed
+    (or garbage collected) before.
+    """
+
+    def __init__(self, stream: Iterable, on_end: Callable[[Optional[BaseException]], None],
+                 on_close: Callable[[], None]):
+        self._stream = stream
+        self._iter: Iterator = iter(stream)
+        self._on_end = on_end
+        self._on_close = on_close
+        self._done = False
+        self._lock = threading.Lock()
+
+    def _finish(self) -> bool:
+        with self._lock:
+            done, self._done = self._done, True
+        return not done
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._iter)
+        except StopIteration:
+            if self._finish():
+                self._on_end(None)
+            raise
+        except BaseException as e:
+            if self._finish():
+                self._on_end(e)
+            raise
+
+    def close(self):
+        if hasattr(self._stream, 'close'):
+            self._stream.close()
+        if self._finish():
+            self._on_close()
+
+    def __del__(self):
+        if self._finish():
+            self._on_close()
+
+
+@dataclass
+class Endpoint:
+    """
+    An OpenAI compatible API endpoint.
+
+    Args:
+        api_base: API base url, e.g. `https://api.openai.com/v1`.
+        api_key: API key of this endpoint, default to the key of the request.
+        model: model name on this endpoint, default to the model of the request.
+        name: name of the endpoint in metrics, default to `api_base`.
+    """
+    api_base: str
+    api_key: Optional[str] = None
+    model: Optional[str] = None
+    name: Optional[str] = None
+
+    @property
+    def label(self) -> str:
+        return self.name if self.name is not None else self.api_base
+
+
+class _EndpointState:
+    def __init__(self, endpoint: Endpoint):
+        self.endpoint = endpoint
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.samples = 0
+        self.failures = 0
+        self.in_flight = 0
+        self.ejected_until = 0.0
+
+    def reset(self):
+        self.latency = None
+        self.error_rate = 0.0
+        self.samples = 0
+        self.failures = 0
+
+
+class EndpointRouter:
+    """
+    A transport that routes requests to the fastest healthy endpoint.
+
+    Every endpoint keeps an exponentially weighted moving average of its latency and error rate, its score is
+    `latency * (in_flight + 1) * (1 + error_penalty * error_rate)`, lower is better. Endpoints without
+    measurements are scored with the median latency of the other endpoints, and get at most `max_probes`
+    requests in flight until their first measurement. A request picks two random endpoints and goes to the one with
+    the lower score (power of two choices), which follows the fastest endpoints without sending everything to one
+    of them.
+
+    Outliers are ejected for `eject_time` seconds: endpoints failing `failure_threshold` times in a row, and
+    endpoints whose latency average is above `outlier_factor` times the median of the other endpoints. At most
+    `max_ejected` of the endpoints are ejected at the same time. Ejected endpoints start over with no measurement.
+    A request failing with an upstream error fails over to another endpoint, up to `max_attempts` endpoints. With
+    a `request_timeout`, every attempt gets the time left, and a request fails over only while at least
+    `min_timeout` seconds are left.
+
+    Streamed responses are measured when the stream ends: their latency includes the streamed content, and errors
+    raised while streaming count as failures but do not fail over. Streams closed before their end are not measured.
+
+    Metrics (labeled by `endpoint`):
+        * router_requests: number of requests sent to an endpoint.
+        * router_errors: number of failed requests.
+        * router_ejections: number of ejections, also labeled by `reason` (failures or latency).
+        * router_latency: latency moving average in seconds.
+
+    Example:
+        router = EndpointRouter([Endpoint('https://eu.example.com/v1'), Endpoint('https://us.example.com/v1')])
+        set_default_transport(router)
+    """
+
+    def __init__(
+            self,
+            endpoints: Iterable[Endpoint],
+            transport: Optional[Transport] = None,
+            decay: float = 0.3,
+            error_penalty: float = 10.0,
+            failure_threshold: int = 3,
+            outlier_factor: float = 3.0,
+            min_samples: int = 5,
+            eject_time: float = 30.0,
+            max_ejected: float = 0.5,
+            max_attempts: int = 2,
+            max_probes: int = 1,
+            min_timeout: float = 1.0,
+            seed: Optional[int] = None,
+            metrics: Optional[MetricsRegistry] = None,
+    ):
+        """
+
+        :param endpoints: endpoints serving the same model.
+        :param transport: transport sending the requests, default to the default transport when the router
+                          is created.
+        :param decay: weight of a new measurement in the moving averages, between 0 and 1.
+        :param error_penalty: how much the error rate increases the score.
+        :param failure_threshold: number of consecutive failures that eject an endpoint.
+        :param outlier_factor: an endpoint whose latency is above this factor times the median latency of the other
+                               endpoints is ejected.
+        :param min_samples: number of measurements of an endpoint before it can be ejected for its latency.
+        :param eject_time: seconds an ejected endpoint stays out of the rotation.
+        :param max_ejected: max fraction of endpoints ejected at the same time, at least one endpoint is kept.
+        :param max_attempts: max number of endpoints tried by a request.
+        :param max_probes: max number of requests in flight to an endpoint without measurement.
+        :param min_timeout: min seconds of the request timeout left to fail over to another endpoint.
+        :param seed: random seed of endpoint selection.
+        :param metrics: metrics registry, default to `slambda.metrics.metrics`.
+        """
+        self._states: List[_EndpointState] = [_EndpointState(e) for e in endpoints]
+        if len(self._states) == 0:
+            raise ValueError('at least one endpoint is required')
+        if not (0 < decay <= 1):
+            raise ValueError('decay must be between 0 and 1')
+        self.transport = transport if transport is not None else get_default_transport()
+        self.decay = decay
+        self.error_penalty = error_penalty
+        self.failure_threshold = failure_threshold
+        self.outlier_factor = outlier_factor
+        self.min_samples = min_samples
+        self.eject_time = eject_time
+        self.max_ejected = max_ejected
+        self.max_attempts = max_attempts
+        self.max_probes = max_probes
+        self.min_timeout = min_timeout
+        self.metrics = metrics if metrics is not None else default_metrics
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @property
+    def endpoints(self) -> List[Endpoint]:
+        return [s.endpoint for s in self._states]
+
+    def available(self) -> List[Endpoint]:
+        """
+        Endpoints that are not ejected.
+        """
+        with self._lock:
+            return [s.endpoint for s in self._available(time.monotonic())]
+
+    def _available(self, now: float) -> List[_EndpointState]:
+        ret = []
+        for state in self._states:
+            if 0 < state.ejected_until <= now:
+                state.ejected_until = 0.0
+                state.reset()
+            if state.ejected_until == 0:
+                ret.append(state)
+        return ret
+
+    def _score(self, state: _EndpointState, default_latency: float) -> float:
+        latency = state.latency if state.latency is not None else default_latency
+        return latency * (state.in_flight + 1) * (1 + self.error_penalty * state.error_rate)
+
+    def _pick(self, exclude: Set[_EndpointState]) -> _EndpointState:
+        with self._lock:
+            candidates = [s for s in self._available(time.monotonic()) if s not in exclude]
+            if len(candidates) == 0:
+                # every remaining endpoint is ejected, try them anyway rather than failing.
+                candidates = [s for s in self._states if s not in exclude]
+            # endpoints without measurement are probed by a few requests at a time.
+            candidates = [s for s in candidates if s.latency is not None or s.in_flight < self.max_probes] or \
+                candidates
+            if len(candidates) == 1:
+                chosen = candidates[0]
+            else:
+                measured = [s.latency for s in self._states if s.latency is not None]
+                default_latency = statistics.median(measured) if measured else 1.0
+                a, b = self._random.sample(candidates, 2)
+                chosen = a if self._score(a, default_latency) <= self._score(b, default_latency) else b
+            chosen.in_flight += 1
+            return chosen
+
+    def _eject(self, state: _EndpointState, reason: str, now: float):
+        ejected = sum(1 for s in self._states if s.ejected_until > now)
+        if ejected >= min(int(len(self._states) * self.max_ejected), len(self._states) - 1):
+            return
+        state.ejected_until = now + self.eject_time
+        self.metrics.inc('router_ejections', endpoint=state.endpoint.label, reason=reason)
+
+    def _record(self, state: _EndpointState, latency: float, error: Optional[BaseException]):
+        label = state.endpoint.label
+        with self._lock:
+            state.in_flight -= 1
+            if state.ejected_until > 0:
+                return
+            now = time.monotonic()
+            failed = error is not None and is_upstream_failure(error)
+            state.samples += 1
+            state.error_rate = (1 - self.decay) * state.error_rate + self.decay * (1.0 if failed else 0.0)
+            if failed:
+                self.metrics.inc('router_errors', endpoint=label)
+                state.failures += 1
+                if state.failures >= self.failure_threshold:
+                    self._eject(state, 'failures', now)
+                return
+            state.failures = 0
+            state.latency = latency if state.latency is None else \
+                (1 - self.decay) * state.latency + self.decay * latency
+            self.metrics.set('router_latency', state.latency, endpoint=label)
+            others = [s.latency for s in self._available(now) if s is not state and s.latency is not None]
+            if state.samples >= self.min_samples and others and \
+                    state.latency > self.outlier_factor * statistics.median(others):
+                self._eject(state, 'latency', now)
+
+    def _release(self, state: _EndpointState):
+        with self._lock:
+            state.in_flight -= 1
+
+    def _open_stream(self, state: _EndpointState, args) -> _TrackedStream:
+        start = time.monotonic()
+        with self._track(state, finished=False):
+            stream = self.transport(**args)
+        return _TrackedStream(stream, lambda error: self._record(state, time.monotonic() - start, error),
+                              lambda: self._release(state))
+
+    @contextmanager
+    def _track(self, state: _EndpointState, finished: bool = True):
+        """
+        Record the outcome of a request to an endpoint, if `finished` is False only failures are recorded.
+        """
+        start = time.monotonic()
+        try:
+            yield
+        except BaseException as e:
+            self._record(state, time.monotonic() - start, e)
+            raise
+        if finished:
+            self._record(state, time.monotonic() - start, None)
+
+    def __call__(self, **call_args):
+        request_timeout = call_args.get('request_timeout')
+        start = time.monotonic()
+        tried: Set[_EndpointState] = set()
+        while True:
+            state = self._pick(tried)
+            tried.add(state)
+            endpoint = state.endpoint
+            self.metrics.inc('router_requests', endpoint=endpoint.label)
+            args = dict(call_args, api_base=endpoint.api_base)
+            if endpoint.api_key is not None:
+                args['api_key'] = endpoint.api_key
+            if endpoint.model is not None:
+                args['model'] = endpoint.model
+            if request_timeout is not None:
+                # time spent on previous endpoints is part of the request timeout.
+                args['request_timeout'] = max(request_timeout - (time.monotonic() - start), 0.001)
+            try:
+                if call_args.get('stream'):
+                    return self._open_stream(state, args)
+                with self._track(state):
+                    return self.transport(**args)
+            except Exception as e:
+                if not is_upstream_failure(e) or len(tried) >= min(self.max_attempts, len(self._states)):
+                    raise
+                if request_timeout is not None and request_timeout - (time.monotonic() - start) < self.min_timeout:
+                    raise
@@ -0,0 +1,162 @@
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from enum import Enum
+from typing import Dict, Optional, Union
+
+from .metrics import metrics as default_metrics, MetricsRegistry
+
+
+class Priority(str, Enum):
+    """
+    Priority classes of the scheduler, from the highest to the lowest.
+    """
+    INTERACTIVE = 'interactive'
+    """
+    user facing calls.
+    """
+    DEFAULT = 'default'
+    """
+    calls without an explicit priority.
+    """
+    BATCH = 'batch'
+    """
+    background jobs, e.g. `LmFunction.map`.
+    """
+
+
+class _Ticket:
+    __slots__ = ('priority', 'flow', 'finish', 'seq', 'granted', 'enqueued_at')
+
+    def __init__(self, priority: Priority, flow: str, finish: float, seq: int):
+        self.priority = priority
+        self.flow = flow
+        self.finish = finish
+        self.seq = seq
+        self.granted = False
+        self.enqueued_at = time.monotonic()
+
+
+class Scheduler:
+    """
+    Admission control in front of the ChatCompletion API, shared by any number of functions.
+
+    * At most `max_concurrency` requests are in flight.
+    * Waiting requests of a higher priority class are always admitted first.
+    * Within a class, flows (functions or tenants) share capacity with weighted fair queuing according
+      to `weights` (default weight is 1).
+    * `reservations[priority]` slots can only be used by that class, so e.g. interactive calls never wait
+      behind a large batch job even when the batch job arrived first.
+
+    Metrics (labeled by `priority`):
+        * scheduler_in_flight: requests being executed.
+        * scheduler_queued: requests waiting for a slot.
+        * scheduler_wait_seconds: total time spent waiting for a slot.
+    """
+
+    def __init__(
+            self,
+            max_concurrency: int = 16,
+            reservations: Optional[Dict[Union[Priority, str], int]] = None,
+            weights: Optional[Dict[str, float]] = None,
+            metrics: Optional[MetricsRegistry] = None,
+    ):
+        """
+
+        :param max_concurrency: max number of requests in flight.
+        :param reservations: number of slots reserved per priority class.
+        :param weights: weight per flow for fair queuing within a priority class.
+        :param metrics: metrics registry, default to `slambda.metrics.metrics`.
+        """
+        reservations = {Priority(k): v for k, v in (reservations or {}).items()}
+        if sum(reservations.values()) > max_concurrency:
+            raise ValueError('total reservations exceed max_concurrency')
+        self.max_concurrency = max_concurrency
+        self.reservations = reservations
+        self.weights = weights or {}
+        self.metrics = metrics if metrics is not None else default_metrics
+
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._queues: Dict[Priority, list] = {p: [] for p in Priority}
+        self._in_flight: Dict[Priority, int] = {p: 0 for p in Priority}
+        self._virtual_time: Dict[Priority, float] = {p: 0.0 for p in Priority}
+        self._flow_finish: Dict[Priority, Dict[str, float]] = {p: {} for p in Priority}
+
+    def _admissible(self, priority: Priority) -> bool:
+        idle_reserved = sum(
+            max(0, n - self._in_flight[p]) for p, n in self.reservations.items() if p != priority
+        )
+        return sum(self._in_flight.values()) + idle_reserved < self.max_concurrency
+
+    def _dispatch(self):
+        for priority in Priority:
+            queue = self._queues[priority]
+            while queue and self._admissible(priority):
+                ticket = min(queue, key=lambda t: (t.finish, t.seq))
+                queue.remove(ticket)
+                ticket.granted = True
+                self._in_flight[priority] += 1
+                self._virtual_time[priority] = max(self._virtual_time[priority],
+                                                   ticket.finish - 1 / self.weights.get(ticket.flow, 1.0))
+                self.metrics.inc('scheduler_wait_seconds', time.monotonic() - ticket.enqueued_at,
+                                 priority=priority.value)
+        self._update_gauges()
+
+    def _update_gauges(self):
+        for p in Priority:
+            self.metrics.set('scheduler_in_flight', self._in_flight[p], priority=p.value)
+            self.metrics.set('scheduler_queued', len(self._queues[p]), priority=p.value)
+
+    def acquire(self, priority: Union[Priority, str] = Priority.DEFAULT, flow: str = 'default',
+                timeout: Optional[float] = None) -> Priority:
+        """
+        Wait for a slot.
+        :param priority: priority class.
+        :param flow: the function or tenant this request belongs to.
+        :param timeout: give up after this many seconds.
+        :raise TimeoutError: if no slot was available before timeout.
+        :return: priority class to pass to `release`.
+        """
+        priority = Priority(priority)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            flow_finish = self._flow_finish[priority]
+            start = max(self._virtual_time[priority], flow_finish.get(flow, 0.0))
+            finish = start + 1 / self.weights.get(flow, 1.0)
+            flow_finish[flow] = finish
+            ticket = _Ticket(priority, flow, finish, next(self._seq))
+            self._queues[priority].append(ticket)
+            self._dispatch()
+            self._cond.notify_all()
+            while not ticket.granted:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    self._queues[priority].remove(ticket)
+                    self._update_gauges()
+                    raise TimeoutError(f'no {priority.value} slot available within {timeout} seconds')
+                self._cond.wait(remaining)
+            return priority
+
+    def release(self, priority: Union[Priority, str]):
+        """
+        Release a slot acquired with `acquire`.
+        """
+        priority = Priority(priority)
+        with self._cond:
+            self._in_flight[priority] -= 1
+            self._dispatch()
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, priority: Union[Priority, str] = Priority.DEFAULT, flow: str = 'default',
+             timeout: Optional[float] = None):
+        """
+        Hold a slot for the duration of the with block, see `acquire`.
+        """
+        p = self.acquire(priority, flow, timeout)
+        try:
+            yield
+        finally:
+            self.release(p)
@@ -0,0 +1,492 @@
+"""
+Serve LmFunctions over HTTP, with a single asyncio event loop.
+
+Usage:
+    slambda serve slambda.contrib --port 8080
+
+Endpoints:
+    * GET /health: server status.
+    * GET /metrics: snapshot of `slambda.metrics.metrics`.
+    * GET /functions: served functions and their input types.
+    * POST /functions/{name}: call a function, the body is `{"input": ..., "override": {...}}`, where input is a
+      string for unary functions, an object of keyword arguments for keyword functions, or null, and override
+      only takes the keys of `OVERRIDE_PARAMS`. The response is `{"output": ...}`.
+    * POST /playground/run: run a posted definition and stream its tokens as Server-Sent Events, only if the
+      playground is enabled. See `FunctionServer.run_playground`.
+"""
+import asyncio
+import functools
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from http import HTTPStatus
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from .batch import call_with_input
+from .circuit import CircuitOpenError
+from .codec import get_codec
+from .core import Definition, FunctionInputType, LmFunction, LmOutputCastingError
+from .deadline import DeadlineExceededError
+from .metrics import metrics as default_metrics, MetricsRegistry
+
+MAX_HEADER_COUNT = 100
+
+OVERRIDE_PARAMS = frozenset(['model', 'temperature', 'n', 'top_p', 'stop', 'max_tokens', 'presence_penalty',
+                             'frequency_penalty', 'logit_bias', 'user', 'timeout'])
+"""
+Keys of `__override` a client can send, other slambda options (e.g. priority, tenant, budget) are server side.
+"""
+
+PLAYGROUND = 'playground'
+"""
+Function label of playground runs in server metrics, and name of the definitions they run.
+"""
+
+
+class HttpError(Exception):
+    """
+    An error returned to the client with its status code.
+    """
+
+    def __init__(self, status: int, message: str, headers: Optional[Dict[str, str]] = None):
+        self.status = status
+        self.message = message
+        self.headers = headers or {}
+        super().__init__(message)
+
+
+@dataclass
+class Response:
+    """
+    A response, either a json body or a stream of Server-Sent Events.
+    """
+    status: int = 200
+    body: Any = None
+    headers: Dict[str, str] = field(default_factory=dict)
+    events: Optional[AsyncIterator[str]] = None
+
+
+def validate_input(definition: Definition, fn_input: Any):
+    """
+    Check that `fn_input` is a valid input of a function according to its `FunctionInputConfig`.
+    :raise ValueError: if the input is invalid.
+    """
+    input_config = definition.input_config
+    if input_config.strict_no_args:
+        if fn_input is not None:
+            raise ValueError('this function does not accept input')
+        return
+    if input_config.input_type == FunctionInputType.UNARY and fn_input is not None and \
+            not isinstance(fn_input, str):
+        raise ValueError('input must be a string')
+    if input_config.input_type == FunctionInputType.KEYWORD and fn_input is not None and \
+            not isinstance(fn_input, dict):
+        raise ValueError('input must be an object of keyword arguments')
+    try:
+        Definition.render_input(input_config, fn_input, definition.default_args, definition.required_args,
+                                definition.message_template)
+    except KeyError as e:
+        raise ValueError(f'{e.args[0]} is required but not provided')
+
+
+def error_status(error: BaseException) -> int:
+    """
+    HTTP status of a failed function call.
+    """
+    if isinstance(error, ValueError):
+        return HTTPStatus.BAD_REQUEST
+    if isinstance(error, CircuitOpenError):
+        return HTTPStatus.SERVICE_UNAVAILABLE
+    if isinstance(error, (DeadlineExceededError, TimeoutError)):
+        return HTTPStatus.GATEWAY_TIMEOUT
+    if isinstance(error, LmOutputCastingError):
+        return HTTPStatus.BAD_GATEWAY
+    return HTTPStatus.INTERNAL_SERVER_ERROR
+
+
+def sse_event(event: str, data: Any) -> str:
+    """
+    A Server-Sent Event with a json payload.
+    """
+    return f'event: {event}\ndata: {get_codec().dumps(data)}\n\n'
+
+
+def serve(functions: Dict[str, LmFunction], host: str = '127.0.0.1', port: int = 8080, **kwargs):
+    """
+    Serve functions until interrupted, see `FunctionServer` for keyword arguments.
+    """
+    server = FunctionServer(functions, **kwargs)
+    try:
+        asyncio.run(server.serve_forever(host, port))
+    except KeyboardInterrupt:
+        pass
+
+
+class FunctionServer:
+    """
+    An asyncio HTTP/1.1 server that exposes functions at `/functions/{name}`.
+
+    Requests are parsed on a single event loop and connections are kept alive, function calls run in a shared
+    thread pool. When `max_pending` calls are in flight, new calls are rejected with 503 instead of queueing
+    without bound.
+
+    Metrics:
+        * server_requests: number of requests, labeled by `function` and `status`.
+        * server_shed: number of calls rejected by load shedding, labeled by `function`.
+        * server_pending: number of calls in flight.
+        * playground_definitions: number of posted definitions, labeled by `cached`.
+    """
+
+    def __init__(
+            self,
+            functions: Dict[str, LmFunction],
+            max_pending: int = 64,
+            max_workers: int = 32,
+            max_body_size: int = 1 << 20,
+            metrics: Optional[MetricsRegistry] = None,
+            playground: bool = False,
+            playground_cache_size: int = 256,
+            allow_origin: Optional[str] = None,
+    ):
+        """
+
+        :param functions: functions by endpoint name, LmFunctions or wrappers with a `definition` such as
+                          `slambda.microbatch.MicroBatcher`.
+        :param max_pending: max number of calls in flight, calls above it are rejected with 503.
+        :param max_workers: number of threads running function calls.
+        :param max_body_size: max request body size in bytes.
+        :param metrics: metrics registry, default to `slambda.metrics.metrics`.
+        :param playground: if True, serve `/playground/run`, which runs any posted definition.
+        :param playground_cache_size: number of compiled playground definitions kept in memory.
+        :param allow_origin: value of the `Access-Control-Allow-Origin` header, for browser clients on
+                             another origin.
+        """
+        self.functions = dict(functions)
+        self.max_pending = max_pending
+        self.max_body_size = max_body_size
+        self.metrics = metrics if metrics is not None else default_metrics
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='slambda-serve')
+        self.playground = playground
+        self.playground_cache_size = playground_cache_size
+        self.allow_origin = allow_origin
+        self.pending = 0
+        # only accessed on the event loop.
+        self._definitions: OrderedDict = OrderedDict()
+        self._codec = get_codec()
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self, host: str = '127.0.0.1', port: int = 8080) -> asyncio.AbstractServer:
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        return self._server
+
+    @property
+    def port(self) -> int:
+        return self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self, host: str = '127.0.0.1', port: int = 8080):
+        server = await self.start(host, port)
+        async with server:
+            await server.serve_forever()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        self.executor.shutdown(wait=False)
+
+    async def run_in_executor(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+
+    # HTTP layer
+
+    @staticmethod
+    async def _readline(reader: asyncio.StreamReader, status: HTTPStatus) -> bytes:
+        try:
+            return await reader.readline()
+        except ValueError:
+            # the line is longer than the limit of the stream reader.
+            raise HttpError(status, 'line is too long')
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Optional[Tuple[str, str, Dict[str, str], bytes]]:
+        line = await self._readline(reader, HTTPStatus.REQUEST_URI_TOO_LONG)
+        if not line:
+            return None
+        try:
+            method, target, _ = line.decode('latin-1').split(' ', 2)
+        except ValueError:
+            raise HttpError(HTTPStatus.BAD_REQUEST, 'invalid request line')
+        headers = {}
+        while True:
+            line = await self._readline(reader, HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE)
+            if line in (b'\r\n', b'\n', b''):
+                break
+            if len(headers) >= MAX_HEADER_COUNT:
+                raise HttpError(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE, 'too many headers')
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        try:
+            length = int(headers.get('content-length', 0) or 0)
+        except ValueError:
+            raise HttpError(HTTPStatus.BAD_REQUEST, 'invalid content-length')
+        if length < 0:
+            raise HttpError(HTTPStatus.BAD_REQUEST, 'invalid content-length')
+        if length > self.max_body_size:
+            raise HttpError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, 'request body is too large')
+        body = await reader.readexactly(length) if length > 0 else b''
+        return method.upper(), target.split('?', 1)[0], headers, body
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except HttpError as e:
+                    await self._write(writer, self._error_response(e), keep_alive=False)
+                    return
+                if request is None:
+                    return
+                method, path, headers, body = request
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                try:
+                    resp = await self.dispatch(method, path, body)
+                except HttpError as e:
+                    resp = self._error_response(e)
+                await self._write(writer, resp, keep_alive and resp.events is None)
+                if not keep_alive or resp.events is not None:
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def _error_response(e: HttpError) -> Response:
+        return Response(e.status, {'error': e.message}, headers=e.headers)
+
+    async def _write(self, writer: asyncio.StreamWriter, resp: Response, keep_alive: bool):
+        status = HTTPStatus(resp.status)
+        head = [f'HTTP/1.1 {status.value} {status.phrase}']
+        headers = dict(resp.headers)
+        headers['Connection'] = 'keep-alive' if keep_alive else 'close'
+        if self.allow_origin is not None:
+            headers['Access-Control-Allow-Origin'] = self.allow_origin
+        if resp.events is not None:
+            headers.update({'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache'})
+            body = b''
+        elif resp.status == HTTPStatus.NO_CONTENT:
+            body = b''
+        else:
+            body = self._codec.dumps(resp.body).encode('utf-8')
+            headers.update({'Content-Type': 'application/json', 'Content-Length': str(len(body))})
+        head.extend(f'{k}: {v}' for k, v in headers.items())
+        try:
+            writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body)
+            await writer.drain()
+            if resp.events is not None:
+                async for event in resp.events:
+                    writer.write(event.encode('utf-8'))
+                    await writer.drain()
+        finally:
+            if resp.events is not None:
+                # stops the producer of the events if the client disconnected.
+                await resp.events.aclose()
+
+    # routes
+
+    def _parse_body(self, body: bytes) -> Dict:
+        if not body:
+            return {}
+        try:
+            data = self._codec.loads(body.decode('utf-8'))
+        except ValueError:
+            raise HttpError(HTTPStatus.BAD_REQUEST, 'request body must be json')
+        if not isinstance(data, dict):
+            raise HttpError(HTTPStatus.BAD_REQUEST, 'request body must be a json object')
+        return data
+
+    async def dispatch(self, method: str, path: str, body: bytes) -> Response:
+        path = path.rstrip('/') or '/'
+        if method == 'OPTIONS' and self.allow_origin is not None:
+            return Response(HTTPStatus.NO_CONTENT, headers={
+                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type',
+            })
+        if method == 'GET' and path == '/health':
+            return Response(body={'status': 'ok', 'functions': len(self.functions), 'pending': self.pending})
+        if method == 'GET' and path == '/metrics':
+            return Response(body=self.metrics.snapshot())
+        if method == 'GET' and path == '/functions':
+            return Response(body={'functions': [
+                {'name': name, 'input_type': fn.definition.input_config.input_type.value,
+                 'nullary': fn.definition.input_config.strict_no_args,
+                 'required_args': fn.definition.required_args}
+                for name, fn in self.functions.items()
+            ]})
+        if path.startswith('/functions/'):
+            if method != 'POST':
+                raise HttpError(HTTPStatus.METHOD_NOT_ALLOWED, 'use POST to call a function')
+            return await self.call_function(path[len('/functions/'):], self._parse_body(body))
+        if self.playground and path == '/playground/run':
+            if method != 'POST':
+                raise HttpError(HTTPStatus.METHOD_NOT_ALLOWED, 'use POST to run a definition')
+            return await self.run_playground(self._parse_body(body))
+        raise HttpError(HTTPStatus.NOT_FOUND, f'{path} not found')
+
+    def _parse_call(self, name: str, definition: Definition, data: Dict) -> Tuple[Any, Dict]:
+        """
+        Validate the input and override of a call, and apply load shedding.
+        :return: function input and override.
+        """
+        fn_input = data.get('input')
+        override = data.get('override') or {}
+        try:
+            if not isinstance(override, dict):
+                raise ValueError('override must be an object')
+            unknown = sorted(k for k in override if k not in OVERRIDE_PARAMS)
+            if unknown:
+                raise ValueError(f'override does not support {", ".join(unknown)}')
+            validate_input(definition, fn_input)
+        except ValueError as e:
+            self.metrics.inc('server_requests', function=name, status=400)
+            raise HttpError(HTTPStatus.BAD_REQUEST, str(e))
+
+        if self.pending >= self.max_pending:
+            self.metrics.inc('server_shed', function=name)
+            self.metrics.inc('server_requests', function=name, status=503)
+            raise HttpError(HTTPStatus.SERVICE_UNAVAILABLE, 'server is overloaded', headers={'Retry-After': '1'})
+        return fn_input, override
+
+    def _acquire(self):
+        self.pending += 1
+        self.metrics.set('server_pending', self.pending)
+
+    def _release(self):
+        self.pending -= 1
+        self.metrics.set('server_pending', self.pending)
+
+    async def call_function(self, name: str, data: Dict) -> Response:
+        fn = self.functions.get(name)
+        if fn is None:
+            raise HttpError(HTTPStatus.NOT_FOUND, f'function {name} not found')
+        fn_input, override = self._parse_call(name, fn.definition, data)
+
+        ctrl_kws = {'__override': override} if override else {}
+        self._acquire()
+        try:
+            output = await self.run_in_executor(call_with_input, fn, fn_input, **ctrl_kws)
+        except Exception as e:
+            status = error_status(e)
+            self.metrics.inc('server_requests', function=name, status=int(status))
+            raise HttpError(status, f'{type(e).__name__}: {e}')
+        finally:
+            self._release()
+        self.metrics.inc('server_requests', function=name, status=200)
+        return Response(body={'output': output})
+
+    def compile_definition(self, template: Dict) -> Definition:
+        """
+        Validate a posted definition. Definitions are cached by a fingerprint of the posted json, so repeated runs
+        of the same definition are not validated and compiled again. Compiled definitions are named `PLAYGROUND`,
+        so playground runs share one label in metrics and usage whatever the posted name.
+        :raise HttpError: if the definition is invalid.
+        """
+        key = hashlib.sha256(json.dumps(template, sort_keys=True).encode('utf-8')).hexdigest()
+        definition = self._definitions.get(key)
+        if definition is not None:
+            self._definitions.move_to_end(key)
+            self.metrics.inc('playground_definitions', cached=True)
+            return definition
+        try:
+            definition = Definition.model_validate({**template, 'name': PLAYGROUND})
+            definition.wire_message_stack()
+        except ValueError as e:
+            self.metrics.inc('server_requests', function=PLAYGROUND, status=400)
+            raise HttpError(HTTPStatus.BAD_REQUEST, f'invalid definition: {e}')
+        self.metrics.inc('playground_definitions', cached=False)
+        self._definitions[key] = definition
+        while len(self._definitions) > self.playground_cache_size:
+            self._definitions.popitem(last=False)
+        return definition
+
+    async def run_playground(self, data: Dict) -> Response:
+        """
+        Run a definition and stream its tokens.
+
+        The body is `{"template": {...}, "input": ..., "override": {...}}`, where template is a dumped `Definition`,
+        e.g. the `template` of a function extracted by `utils/extract_defs.py` (`definition` is accepted too).
+        The response is a stream of events:
+            * token: `{"index": ..., "content": ...}`, a token of choice `index`.
+            * done: `{"output": ...}`, the output cast from the streamed content, a list of outputs if n > 1.
+            * error: `{"error": ..., "status": ...}`, the call failed or its output cannot be cast.
+        """
+        template = data.get('template', data.get('definition'))
+        if not isinstance(template, dict):
+            raise HttpError(HTTPStatus.BAD_REQUEST, 'template must be a definition object')
+        definition = self.compile_definition(template)
+        fn_input, override = self._parse_call(PLAYGROUND, definition, data)
+        fn = LmFunction(definition)
+        ctrl_kws = {'__override': {**override, 'stream': True}}
+
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        cancelled = threading.Event()
+
+        def put(item):
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+
+        def produce():
+            stream = None
+            try:
+                stream = call_with_input(fn, fn_input, **ctrl_kws)
+                for chunk in stream:
+                    if cancelled.is_set():
+                        break
+                    for choice in chunk['choices']:
+                        content = choice.get('delta', {}).get('content')
+                        if content:
+                            put(('token', {'index': choice.get('index', 0), 'content': content}))
+            except Exception as e:
+                put(('error', e))
+            finally:
+                if hasattr(stream, 'close'):
+                    stream.close()
+                put(None)
+
+        self._acquire()
+        future = loop.run_in_executor(self.executor, produce)
+        # the run ends at its next chunk if the client disconnects.
+        future.add_done_callback(lambda _: self._release())
+        return Response(events=self._playground_events(definition, queue, cancelled))
+
+    async def _playground_events(self, definition: Definition, queue: asyncio.Queue,
+                                 cancelled: threading.Event) -> AsyncIterator[str]:
+        try:
+            contents: Dict[int, List[str]] = {}
+            while True:
+                item = await queue.get()
+                if item is None:
+                    break
+                event, data = item
+                if event == 'error':
+                    status = error_status(data)
+                    self.metrics.inc('server_requests', function=PLAYGROUND, status=int(status))
+                    yield sse_event('error', {'error': f'{type(data).__name__}: {data}', 'status': int(status)})
+                    return
+                contents.setdefault(data['index'], []).append(data['content'])
+                yield sse_event(event, data)
+
+            try:
+                outputs = [Definition.cast_lm_output(definition.output_config, ''.join(contents.get(i, [])))
+                           for i in range(max(contents.keys(), default=0) + 1)]
+            except LmOutputCastingError as e:
+                self.metrics.inc('server_requests', function=PLAYGROUND, status=int(HTTPStatus.BAD_GATEWAY))
+                yield sse_event('error', {'error': f'{type(e).__name__}: {e}', 'status': int(HTTPStatus.BAD_GATEWAY)})
+                return
+            self.metrics.inc('server_requests', function=PLAYGROUND, status=200)
+            yield sse_event('done', {'output': outputs[0] if len(outputs) == 1 else outputs})
+        finally:
+            cancelled.set()
@@ -0,0 +1,160 @@
+import hashlib
+import heapq
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Iterable, Iterator, Optional, Tuple
+
+from .batch import BatchItem, run_batch, call_with_input
+from .core import LmFunction
+from .discovery import resolve_function
+from .files import BatchStats, Record, RecordWriter, read_records, record_to_input, result_row, DEFAULT_BUFFER_SIZE
+
+INDEX_FIELD = '__index__'
+"""
+Field of shard output rows that holds the position of the record in the input file.
+"""
+
+
+def shard_of(key: Any, shard_count: int) -> int:
+    """
+    Deterministic shard of a key, the same on every machine and python process.
+    """
+    digest = hashlib.blake2b(str(key).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % shard_count
+
+
+def iter_shard(
+        records: Iterable[Record],
+        shard_index: int,
+        shard_count: int,
+        key_field: Optional[str] = None,
+) -> Iterator[Tuple[int, Record]]:
+    """
+    Yield (input position, record) for records that belong to shard `shard_index`.
+    :param key_field: records are partitioned by this field if provided, otherwise by input position.
+    """
+    if not (0 <= shard_index < shard_count):
+        raise ValueError(f'shard_index must be in [0, {shard_count})')
+    for index, record in enumerate(records):
+        key = index if key_field is None else record[key_field]
+        if shard_of(key, shard_count) == shard_index:
+            yield index, record
+
+
+def shard_path(output_dir: str, shard_index: int, shard_count: int) -> str:
+    return os.path.join(output_dir, f"part-{shard_index:05d}-of-{shard_count:05d}.jsonl")
+
+
+def run_shard(
+        fn: LmFunction,
+        input_path: str,
+        output_dir: str,
+        shard_index: int,
+        shard_count: int,
+        key_field: Optional[str] = None,
+        input_field: Optional[str] = None,
+        output_field: str = 'output',
+        input_format: Optional[str] = None,
+        concurrency: int = 8,
+        buffer_size: int = DEFAULT_BUFFER_SIZE,
+        **ctrl_kws,
+) -> BatchStats:
+    """
+    Process one shard of an input file, and write its results to `shard_path(output_dir, ...)`.
+    Each machine or process can run a different shard of the same file, no coordination is needed.
+    Shard outputs are combined with `merge_shards`.
+
+    See `slambda.files.process_file` for the other arguments.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+
+    def run(indexed_record):
+        _, record = indexed_record
+        return call_with_input(fn, record_to_input(fn, record, input_field), **ctrl_kws)
+
+    stats = BatchStats()
+    records = read_records(input_path, input_format, buffer_size=buffer_size)
+    shard = iter_shard(records, shard_index, shard_count, key_field=key_field)
+    out = shard_path(output_dir, shard_index, shard_count)
+    with RecordWriter(out, 'jsonl', buffer_size=buffer_size) as writer:
+        for item in run_batch(run, shard, concurrency=concurrency):
+            index, record = item.input
+            row = result_row(BatchItem(index=index, input=record, output=item.output, error=item.error),
+                             output_field=output_field)
+            row[INDEX_FIELD] = index
+            stats.count(item.ok)
+            writer.write(row)
+    return stats
+
+
+def merge_shards(
+        output_dir: str,
+        shard_count: int,
+        output_path: str,
+        output_format: Optional[str] = None,
+        output_field: str = 'output',
+        buffer_size: int = DEFAULT_BUFFER_SIZE,
+) -> BatchStats:
+    """
+    Merge shard outputs into one file in input order. Shards are streamed, memory usage does not depend on
+    their size.
+    """
+    paths = [shard_path(output_dir, i, shard_count) for i in range(shard_count)]
+    missing = [p for p in paths if not os.path.exists(p)]
+    if len(missing) > 0:
+        raise FileNotFoundError(f'missing shard outputs: {missing}')
+
+    stats = BatchStats()
+    streams = [read_records(p, 'jsonl', buffer_size=buffer_size) for p in paths]
+    with RecordWriter(output_path, output_format, buffer_size=buffer_size, text_field=output_field) as writer:
+        for row in heapq.merge(*streams, key=lambda r: r[INDEX_FIELD]):
+            del row[INDEX_FIELD]
+            stats.count(row.get('error') is None)
+            writer.write(row)
+    return stats
+
+
+def _run_shard_by_ref(fn_ref: str, *args, **kwargs) -> BatchStats:
+    return run_shard(resolve_function(fn_ref), *args, **kwargs)
+
+
+def run_sharded(
+        fn_ref: str,
+        input_path: str,
+        output_path: str,
+        shard_count: Optional[int] = None,
+        work_dir: Optional[str] = None,
+        output_format: Optional[str] = None,
+        mp_context: Optional[multiprocessing.context.BaseContext] = None,
+        **kwargs,
+) -> BatchStats:
+    """
+    Process a file with a pool of local processes, one shard per process, then merge shard outputs.
+
+    :param fn_ref: function reference in `module:name` format, it is imported in every worker process.
+    :param input_path: input file path.
+    :param output_path: output file path.
+    :param shard_count: number of shards and processes, default to the number of cpus.
+    :param work_dir: directory for shard outputs, a temporary directory is used if not provided.
+    :param output_format: format of the merged output, see `slambda.files.FORMATS`.
+    :param mp_context: multiprocessing context used to start worker processes.
+    :param kwargs: other arguments passed to `run_shard`.
+    :return: stats of the merged output.
+    """
+    if shard_count is None:
+        shard_count = os.cpu_count() or 1
+    resolve_function(fn_ref)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        output_dir = work_dir if work_dir is not None else tmp
+        with ProcessPoolExecutor(max_workers=shard_count, mp_context=mp_context) as executor:
+            futures = [
+                executor.submit(_run_shard_by_ref, fn_ref, input_path, output_dir, i, shard_count, **kwargs)
+                for i in range(shard_count)
+            ]
+            for f in futures:
+                f.result()
+        return merge_shards(output_dir, shard_count, output_path, output_format=output_format,
+                            output_field=kwargs.get('output_field', 'output'))
@@ -0,0 +1,254 @@
+"""
+A local HTTP server that mimics the ChatCompletion endpoint, for load tests without calling the real API.
+
+Usage:
+    python -m slambda.standin --port 8000 --latency 0.5 --max-rps 20 --rate-limit-rate 0.01
+
+Then point openai at it, e.g. `openai.api_base = 'http://127.0.0.1:8000/v1'`.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+from .metrics import MetricsRegistry
+
+
+@dataclass
+class StandinConfig:
+    """
+    Behavior of the stand-in server.
+
+    Args:
+        latency: seconds before the response (or the first streamed chunk) is sent.
+        jitter: a random delay up to this many seconds is added to latency.
+        max_rps: requests per second above this rate are rejected with 429, None for no limit.
+        rate_limit_rate: fraction of requests rejected with 429 at random.
+        chunk_interval: seconds between streamed chunks.
+        content: content of every response, by default the last example answer in the request
+                 (so the output has the type expected by the function), or the last message.
+    """
+    latency: float = 0.05
+    jitter: float = 0.0
+    max_rps: Optional[float] = None
+    rate_limit_rate: float = 0.0
+    chunk_interval: float = 0.01
+    content: Optional[str] = None
+
+
+class _RateCap:
+    """
+    Token bucket allowing `rate` requests per second, with bursts of up to `rate` requests.
+    """
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self) -> bool:
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+def response_content(config: StandinConfig, messages: List[Dict]) -> str:
+    if config.content is not None:
+        return config.content
+    for m in reversed(messages):
+        if m.get('name') == 'example_assistant':
+            return m.get('content', '')
+    return messages[-1].get('content', '') if messages else ''
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: 'StandinServer'
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body: Dict):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            request = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            return self._send_json(400, {'error': {'message': 'invalid json body', 'type': 'invalid_request_error'}})
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            return self._send_json(404, {'error': {'message': f'unknown path {self.path}',
+                                                   'type': 'invalid_request_error'}})
+
+        stats = self.server.stats
+        stats.inc('requests')
+        config = self.server.config
+        if (self.server.rate_cap is not None and not self.server.rate_cap.take()) or \
+                random.random() < config.rate_limit_rate:
+            stats.inc('rate_limited')
+            return self._send_json(429, {'error': {'message': 'Rate limit reached', 'type': 'requests'}})
+
+        time.sleep(config.latency + random.uniform(0, config.jitter))
+        content = response_content(config, request.get('messages', []))
+        model = request.get('model', 'standin')
+        n = request.get('n') or 1
+        if request.get('stream'):
+            self._stream(model, content, n)
+        else:
+            self._send_json(200, {
+                'id': f'chatcmpl-{uuid.uuid4().hex}',
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [
+                    {'index': i, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}
+                    for i in range(n)
+                ],
+                'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0},
+            })
+
+    def _stream(self, model: str, content: str, n: int):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        chunk_id = f'chatcmpl-{uuid.uuid4().hex}'
+        words = content.split(' ')
+        deltas = [{'role': 'assistant'}] + [{'content': w if i == 0 else ' ' + w} for i, w in enumerate(words)]
+        for i, delta in enumerate(deltas):
+            if i > 1:
+                time.sleep(self.server.config.chunk_interval)
+            self._write_event(json.dumps({
+                'id': chunk_id,
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{'index': c, 'delta': delta, 'finish_reason': None} for c in range(n)],
+            }))
+        self._write_event(json.dumps({
+            'id': chunk_id,
+            'object': 'chat.completion.chunk',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [{'index': c, 'delta': {}, 'finish_reason': 'stop'} for c in range(n)],
+        }))
+        self._write_event('[DONE]')
+        self.wfile.write(b'0\r\n\r\n')
+
+    def _write_event(self, data: str):
+        event = f'data: {data}\n\n'.encode('utf-8')
+        self.wfile.write(f'{len(event):x}\r\n'.encode('ascii') + event + b'\r\n')
+        self.wfile.flush()
+
+
+class StandinServer(ThreadingHTTPServer):
+    """
+    The stand-in server, it handles every request in its own thread.
+
+    Example:
+        with StandinServer(latency=0.2) as server:
+            openai.api_base = server.url
+            ...
+    """
+    daemon_threads = True
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, config: Optional[StandinConfig] = None, **kwargs):
+        """
+
+        :param host: listen address.
+        :param port: listen port, 0 for a random free port.
+        :param config: server behavior, or pass `StandinConfig` fields as keyword arguments.
+        """
+        super().__init__((host, port), _Handler)
+        self.config = config if config is not None else StandinConfig(**kwargs)
+        self.rate_cap = _RateCap(self.config.max_rps) if self.config.max_rps is not None else None
+        self.stats = MetricsRegistry()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        """
+        API base url of this server.
+        """
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+    def start(self) -> 'StandinServer':
+        """
+        Serve requests in a background thread.
+        """
+        self._thread = threading.Thread(target=self.serve_forever, name='slambda-standin', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+def add_config_arguments(parser: argparse.ArgumentParser, prefix: str = ''):
+    """
+    Add `StandinConfig` options to a command line parser.
+    """
+    parser.add_argument(f'--{prefix}latency', type=float, default=0.05, help='response latency in seconds')
+    parser.add_argument(f'--{prefix}jitter', type=float, default=0.0, help='max random extra latency in seconds')
+    parser.add_argument(f'--{prefix}max-rps', type=float, default=None, help='reject requests above this rate')
+    parser.add_argument(f'--{prefix}rate-limit-rate', type=float, default=0.0,
+                        help='fraction of requests rejected with 429 at random')
+    parser.add_argument(f'--{prefix}content', default=None, help='content of every response')
+
+
+def config_from_arguments(args, prefix: str = '') -> StandinConfig:
+    prefix = prefix.replace('-', '_')
+    return StandinConfig(
+        latency=getattr(args, f'{prefix}latency'),
+        jitter=getattr(args, f'{prefix}jitter'),
+        max_rps=getattr(args, f'{prefix}max_rps'),
+        rate_limit_rate=getattr(args, f'{prefix}rate_limit_rate'),
+        content=getattr(args, f'{prefix}content'),
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m slambda.standin', description='ChatCompletion stand-in server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    add_config_arguments(parser)
+    args = parser.parse_args(argv)
+    server = StandinServer(args.host, args.port, config_from_arguments(args))
+    print(f'serving on {server.url}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+from typing import Any, Callable, Optional
+
+import openai
+
+Transport = Callable[..., Any]
+"""
+A callable that sends a ChatCompletion request, called with the keyword arguments of `openai.ChatCompletion.create`
+and returning its response.
+"""
+
+
+def openai_transport(**call_args):
+    """
+    Send the request with `openai.ChatCompletion.create`.
+    """
+    # looked up on every call, so patching openai.ChatCompletion.create works as expected.
+    return openai.ChatCompletion.create(**call_args)
+
+
+_transport: Optional[Transport] = None
+
+
+def get_default_transport() -> Transport:
+    """
+    Return the transport used by functions without their own transport, default to `openai_transport`.
+    """
+    return _transport if _transport is not None else openai_transport
+
+
+def set_default_transport(transport: Optional[Transport]):
+    """
+    Change the transport used by functions without their own transport, e.g. a `slambda.replay.Recorder`.
+    :param transport: a transport, or None to use `openai_transport`.
+    """
+    global _transport
+    _transport = transport
@@ -0,0 +1,334 @@
+import math
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from enum import Enum
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .credentials import CHARS_PER_TOKEN, estimate_prompt_tokens
+from .metrics import metrics as default_metrics, MetricsRegistry
+
+Pricing = Dict[str, Tuple[float, float]]
+"""
+Price of models in USD per 1k prompt tokens and per 1k completion tokens, by model name.
+"""
+
+PRICING: Pricing = {
+    'gpt-3.5-turbo': (0.0015, 0.002),
+    'gpt-3.5-turbo-16k': (0.003, 0.004),
+    'gpt-4': (0.03, 0.06),
+    'gpt-4-32k': (0.06, 0.12),
+}
+"""
+Default pricing, dated model names (e.g. `gpt-4-0613`) are priced as their base model.
+"""
+
+
+def model_price(model: str, pricing: Optional[Pricing] = None) -> Optional[Tuple[float, float]]:
+    """
+    Price of a model, the longest model name that `model` is a version of is used, e.g. `gpt-4-32k-0613`
+    is priced as `gpt-4-32k`.
+    :return: price per 1k prompt tokens and per 1k completion tokens, None if the model is unknown.
+    """
+    pricing = pricing if pricing is not None else PRICING
+    if model in pricing:
+        return pricing[model]
+    matches = [name for name in pricing if model.startswith(name + '-')]
+    return pricing[max(matches, key=len)] if matches else None
+
+
+def usage_cost(model: str, prompt_tokens: int, completion_tokens: int, pricing: Optional[Pricing] = None) -> float:
+    """
+    Cost of a request in USD, 0 if the model is unknown.
+    """
+    price = model_price(model, pricing)
+    if price is None:
+        return 0.0
+    return (prompt_tokens * price[0] + completion_tokens * price[1]) / 1000
+
+
+@dataclass
+class Usage:
+    """
+    Token usage of one or more requests.
+
+    Args:
+        requests: number of requests.
+        prompt_tokens: number of prompt tokens.
+        completion_tokens: number of completion tokens.
+        cost: cost in USD, requests to unknown models cost 0.
+    """
+    requests: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cost: float = 0.0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def add(self, other: 'Usage'):
+        self.requests += other.requests
+        self.prompt_tokens += other.prompt_tokens
+        self.completion_tokens += other.completion_tokens
+        self.cost += other.cost
+
+
+def response_usage(model: str, resp, pricing: Optional[Pricing] = None) -> Optional[Usage]:
+    """
+    Usage of a ChatCompletion response, None if the response has no usage, see `metered_stream` for streams.
+    """
+    usage = resp.get('usage') if isinstance(resp, dict) else None
+    if not usage:
+        return None
+    prompt_tokens = usage.get('prompt_tokens') or 0
+    completion_tokens = usage.get('completion_tokens') or 0
+    return Usage(1, prompt_tokens, completion_tokens, usage_cost(model, prompt_tokens, completion_tokens, pricing))
+
+
+def metered_stream(stream: Iterable, call_args: Dict, on_usage: Callable[[Dict], None]) -> Iterator:
+    """
+    Yield the chunks of a streamed ChatCompletion response. Streams do not report their usage, once the stream
+    is consumed or closed, `on_usage` is called with a response whose usage is estimated from the characters of
+    the messages and of the streamed content.
+    """
+    chars = 0
+    try:
+        for chunk in stream:
+            for choice in chunk.get('choices') or []:
+                chars += len((choice.get('delta') or {}).get('content') or '')
+            yield chunk
+    finally:
+        if hasattr(stream, 'close'):
+            stream.close()
+        prompt_tokens = estimate_prompt_tokens(call_args.get('messages', []))
+        completion_tokens = math.ceil(chars / CHARS_PER_TOKEN)
+        on_usage({'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                            'total_tokens': prompt_tokens + completion_tokens, 'estimated': True}})
+
+
+class UsageTracker:
+    """
+    Token usage aggregated by function and model.
+
+    Metrics (labeled by `function` and `model`):
+        * usage_requests: number of requests with usage.
+        * usage_prompt_tokens: number of prompt tokens.
+        * usage_completion_tokens: number of completion tokens.
+        * usage_cost: cost in USD.
+    """
+
+    def __init__(self, pricing: Optional[Pricing] = None, metrics: Optional[MetricsRegistry] = None):
+        """
+
+        :param pricing: model pricing, default to `PRICING`.
+        :param metrics: metrics registry, default to `slambda.metrics.metrics`.
+        """
+        self.pricing = pricing
+        self.metrics = metrics if metrics is not None else default_metrics
+        self._lock = threading.Lock()
+        self._usage: Dict[Tuple[str, str], Usage] = {}
+
+    def record(self, function: str, model: str, resp) -> Optional[Usage]:
+        """
+        Record the usage of a response.
+        :param function: function key, i.e. `Definition.name` if the function is named.
+        :param model: model of the request.
+        :param resp: the ChatCompletion response.
+        :return: usage of the response, None if the response has no usage.
+        """
+        usage = response_usage(model, resp, self.pricing)
+        if usage is None:
+            return None
+        with self._lock:
+            self._usage.setdefault((function, model), Usage()).add(usage)
+        self.metrics.inc('usage_requests', function=function, model=model)
+        self.metrics.inc('usage_prompt_tokens', usage.prompt_tokens, function=function, model=model)
+        self.metrics.inc('usage_completion_tokens', usage.completion_tokens, function=function, model=model)
+        self.metrics.inc('usage_cost', usage.cost, function=function, model=model)
+        return usage
+
+    def get(self, function: Optional[str] = None, model: Optional[str] = None) -> Usage:
+        """
+        Total usage of a function and/or model, of everything if neither is provided.
+        """
+        ret = Usage()
+        with self._lock:
+            for (f, m), usage in self._usage.items():
+                if (function is None or f == function) and (model is None or m == model):
+                    ret.add(usage)
+        return ret
+
+    def snapshot(self) -> List[Dict]:
+        """
+        Usage of every function and model, as a list of dicts.
+        """
+        with self._lock:
+            return [
+                dict(function=f, model=m, requests=u.requests, prompt_tokens=u.prompt_tokens,
+                     completion_tokens=u.completion_tokens, cost=u.cost)
+                for (f, m), u in self._usage.items()
+            ]
+
+    def reset(self):
+        with self._lock:
+            self._usage.clear()
+
+
+usage_tracker = UsageTracker()
+"""
+Usage of every function call.
+"""
+
+
+class BudgetExceededError(RuntimeError):
+    """
+    A call was refused because its budget is spent.
+    """
+
+    def __init__(self, budget: 'Budget', spent: Usage):
+        self.budget = budget
+        self.spent = spent
+        name = f'budget {budget.name}' if budget.name is not None else 'budget'
+        super().__init__(f'{name} exceeded: {spent.total_tokens} tokens, ${spent.cost:.4f} spent')
+
+
+class BudgetAction(str, Enum):
+    """
+    What happens to calls once a budget is spent.
+    """
+    REFUSE = 'refuse'
+    """
+    Raise `BudgetExceededError`.
+    """
+    THROTTLE = 'throttle'
+    """
+    Wait until enough usage leaves the budget window, calls are refused if they cannot wait that long.
+    """
+
+
+class Budget:
+    """
+    A limit on tokens and/or cost, shared by every function and call it is attached to, e.g. one budget per
+    function, or one budget for a batch job passed with `__override={'budget': budget}`.
+
+    Calls are checked before they are sent, and charged with the usage of their response, so calls in flight
+    when the budget runs out can exceed it. Cached responses are free, and streams are charged with an estimate
+    once they end. A cost budget refuses calls to models without a price, they could not be charged.
+
+    Metrics (labeled by `budget`):
+        * budget_refused: number of refused calls.
+        * budget_throttled: number of calls that waited for the budget.
+    """
+
+    def __init__(
+            self,
+            max_tokens: Optional[int] = None,
+            max_cost: Optional[float] = None,
+            pricing: Optional[Pricing] = None,
+            window: Optional[float] = None,
+            action: BudgetAction = BudgetAction.REFUSE,
+            name: Optional[str] = None,
+            metrics: Optional[MetricsRegistry] = None,
+    ):
+        """
+
+        :param max_tokens: max total tokens.
+        :param max_cost: max cost in USD.
+        :param pricing: model pricing, default to `PRICING`.
+        :param window: if provided, only usage of the last `window` seconds counts, e.g. 3600 for an hourly budget.
+        :param action: refuse or throttle calls once the budget is spent, throttling requires a window.
+        :param name: name of the budget in errors and metrics.
+        :param metrics: metrics registry, default to `slambda.metrics.metrics`.
+        """
+        if max_tokens is None and max_cost is None:
+            raise ValueError('at least one of max_tokens and max_cost must be provided')
+        action = BudgetAction(action)
+        if action == BudgetAction.THROTTLE and window is None:
+            raise ValueError('a throttling budget requires a window')
+        self.max_tokens = max_tokens
+        self.max_cost = max_cost
+        self.pricing = pricing
+        self.window = window
+        self.action = action
+        self.name = name
+        self.metrics = metrics if metrics is not None else default_metrics
+        self._cond = threading.Condition()
+        self._charges: deque = deque()
+        self._spent = Usage()
+
+    def _expire(self, now: float):
+        if self.window is None:
+            return
+        while self._charges and self._charges[0][0] <= now - self.window:
+            _, usage = self._charges.popleft()
+            self._spent.requests -= usage.requests
+            self._spent.prompt_tokens -= usage.prompt_tokens
+            self._spent.completion_tokens -= usage.completion_tokens
+            self._spent.cost -= usage.cost
+
+    def _exceeded(self) -> bool:
+        return (self.max_tokens is not None and self._spent.total_tokens >= self.max_tokens) or \
+            (self.max_cost is not None and self._spent.cost >= self.max_cost)
+
+    def spent(self) -> Usage:
+        """
+        Usage counted against the budget.
+        """
+        with self._cond:
+            self._expire(time.monotonic())
+            return Usage(self._spent.requests, self._spent.prompt_tokens, self._spent.completion_tokens,
+                         self._spent.cost)
+
+    def exceeded(self) -> bool:
+        with self._cond:
+            self._expire(time.monotonic())
+            return self._exceeded()
+
+    def acquire(self, timeout: Optional[float] = None, model: Optional[str] = None):
+        """
+        Check the budget before a call, throttling budgets wait up to `timeout` seconds.
+        :param timeout: max seconds to wait.
+        :param model: model of the call.
+        :raise BudgetExceededError: if the budget is spent.
+        :raise ValueError: if this is a cost budget and `model` has no price.
+        """
+        label = self.name or ''
+        if self.max_cost is not None and model is not None and model_price(model, self.pricing) is None:
+            self.metrics.inc('budget_refused', budget=label)
+            raise ValueError(f'model {model} has no price, its calls cannot be charged to a cost budget')
+        end = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            throttled = False
+            while True:
+                now = time.monotonic()
+                self._expire(now)
+                if not self._exceeded():
+                    return
+                wait = self._charges[0][0] + self.window - now if self.action == BudgetAction.THROTTLE else None
+                if wait is None or (end is not None and now + wait > end):
+                    self.metrics.inc('budget_refused', budget=label)
+                    raise BudgetExceededError(self, Usage(self._spent.requests, self._spent.prompt_tokens,
+                                                          self._spent.completion_tokens, self._spent.cost))
+                if not throttled:
+                    throttled = True
+                    self.metrics.inc('budget_throttled', budget=label)
+                self._cond.wait(wait)
+
+    def charge(self, usage: Usage):
+        with self._cond:
+            now = time.monotonic()
+            if self.window is not None:
+                self._charges.append((now, usage))
+            self._spent.add(usage)
+            self._expire(now)
+
+    def charge_response(self, model: str, resp) -> Optional[Usage]:
+        """
+        Charge the usage of a response, priced with the pricing of this budget.
+        """
+        usage = response_usage(model, resp, self.pricing)
+        if usage is not None:
+            self.charge(usage)
+        return usage
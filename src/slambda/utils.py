@@ -1,5 +1,10 @@
-import json
+import re
+import sys
 from string import Formatter
+from typing import Any, Callable, List, Optional, Tuple
+
+from .codec import get_codec
+from .metrics import metrics
 
 
 def extract_required_keywords(template_str):
@@ -11,14 +16,242 @@ def extract_required_keywords(template_str):
     return [fn for _, fn, _, _ in Formatter().parse(template_str) if fn is not None]
 
 
-def try_parse_json(js):
+def intern_strings(value):
+    """
+    Intern every string in value, including strings nested in dicts and lists, so equal strings share memory.
+    :param value: a str, or a dict/list containing str values.
+    :return: value with interned strings, dicts and lists are copied.
+    """
+    if isinstance(value, str):
+        return sys.intern(value)
+    if isinstance(value, dict):
+        return {intern_strings(k): intern_strings(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [intern_strings(v) for v in value]
+    return value
+
+
+def try_parse_json(js, repair=False, truncated=False):
     """
     Parse the given string as json. If it cannot be parsed, return the original string.
     :param js: json string.
+    :param repair: if True, try the local repairs in `JSON_REPAIRS` before giving up.
+    :param truncated: if True, repairs include closing a truncated document, see `repair_json`.
     :return: parsed dict object, or the original string if it cannot be parsed.
     """
+    if repair:
+        value, repair_name = repair_json(js, truncated=truncated)
+        if repair_name is None:
+            return js, False
+        return value, True
     try:
-        dict_ret = json.loads(js)
+        dict_ret = get_codec().loads(js)
         return dict_ret, True
     except ValueError as e:
         return js, False
+
+
+_CODE_FENCE_RE = re.compile(r"\s*```[a-zA-Z]*[ \t]*\n?")
+
+
+def strip_code_fence(js: str) -> str:
+    """
+    Return the content of a markdown code block wrapping the document, e.g. ```json ... ```.
+    Only a fence opening the document is stripped, backticks inside the document (e.g. in a json string) are kept.
+    The block ends at the last fence, or at the end of the document if it is truncated.
+    """
+    m = _CODE_FENCE_RE.match(js)
+    if m is None:
+        return js
+    content = js[m.end():]
+    end = content.rfind('```')
+    if end >= 0:
+        content = content[:end]
+    return content
+
+
+def extract_json_span(js: str) -> str:
+    """
+    Drop leading and trailing prose around a json object or array.
+    """
+    starts = [i for i in (js.find('{'), js.find('[')) if i >= 0]
+    if len(starts) == 0:
+        return js
+    start = min(starts)
+    end = max(js.rfind('}'), js.rfind(']'))
+    if end > start and not js[end + 1:].lstrip().startswith((',', ':', '"')):
+        return js[start:end + 1]
+    # no closing bracket, or the document goes on after it (e.g. it is truncated), keep the tail.
+    return js[start:]
+
+
+def remove_trailing_commas(js: str) -> str:
+    """
+    Remove commas that directly precede a closing bracket, e.g. `[1, 2,]`.
+    """
+    out = []
+    in_string = False
+    escaped = False
+    n = len(js)
+    for i, c in enumerate(js):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif c == '\\':
+                escaped = True
+            elif c == '"':
+                in_string = False
+        elif c == '"':
+            in_string = True
+        elif c == ',':
+            j = i + 1
+            while j < n and js[j].isspace():
+                j += 1
+            if j < n and js[j] in '}]':
+                continue
+        out.append(c)
+    return ''.join(out)
+
+
+def replace_single_quotes(js: str) -> str:
+    """
+    Convert single quoted strings to double quoted strings, e.g. `{'a': 'b'}`.
+    """
+    out = []
+    quote = None
+    escaped = False
+    for c in js:
+        if quote is None:
+            if c == "'":
+                quote = c
+                out.append('"')
+            else:
+                if c == '"':
+                    quote = c
+                out.append(c)
+        elif escaped:
+            escaped = False
+            if quote == "'" and c == "'":
+                out[-1] = "'"
+            else:
+                out.append(c)
+        elif c == '\\':
+            escaped = True
+            out.append(c)
+        elif c == quote:
+            quote = None
+            out.append('"')
+        elif c == '"' and quote == "'":
+            out.append('\\"')
+        else:
+            out.append(c)
+    return ''.join(out)
+
+
+def close_truncated(js: str) -> str:
+    """
+    Close a truncated json document.
+    If the outermost value is an array, incomplete trailing items are dropped, otherwise open strings and
+    brackets are closed.
+    """
+    stack = []
+    in_string = False
+    escaped = False
+    last_top_level_comma = None
+    for i, c in enumerate(js):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif c == '\\':
+                escaped = True
+            elif c == '"':
+                in_string = False
+        elif c == '"':
+            in_string = True
+        elif c in '[{':
+            stack.append(c)
+        elif c in ']}':
+            if len(stack) == 0:
+                return js
+            stack.pop()
+        elif c == ',' and len(stack) == 1 and stack[0] == '[':
+            last_top_level_comma = i
+
+    if len(stack) == 0 and not in_string:
+        return js
+    if re.fullmatch(r'[\s\[{]*', js):
+        # Nothing but opening brackets, there is nothing to recover.
+        return js
+
+    if stack and stack[0] == '[' and len(stack) + int(in_string) > 1 and last_top_level_comma is not None:
+        return js[:last_top_level_comma] + ']'
+
+    ret = js
+    if in_string:
+        if escaped:
+            ret = ret[:-1]
+        ret += '"'
+    ret = ret.rstrip()
+    if ret.endswith(','):
+        ret = ret[:-1]
+    elif ret.endswith(':'):
+        ret += ' null'
+    closers = {'[': ']', '{': '}'}
+    return ret + ''.join(closers[c] for c in reversed(stack))
+
+
+JSON_REPAIRS: List[Tuple[str, Callable[[str], str]]] = [
+    ('strip_code_fence', strip_code_fence),
+    ('extract_json_span', extract_json_span),
+    ('remove_trailing_commas', remove_trailing_commas),
+    ('replace_single_quotes', replace_single_quotes),
+    ('close_truncated', close_truncated),
+]
+"""
+Local repairs tried by `repair_json`, ordered from the cheapest and most common fix.
+"""
+
+TRUNCATION_REPAIRS = {'close_truncated'}
+"""
+Repairs that can drop content of a truncated document, only tried by `repair_json` if asked to.
+"""
+
+
+def repair_json(js: str, truncated: bool = False) -> Tuple[Any, Optional[str]]:
+    """
+    Parse the given string as json, applying the repairs in `JSON_REPAIRS` one after another until it can be parsed.
+    Each repair is applied on top of the previous ones.
+
+    A truncated document can only be parsed by closing it, which drops incomplete trailing items, so the repairs
+    in `TRUNCATION_REPAIRS` are skipped unless `truncated` is True.
+
+    The name of the repair that succeeded is recorded with the `json_repair` counter of `slambda.metrics`.
+
+    :param js: json string.
+    :param truncated: if True, also try the repairs in `TRUNCATION_REPAIRS`.
+    :return: (parsed value, name of the last repair applied) where name is 'none' if the string is valid json,
+             or (original string, None) if it cannot be repaired.
+    """
+    codec = get_codec()
+    try:
+        return codec.loads(js), 'none'
+    except ValueError:
+        pass
+
+    current = js
+    for name, fix in JSON_REPAIRS:
+        if name in TRUNCATION_REPAIRS and not truncated:
+            continue
+        fixed = fix(current)
+        if fixed == current:
+            continue
+        current = fixed
+        try:
+            value = codec.loads(current)
+        except ValueError:
+            continue
+        metrics.inc('json_repair', repair=name)
+        return value, name
+
+    metrics.inc('json_repair', repair='failed')
+    return js, None
@@ -0,0 +1,179 @@
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .batch import call_with_input
+from .cache import ResponseCache, request_fingerprint
+from .checkpoint import Checkpoint, CheckpointMismatchError
+from .codec import get_codec
+from .core import Definition, LmFunction
+from .files import read_records, record_to_input
+from .replay import read_log
+
+
+@dataclass
+class WarmupStats:
+    """
+    Summary of a cache warm-up.
+
+    Args:
+        loaded: number of responses inserted into the cache.
+        skipped: number of entries that were stale, failed or invalid.
+    """
+    loaded: int = 0
+    skipped: int = 0
+
+
+def completion_response(fn: LmFunction, output: Any) -> Dict:
+    """
+    A ChatCompletion response whose content is cast to `output` by `fn`.
+    """
+    content = output if isinstance(output, str) else get_codec().render(output)
+    return {
+        'object': 'chat.completion',
+        'model': fn.definition.gpt_opts.model,
+        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+    }
+
+
+def _matches(messages: List[Dict], stacks: List[List[Dict]]) -> bool:
+    return any(messages[:len(stack)] == stack for stack in stacks)
+
+
+def warm_from_logs(
+        cache: ResponseCache,
+        paths: Iterable[str],
+        definitions: Optional[Iterable[Definition]] = None,
+        batch_size: int = 1000,
+) -> WarmupStats:
+    """
+    Load responses recorded by `slambda.replay.Recorder` into a cache.
+
+    :param cache: the cache to warm up.
+    :param paths: log paths.
+    :param definitions: if provided, only requests whose messages start with the message stack of one of these
+                        definitions are loaded, so responses of outdated prompts are skipped.
+    :param batch_size: number of responses per bulk insert.
+    """
+    stacks = None if definitions is None else [list(d.wire_message_stack()) for d in definitions]
+    stats = WarmupStats()
+
+    def entries() -> Iterator[Tuple[str, Dict]]:
+        for path in paths:
+            for record in read_log(path):
+                request = record.get('request')
+                if not isinstance(request, dict) or request_fingerprint(request) != record.get('key') or \
+                        (stacks is not None and not _matches(request.get('messages', []), stacks)):
+                    stats.skipped += 1
+                    continue
+                stats.loaded += 1
+                yield record['key'], record['response']
+
+    _set_many(cache, entries(), batch_size)
+    return stats
+
+
+def warm_from_rows(
+        cache: ResponseCache,
+        fn: LmFunction,
+        rows: Iterable[Dict],
+        fingerprint: str,
+        input_field: Optional[str] = None,
+        output_field: str = 'output',
+        error_field: str = 'error',
+        batch_size: int = 1000,
+        **ctrl_kws
+) -> WarmupStats:
+    """
+    Load outputs of a previous batch run of `fn` into a cache, e.g. rows written by `slambda.files.process_file`.
+
+    :param cache: the cache to warm up.
+    :param fn: the function, requests are rebuilt from the input of each row.
+    :param rows: rows containing the input record and its output.
+    :param fingerprint: definition fingerprint of the function that produced the outputs.
+    :param input_field: see `slambda.files.record_to_input`, default to `input` for rows of string records.
+    :param output_field: field of the output in a row.
+    :param error_field: field of the error in a row, rows with an error are skipped.
+    :param batch_size: number of responses per bulk insert.
+    :param ctrl_kws: reserved keywords used by the batch run, e.g. `__override`.
+    :raise CheckpointMismatchError: if the definition of `fn` changed since the batch run.
+    """
+    current = fn.definition.fingerprint()
+    if fingerprint != current:
+        raise CheckpointMismatchError('definition', fingerprint, current)
+    n = (ctrl_kws.get('__override') or {}).get('n', fn.definition.gpt_opts.n)
+    if n is not None and n != 1:
+        raise ValueError('outputs of functions with n > 1 cannot be loaded')
+    stats = WarmupStats()
+
+    def entries() -> Iterator[Tuple[str, Dict]]:
+        for row in rows:
+            if row.get(error_field) is not None or row.get(output_field) is None:
+                stats.skipped += 1
+                continue
+            record = {k: v for k, v in row.items() if k not in (output_field, error_field)}
+            field = input_field
+            if field is None and list(record.keys()) == ['input']:
+                field = 'input'
+            try:
+                call_args = call_with_input(fn.request_args, record_to_input(fn, record, field), **ctrl_kws)
+            except (ValueError, KeyError):
+                stats.skipped += 1
+                continue
+            stats.loaded += 1
+            yield request_fingerprint(call_args), completion_response(fn, row[output_field])
+
+    _set_many(cache, entries(), batch_size)
+    return stats
+
+
+def warm_from_file(
+        cache: ResponseCache,
+        fn: LmFunction,
+        path: str,
+        fingerprint: str,
+        fmt: Optional[str] = None,
+        **kwargs
+) -> WarmupStats:
+    """
+    Load an output file of a previous batch run, see `warm_from_rows`.
+    :param fmt: file format, detected from file extension if not provided.
+    """
+    return warm_from_rows(cache, fn, read_records(path, fmt), fingerprint, **kwargs)
+
+
+def warm_from_checkpoint(cache: ResponseCache, fn: LmFunction, path: str, **kwargs) -> WarmupStats:
+    """
+    Load results of a checkpointed batch run (see `slambda.files.process_file`) into a cache,
+    the definition fingerprint, fields and `__override` are read from the checkpoint.
+    :raise CheckpointMismatchError: if an `__override` is provided and differs from the one of the batch run.
+    """
+    with Checkpoint(path) as cp:
+        meta = cp.meta()
+        if 'definition' not in meta:
+            raise ValueError(f'{path} is not a batch job checkpoint')
+        override = meta.get('override') or {}
+        if '__override' in kwargs:
+            # the budget of the batch run is not recorded, it does not change the requests.
+            given = {k: v for k, v in (kwargs.pop('__override') or {}).items() if k != 'budget'}
+            if get_codec().dumps(given) != get_codec().dumps(override):
+                raise CheckpointMismatchError('override', override, given)
+        if override:
+            kwargs['__override'] = override
+        rows = (row for _, _, row in cp.iter_rows())
+        return warm_from_rows(
+            cache, fn, rows, meta['definition'],
+            input_field=meta.get('input_field'),
+            output_field=meta.get('output_field', 'output'),
+            **kwargs
+        )
+
+
+def _set_many(cache: ResponseCache, entries: Iterable[Tuple[str, Dict]], batch_size: int):
+    batch = []
+    for entry in entries:
+        batch.append(entry)
+        if len(batch) >= batch_size:
+            cache.set_many(batch)
+            batch = []
+    if batch:
+        cache.set_many(batch)
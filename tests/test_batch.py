@@ -0,0 +1,72 @@
+import threading
+import time
+from unittest import TestCase, mock
+
+from slambda import LmFunction, Example
+from slambda.batch import run_batch, call_with_input
+
+
+class TestBatch(TestCase):
+    def test_ordered_results(self):
+        def slow_for_small(x):
+            time.sleep(0.01 * (5 - x))
+            return x * 2
+
+        items = list(run_batch(slow_for_small, range(5), concurrency=5))
+        self.assertEqual([0, 2, 4, 6, 8], [i.output for i in items])
+        self.assertEqual([0, 1, 2, 3, 4], [i.index for i in items])
+
+    def test_errors(self):
+        def fail_on_odd(x):
+            if x % 2 == 1:
+                raise ValueError(x)
+            return x
+
+        items = list(run_batch(fail_on_odd, range(4), concurrency=2))
+        self.assertEqual([True, False, True, False], [i.ok for i in items])
+        self.assertIsInstance(items[1].error, ValueError)
+
+    def test_bounded_read_ahead(self):
+        consumed = []
+        lock = threading.Lock()
+
+        def inputs():
+            for i in range(100):
+                with lock:
+                    consumed.append(i)
+                yield i
+
+        it = run_batch(lambda x: x, inputs(), concurrency=2, max_pending=4)
+        next(it)
+        time.sleep(0.05)
+        self.assertLessEqual(len(consumed), 6)
+        self.assertEqual(100, 1 + len(list(it)))
+
+    def test_close(self):
+        called = []
+
+        def slow(x):
+            called.append(x)
+            time.sleep(0.05)
+            return x
+
+        it = run_batch(slow, range(100), concurrency=2, max_pending=20)
+        self.assertEqual(0, next(it).output)
+        it.close()
+        # queued inputs are cancelled, only the calls in flight finish.
+        self.assertLessEqual(len(called), 4)
+
+    def test_call_with_input(self):
+        f = mock.Mock(return_value=1)
+        call_with_input(f, None)
+        call_with_input(f, 'a')
+        call_with_input(f, {'k': 'v'}, __override={'n': 1})
+        self.assertEqual([mock.call(), mock.call('a'), mock.call(k='v', __override={'n': 1})], f.call_args_list)
+
+    @mock.patch('openai.ChatCompletion.create')
+    def test_lm_function_map(self, mock_openai_api):
+        mock_openai_api.side_effect = lambda **kwargs: {
+            'choices': [{'message': {'content': kwargs['messages'][-1]['content'].upper()}}]
+        }
+        f = LmFunction.create('do this', examples=[Example(input="i0", output='v1')])
+        self.assertEqual(['A', 'B', 'C'], list(f.map(['a', 'b', 'c'], concurrency=2)))
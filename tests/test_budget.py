@@ -0,0 +1,157 @@
+import time
+from unittest import TestCase, mock
+
+from slambda import LmFunction, Example
+from slambda.cache import MemoryCache
+from slambda.hedging import HedgingPolicy
+from slambda.metrics import MetricsRegistry, metrics
+from slambda.microbatch import MicroBatcher
+from slambda.usage import Budget, BudgetExceededError, UsageTracker, model_price, usage_cost, usage_tracker
+
+
+def resp(content, prompt_tokens=100, completion_tokens=20):
+    return {'choices': [{'message': {'content': content}}],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                      'total_tokens': prompt_tokens + completion_tokens}}
+
+
+class TestUsage(TestCase):
+    def setUp(self):
+        metrics.reset()
+        usage_tracker.reset()
+        self.fn = LmFunction.create('do this', examples=[Example(input="i0", output={'label': 'v1'})], name='fn')
+
+    def test_pricing(self):
+        self.assertEqual((0.03, 0.06), model_price('gpt-4-0613'))
+        self.assertEqual((0.06, 0.12), model_price('gpt-4-32k-0613'))
+        self.assertIsNone(model_price('gpt-40'))
+        self.assertAlmostEqual(0.03 + 0.06, usage_cost('gpt-4', 1000, 1000))
+        self.assertEqual(0.0, usage_cost('unknown', 1000, 1000))
+
+    def test_tracker(self):
+        tracker = UsageTracker(pricing={'m': (1.0, 2.0)}, metrics=MetricsRegistry())
+        tracker.record('a', 'm', resp('x', 1000, 500))
+        tracker.record('a', 'other', resp('x', 10, 5))
+        tracker.record('b', 'm', resp('x', 1000, 0))
+        self.assertIsNone(tracker.record('b', 'm', {'choices': []}))
+        self.assertEqual(2, tracker.get('a').requests)
+        self.assertEqual(1515, tracker.get('a').total_tokens)
+        self.assertAlmostEqual(3.0, tracker.get(model='m').cost)
+        self.assertEqual(3, len(tracker.snapshot()))
+        self.assertEqual(500, tracker.metrics.get('usage_completion_tokens', function='a', model='m'))
+
+    @mock.patch('openai.ChatCompletion.create')
+    def test_function(self, mock_openai_api):
+        mock_openai_api.return_value = resp('{"label": "v2"}')
+        self.fn.cache = MemoryCache()
+        self.fn('a')
+        self.fn('a')
+        self.fn('a', __override={'model': 'gpt-4'})
+        self.assertEqual(240, usage_tracker.get('fn').total_tokens)
+        self.assertEqual(100, metrics.get('usage_prompt_tokens', function='fn', model='gpt-4'))
+        self.assertAlmostEqual(usage_cost('gpt-4', 100, 20), metrics.get('usage_cost', function='fn', model='gpt-4'))
+
+    @mock.patch('openai.ChatCompletion.create')
+    def test_hedged(self, mock_openai_api):
+        calls = []
+
+        def create(**kwargs):
+            calls.append(kwargs)
+            if len(calls) == 1:
+                time.sleep(0.2)
+            return resp('{"label": "v2"}')
+
+        mock_openai_api.side_effect = create
+        self.fn.hedging = HedgingPolicy(delay=0.01, max_extra_load=1, metrics=MetricsRegistry())
+        budget = Budget(max_tokens=1000, metrics=MetricsRegistry())
+        self.fn('a', __override={'budget': budget})
+        time.sleep(0.3)
+        # the losing request used tokens too.
+        self.assertEqual(2, len(calls))
+        self.assertEqual(2, usage_tracker.get('fn').requests)
+        self.assertEqual(240, budget.spent().total_tokens)
+
+    @mock.patch('openai.ChatCompletion.create')
+    def test_stream(self, mock_openai_api):
+        mock_openai_api.return_value = iter([{'choices': [{'delta': {'role': 'assistant'}}]},
+                                             {'choices': [{'delta': {'content': 'a' * 40}}]}])
+        budget = Budget(max_tokens=1000, metrics=MetricsRegistry())
+        chunks = self.fn('a', __override={'stream': True, 'budget': budget})
+        # usage is estimated once the stream is consumed.
+        self.assertEqual(0, usage_tracker.get('fn').requests)
+        self.assertEqual(2, len(list(chunks)))
+        usage = usage_tracker.get('fn')
+        self.assertEqual(1, usage.requests)
+        self.assertEqual(10, usage.completion_tokens)
+        self.assertGreater(usage.prompt_tokens, 0)
+        self.assertEqual(usage.total_tokens, budget.spent().total_tokens)
+
+    @mock.patch('openai.ChatCompletion.create')
+    def test_packed(self, mock_openai_api):
+        mock_openai_api.return_value = resp('{"0": {"label": "x"}, "1": {"label": "y"}}')
+        with MicroBatcher(self.fn, max_batch_size=2, max_wait=1) as batcher:
+            futures = [batcher.submit(t) for t in ['x', 'y']]
+            self.assertEqual([{'label': 'x'}, {'label': 'y'}], [f.result(timeout=5) for f in futures])
+        # packed requests are counted under the batched function.
+        self.assertEqual(1, usage_tracker.get('fn').requests)
+        self.assertEqual([], [u for u in usage_tracker.snapshot() if u['function'] != 'fn'])
+
+
+class TestBudget(TestCase):
+    def setUp(self):
+        self.fn = LmFunction.create('do this', examples=[Example(input="i0", output={'label': 'v1'})], name='fn')
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            Budget()
+        with self.assertRaises(ValueError):
+            Budget(max_tokens=10, action='throttle')
+
+    @mock.patch('openai.ChatCompletion.create')
+    def test_refuse(self, mock_openai_api):
+        mock_openai_api.return_value = resp('{"label": "v2"}')
+        self.fn.budget = Budget(max_tokens=200, name='fn', metrics=MetricsRegistry())
+        self.fn('a')
+        self.fn('b')
+        with self.assertRaises(BudgetExceededError) as ctx:
+            self.fn('c')
+        self.assertEqual(240, ctx.exception.spent.total_tokens)
+        self.assertEqual(2, mock_openai_api.call_count)
+        self.assertEqual(1, self.fn.budget.metrics.get('budget_refused', budget='fn'))
+
+    @mock.patch('openai.ChatCompletion.create')
+    def test_job_budget(self, mock_openai_api):
+        mock_openai_api.return_value = resp('{"label": "v2"}')
+        budget = Budget(max_cost=usage_cost('gpt-4', 100, 20), metrics=MetricsRegistry())
+        self.fn('a', __override={'budget': budget})
+        self.fn('b', __override={'budget': budget, 'model': 'gpt-4'})
+        with self.assertRaises(BudgetExceededError):
+            self.fn('c', __override={'budget': budget})
+        # calls without the job budget are not limited.
+        self.fn('c')
+
+    @mock.patch('openai.ChatCompletion.create')
+    def test_unpriced_model(self, mock_openai_api):
+        mock_openai_api.return_value = resp('{"label": "v2"}')
+        budget = Budget(max_cost=1, metrics=MetricsRegistry())
+        with self.assertRaises(ValueError):
+            self.fn('a', __override={'budget': budget, 'model': 'my-model'})
+        mock_openai_api.assert_not_called()
+        # token budgets do not need a price.
+        self.fn('a', __override={'budget': Budget(max_tokens=1000), 'model': 'my-model'})
+        # nor does a cost budget pricing the model.
+        budget = Budget(max_cost=1, pricing={'my-model': (1.0, 1.0)}, metrics=MetricsRegistry())
+        self.fn('a', __override={'budget': budget, 'model': 'my-model'})
+        self.assertAlmostEqual(0.12, budget.spent().cost)
+
+    @mock.patch('openai.ChatCompletion.create')
+    def test_throttle(self, mock_openai_api):
+        mock_openai_api.return_value = resp('{"label": "v2"}')
+        self.fn.budget = Budget(max_tokens=100, window=0.1, action='throttle', metrics=MetricsRegistry())
+        start = time.monotonic()
+        self.fn('a')
+        self.fn('b')
+        self.assertGreaterEqual(time.monotonic() - start, 0.1)
+        self.assertEqual(1, self.fn.budget.metrics.get('budget_throttled', budget=''))
+        with self.assertRaises(BudgetExceededError):
+            self.fn('c', __override={'timeout': 0.01})
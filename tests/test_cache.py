@@ -0,0 +1,50 @@
+import os
+import tempfile
+from unittest import TestCase, mock
+
+from slambda import LmFunction, Example
+from slambda.cache import MemoryCache, SqliteCache, request_fingerprint
+
+
+class TestCache(TestCase):
+    def test_request_fingerprint(self):
+        a = request_fingerprint({'model': 'm', 'messages': [{'role': 'user', 'content': 'x'}]})
+        b = request_fingerprint({'messages': [{'role': 'user', 'content': 'x'}], 'model': 'm',
+                                 'request_timeout': 3, 'api_key': 'k'})
+        c = request_fingerprint({'model': 'm', 'messages': [{'role': 'user', 'content': 'y'}]})
+        self.assertEqual(a, b)
+        self.assertNotEqual(a, c)
+
+    def test_memory_cache_lru(self):
+        cache = MemoryCache(max_size=2)
+        cache.set('a', {'v': 1})
+        cache.set('b', {'v': 2})
+        cache.get('a')
+        cache.set('c', {'v': 3})
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual({'a': {'v': 1}, 'c': {'v': 3}}, cache.get_many(['a', 'b', 'c']))
+        cache.delete('a')
+        self.assertEqual(1, len(cache))
+
+    def test_sqlite_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = SqliteCache(os.path.join(tmp, 'cache.db'))
+            self.assertEqual(1001, cache.set_many((str(i), {'v': i}) for i in range(1001)))
+            self.assertEqual({'v': 3}, cache.get('3'))
+            self.assertEqual({'1', '1000'}, set(cache.get_many(['1', '1000', 'x'])))
+            cache.delete('3')
+            self.assertIsNone(cache.get('3'))
+            self.assertEqual(1000, len(cache))
+            cache.close()
+
+    @mock.patch('openai.ChatCompletion.create')
+    def test_lm_function_cache(self, mock_openai_api):
+        mock_openai_api.side_effect = [
+            {'choices': [{'message': {'content': 'not json'}}]},
+            {'choices': [{'message': {'content': '{"k": 1}'}}]},
+        ]
+        f = LmFunction.create('do this', examples=[Example(input="i0", output={'k': 0})], cast_retries=1)
+        f.cache = MemoryCache()
+        self.assertEqual({'k': 1}, f('a'))
+        self.assertEqual({'k': 1}, f('a'))
+        self.assertEqual(2, len(mock_openai_api.call_args_list))
@@ -0,0 +1,76 @@
+import time
+from unittest import TestCase, mock
+
+import openai
+
+from slambda import LmFunction, Example
+from slambda.cache import MemoryCache
+from slambda.circuit import CircuitBreaker, CircuitState, CircuitOpenError
+from slambda.metrics import MetricsRegistry
+
+
+def fail(breaker, key, error=None):
+    breaker.allow(key)
+    breaker.record(key, error or openai.error.APIError('down'))
+
+
+class TestCircuitBreaker(TestCase):
+    def test_opens_on_failure_rate(self):
+        breaker = CircuitBreaker(failure_rate=0.5, min_calls=4, metrics=MetricsRegistry())
+        events = []
+        breaker.add_listener(lambda *args: events.append(args))
+        for _ in range(2):
+            breaker.allow('k')
+            breaker.record('k')
+        fail(breaker, 'k')
+        self.assertEqual(CircuitState.CLOSED, breaker.state('k'))
+        fail(breaker, 'k')
+        self.assertEqual(CircuitState.OPEN, breaker.state('k'))
+        self.assertEqual([('k', CircuitState.CLOSED, CircuitState.OPEN)], events)
+
+        with self.assertRaises(CircuitOpenError):
+            breaker.allow('k')
+        self.assertEqual(1, breaker.metrics.get('circuit_rejected', circuit='k'))
+        self.assertEqual(2, breaker.metrics.get('circuit_state', circuit='k'))
+        self.assertEqual(CircuitState.CLOSED, breaker.state('other'))
+
+    def test_invalid_request_is_not_failure(self):
+        breaker = CircuitBreaker(min_calls=1, metrics=MetricsRegistry())
+        fail(breaker, 'k', openai.error.InvalidRequestError('bad', 'messages'))
+        fail(breaker, 'k', ValueError())
+        self.assertEqual(CircuitState.CLOSED, breaker.state('k'))
+
+    def test_half_open(self):
+        breaker = CircuitBreaker(min_calls=1, open_seconds=0.01, half_open_max_calls=1, metrics=MetricsRegistry())
+        fail(breaker, 'k')
+        time.sleep(0.02)
+        self.assertEqual(CircuitState.HALF_OPEN, breaker.state('k'))
+
+        breaker.allow('k')
+        with self.assertRaises(CircuitOpenError):
+            breaker.allow('k')
+        breaker.record('k', openai.error.APIError('down'))
+        self.assertEqual(CircuitState.OPEN, breaker.state('k'))
+
+        time.sleep(0.02)
+        breaker.allow('k')
+        breaker.record('k')
+        self.assertEqual(CircuitState.CLOSED, breaker.state('k'))
+
+    @mock.patch('openai.ChatCompletion.create')
+    def test_lm_function(self, mock_openai_api):
+        mock_openai_api.return_value = {'choices': [{'message': {'content': 'v0'}}]}
+        f = LmFunction.create('do this', examples=[Example(input="i0", output='v1')])
+        f.cache = MemoryCache()
+        f.circuit_breaker = CircuitBreaker(min_calls=1, metrics=MetricsRegistry())
+        self.assertEqual('v0', f('cached'))
+
+        mock_openai_api.side_effect = openai.error.APIError('down')
+        with self.assertRaises(openai.error.APIError):
+            f('a')
+        with self.assertRaises(CircuitOpenError):
+            f('a')
+        self.assertEqual(2, len(mock_openai_api.call_args_list))
+
+        # served from cache while open
+        self.assertEqual('v0', f('cached'))
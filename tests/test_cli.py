@@ -0,0 +1,79 @@
+import io
+import json
+import os
+import sys
+import tempfile
+from contextlib import redirect_stderr, redirect_stdout
+from unittest import TestCase, mock
+
+from slambda.cli import main, parse_override
+from slambda.discovery import list_functions
+
+
+def upper(**kwargs):
+    content = kwargs['messages'][-1]['content']
+    return {'choices': [{'message': {'content': content.upper()}}]}
+
+
+class TestCli(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.tmp.name, name)
+
+    def test_parse_override(self):
+        self.assertEqual({'temperature': 0.5, 'stop': ['\n'], 'user': 'bob'},
+                         parse_override(['temperature=0.5', 'stop=["\\n"]', 'user=bob']))
+        with self.assertRaises(ValueError):
+            parse_override(['temperature'])
+
+    def test_list(self):
+        refs = [ref for ref, _ in list_functions()]
+        self.assertIn('slambda.contrib.sentiment:sentiment', refs)
+        self.assertIn('slambda.contrib.writing.grammar:fix_grammar', refs)
+        out = io.StringIO()
+        with redirect_stdout(out):
+            self.assertEqual(0, main(['list', 'slambda.contrib.sentiment']))
+        self.assertEqual(2, len(out.getvalue().splitlines()))
+
+    @mock.patch('openai.ChatCompletion.create')
+    def test_run(self, mock_openai_api):
+        mock_openai_api.side_effect = upper
+        with open(self.path('in.csv'), 'w') as fp:
+            fp.write('text\ngood\nbad\n')
+        err = io.StringIO()
+        with redirect_stderr(err):
+            code = main(['run', 'slambda.contrib.sentiment:sentiment', '-i', self.path('in.csv'), '--input-field',
+                         'text', '-o', self.path('out.jsonl'), '--set', 'temperature=0.5', '--retries', '2',
+                         '--cache', self.path('cache.db')])
+        self.assertEqual(0, code)
+        self.assertIn('2 records, 2 succeeded, 0 failed', err.getvalue())
+        with open(self.path('out.jsonl')) as fp:
+            rows = [json.loads(line) for line in fp]
+        self.assertEqual(['GOOD', 'BAD'], [r['output'] for r in rows])
+        self.assertEqual(0.5, mock_openai_api.call_args.kwargs['temperature'])
+
+        # served from cache.
+        with redirect_stderr(io.StringIO()):
+            main(['run', 'slambda.contrib.sentiment:sentiment', '-i', self.path('in.csv'), '--input-field', 'text',
+                  '-o', self.path('out2.jsonl'), '--set', 'temperature=0.5', '--cache', self.path('cache.db')])
+        self.assertEqual(2, mock_openai_api.call_count)
+
+    @mock.patch('openai.ChatCompletion.create')
+    def test_stdin_stdout(self, mock_openai_api):
+        mock_openai_api.side_effect = upper
+        stdin = io.TextIOWrapper(io.BytesIO(b'good\nbad\n'))
+        stdout = io.TextIOWrapper(io.BytesIO())
+        with mock.patch.object(sys, 'stdin', stdin), mock.patch.object(sys, 'stdout', stdout), \
+                redirect_stderr(io.StringIO()):
+            code = main(['run', 'slambda.contrib.sentiment:sentiment', '--input-format', 'text'])
+            stdout.flush()
+            output = stdout.buffer.getvalue().decode('utf-8')
+        self.assertEqual(0, code)
+        self.assertEqual([{'input': 'good', 'output': 'GOOD', 'error': None},
+                          {'input': 'bad', 'output': 'BAD', 'error': None}],
+                         [json.loads(line) for line in output.splitlines()])
@@ -0,0 +1,62 @@
+import json
+from unittest import TestCase
+
+from slambda import codec as codec_module
+from slambda.codec import JsonCodec, create_codec, get_codec, set_codec, CODECS
+from slambda.core import Definition, FunctionOutputConfig
+
+
+def installed_codecs():
+    ret = []
+    for name in CODECS:
+        try:
+            ret.append(create_codec(name))
+        except ImportError:
+            pass
+    return ret
+
+
+class TestCodec(TestCase):
+    def tearDown(self):
+        codec_module._codec = None
+
+    def test_roundtrip(self):
+        value = [{'name': 'ä', 'url': 'https://x', 'n': 1.5, 'l': [1, None, True]}]
+        for codec in installed_codecs():
+            self.assertEqual(value, codec.loads(codec.dumps(value)), codec.name)
+            self.assertEqual(value, codec.loads(codec.dumps(value).encode('utf-8')), codec.name)
+            self.assertEqual(json.dumps(value), codec.render(value), codec.name)
+
+    def test_sort_keys(self):
+        for codec in installed_codecs():
+            self.assertEqual('{"a":1,"b":2}', codec.dumps({'b': 2, 'a': 1}, sort_keys=True), codec.name)
+
+    def test_invalid(self):
+        for codec in installed_codecs():
+            with self.assertRaises(ValueError):
+                codec.loads('{"k": 0')
+
+    def test_select_codec(self):
+        with self.assertRaises(ValueError):
+            create_codec('nope')
+        set_codec('json')
+        self.assertIs(JsonCodec, type(get_codec()))
+
+        codec = JsonCodec()
+        set_codec(codec)
+        self.assertIs(codec, get_codec())
+
+    def test_definition_uses_codec(self):
+        class CountingCodec(JsonCodec):
+            calls = 0
+
+            def loads(self, s):
+                CountingCodec.calls += 1
+                return super().loads(s)
+
+        set_codec(CountingCodec())
+        v = Definition.cast_lm_output(FunctionOutputConfig(cast_to_json=True), '[{"a": 1}]')
+        self.assertEqual([{'a': 1}], v)
+        self.assertEqual(1, CountingCodec.calls)
+        self.assertEqual('[{"a": 1}]', Definition.render_output_example(FunctionOutputConfig(cast_to_json=True),
+                                                                        [{'a': 1}]))
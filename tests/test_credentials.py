@@ -0,0 +1,132 @@
+import time
+from unittest import TestCase, mock
+
+import openai
+
+from slambda import LmFunction, Example
+from slambda.credentials import Credential, CredentialPool, CredentialsExhaustedError, estimate_tokens
+from slambda.metrics import MetricsRegistry
+
+
+def resp(content, total_tokens=None):
+    ret = {'choices': [{'message': {'content': content}}]}
+    if total_tokens is not None:
+        ret['usage'] = {'total_tokens': total_tokens}
+    return ret
+
+
+class TestCredentialPool(TestCase):
+    def setUp(self):
+        self.fn = LmFunction.create('do this', examples=[Example(input="i0", output={'label': 'v1'})])
+        self.call_args = {'model': 'gpt-3.5-turbo', 'messages': [{'role': 'user', 'content': 'a' * 40}],
+                          'max_tokens': 10}
+
+    def test_estimate_tokens(self):
+        self.assertEqual(10 + 4 + 10, estimate_tokens(self.call_args))
+        self.assertEqual(10 + 4 + 20, estimate_tokens(dict(self.call_args, n=2)))
+
+    def test_headroom(self):
+        seen = []
+
+        def transport(**kwargs):
+            seen.append((kwargs['api_key'], kwargs.get('organization')))
+            return resp('{"label": "v2"}')
+
+        pool = CredentialPool([Credential('sk-1', rpm=2), Credential('sk-2', organization='org-2', rpm=4)],
+                              transport=transport, max_wait=0, metrics=MetricsRegistry())
+        for _ in range(6):
+            pool(**self.call_args)
+        self.assertEqual(2, seen.count(('sk-1', None)))
+        self.assertEqual(4, seen.count(('sk-2', 'org-2')))
+        # the key with the largest fraction of its quota left is used first.
+        self.assertEqual([('sk-1', None), ('sk-2', 'org-2'), ('sk-2', 'org-2')], seen[:3])
+        with self.assertRaises(CredentialsExhaustedError):
+            pool(**self.call_args)
+
+    def test_usage(self):
+        pool = CredentialPool([Credential('sk-1', tpm=100)], transport=lambda **kwargs: resp('a', 90),
+                              max_wait=0, metrics=MetricsRegistry())
+        pool(**self.call_args)
+        # the estimate of 24 tokens is corrected to 90 tokens.
+        with self.assertRaises(CredentialsExhaustedError):
+            pool(**self.call_args)
+
+    def test_failover(self):
+        def transport(**kwargs):
+            if kwargs['api_key'] == 'sk-1':
+                raise openai.error.RateLimitError('rate limited', headers={'retry-after': '60'})
+            return resp('{"label": "v2"}')
+
+        metrics = MetricsRegistry()
+        pool = CredentialPool([Credential('sk-1', rpm=100), Credential('sk-2', rpm=10)],
+                              transport=transport, max_wait=0, metrics=metrics)
+        self.assertEqual(resp('{"label": "v2"}'), pool(**self.call_args))
+        self.assertEqual(1, metrics.get('credential_ejections', credential='...sk-1'))
+        self.assertEqual(['sk-2'], [c.api_key for c in pool.available()])
+        pool(**self.call_args)
+        self.assertEqual(1, metrics.get('credential_requests', credential='...sk-1'))
+
+    def test_failures(self):
+        def transport(**kwargs):
+            if kwargs['api_key'] == 'sk-1':
+                raise openai.error.APIError('server error')
+            raise openai.error.InvalidRequestError('invalid', param=None)
+
+        pool = CredentialPool([Credential('sk-1', rpm=100), Credential('sk-2', rpm=10)], transport=transport,
+                              failure_threshold=2, max_wait=0, metrics=MetricsRegistry())
+        # invalid requests are not retried with another key.
+        with self.assertRaises(openai.error.InvalidRequestError):
+            pool(**self.call_args)
+        self.assertEqual(2, len(pool.available()))
+        with self.assertRaises(openai.error.InvalidRequestError):
+            pool(**self.call_args)
+        self.assertEqual(['sk-2'], [c.api_key for c in pool.available()])
+
+    def test_timeout(self):
+        seen = []
+
+        def transport(**kwargs):
+            seen.append((kwargs['api_key'], kwargs['request_timeout']))
+            if kwargs['api_key'] == 'sk-1':
+                time.sleep(0.1)
+                raise openai.error.Timeout('Request timed out')
+            return resp('{"label": "v2"}')
+
+        pool = CredentialPool([Credential('sk-1', rpm=100), Credential('sk-2', rpm=10)], transport=transport,
+                              failure_threshold=1, max_wait=0, min_timeout=0.05, metrics=MetricsRegistry())
+        # not enough time is left to fail over.
+        with self.assertRaises(openai.error.Timeout):
+            pool(**self.call_args, request_timeout=0.12)
+        self.assertEqual(['sk-1'], [k for k, _ in seen])
+        # the first key is ejected, it had the full timeout.
+        self.assertEqual(['sk-2'], [c.api_key for c in pool.available()])
+
+        seen.clear()
+        pool = CredentialPool([Credential('sk-1', rpm=100), Credential('sk-2', rpm=10)], transport=transport,
+                              failure_threshold=1, max_wait=0, min_timeout=0.05, metrics=MetricsRegistry())
+        self.assertEqual(resp('{"label": "v2"}'), pool(**self.call_args, request_timeout=1))
+        self.assertEqual(['sk-1', 'sk-2'], [k for k, _ in seen])
+        # the failover gets the time left.
+        self.assertLess(seen[1][1], 0.95)
+
+    def test_shortened_timeout(self):
+        def transport(**kwargs):
+            if kwargs['api_key'] == 'sk-1':
+                time.sleep(0.1)
+                raise openai.error.APIError('server error')
+            time.sleep(kwargs['request_timeout'])
+            raise openai.error.Timeout('Request timed out')
+
+        pool = CredentialPool([Credential('sk-1', rpm=100), Credential('sk-2', rpm=10)], transport=transport,
+                              failure_threshold=1, max_wait=0, min_timeout=0.05, metrics=MetricsRegistry())
+        with self.assertRaises(openai.error.Timeout):
+            pool(**self.call_args, request_timeout=0.3)
+        # the second key timed out on a shortened timeout, it is not ejected.
+        self.assertEqual(['sk-2'], [c.api_key for c in pool.available()])
+
+    @mock.patch('openai.ChatCompletion.create')
+    def test_function(self, mock_openai_api):
+        mock_openai_api.return_value = resp('{"label": "v2"}')
+        self.fn.transport = CredentialPool([Credential('sk-1'), Credential('sk-2')], metrics=MetricsRegistry())
+        self.assertEqual({'label': 'v2'}, self.fn('a'))
+        self.assertIn(mock_openai_api.call_args.kwargs['api_key'], ('sk-1', 'sk-2'))
@@ -0,0 +1,152 @@
+import time
+from unittest import TestCase, mock
+
+import openai
+
+from slambda import LmFunction, Example, GptApiOptions
+from slambda.circuit import CircuitBreaker, CircuitOpenError, is_upstream_failure
+from slambda.deadline import Deadline, DeadlineExceededError
+from slambda.hedging import HedgingPolicy
+from slambda.limiter import AdaptiveLimiter
+from slambda.metrics import MetricsRegistry
+from slambda.scheduler import Scheduler
+
+
+def slow_response(*args, **kwargs):
+    time.sleep(0.2)
+    return {'choices': [{'message': {'content': 'v0'}}]}
+
+
+class TestDeadline(TestCase):
+    def test_unbounded(self):
+        d = Deadline()
+        self.assertIsNone(d.remaining())
+        self.assertFalse(d.expired())
+        d.check('request')
+
+    def test_expired(self):
+        with self.assertRaises(ValueError):
+            Deadline(0)
+        d = Deadline(0.01)
+        self.assertLessEqual(d.remaining(), 0.01)
+        time.sleep(0.02)
+        self.assertTrue(d.expired())
+        self.assertEqual(0, d.remaining())
+        with self.assertRaises(DeadlineExceededError) as ctx:
+            d.check('retry')
+        self.assertEqual('retry', ctx.exception.stage)
+        self.assertIsInstance(ctx.exception, TimeoutError)
+
+    def test_bound(self):
+        with self.assertRaises(DeadlineExceededError) as ctx:
+            with Deadline(10).bound('request'):
+                raise openai.error.Timeout('read timeout')
+        self.assertEqual('request', ctx.exception.stage)
+        with self.assertRaises(openai.error.Timeout):
+            with Deadline().bound('request'):
+                raise openai.error.Timeout('read timeout')
+
+    def test_upstream_failure(self):
+        self.assertFalse(is_upstream_failure(DeadlineExceededError(1, 'queue')))
+        self.assertTrue(is_upstream_failure(TimeoutError()))
+        self.assertTrue(is_upstream_failure(openai.error.Timeout('read timeout')))
+        for stage, upstream in [('request', True), ('limiter', False), ('queue', False)]:
+            with self.assertRaises(DeadlineExceededError) as ctx:
+                with Deadline(10).bound(stage):
+                    raise openai.error.Timeout('read timeout')
+            self.assertEqual(upstream, is_upstream_failure(ctx.exception))
+        # expired before the request was sent.
+        self.assertFalse(is_upstream_failure(DeadlineExceededError(1, 'request')))
+
+
+class TestLmFunctionDeadline(TestCase):
+    @mock.patch('openai.ChatCompletion.create')
+    def test_request_timeout(self, mock_openai_api):
+        mock_openai_api.return_value = {'choices': [{'message': {'content': 'v0'}}]}
+        f = LmFunction.create('do this', examples=[Example(input="i0", output='v1')],
+                              gpt_opts=GptApiOptions(timeout=5))
+        self.assertEqual('v0', f('a'))
+        kwargs = mock_openai_api.call_args.kwargs
+        self.assertNotIn('timeout', kwargs)
+        self.assertLessEqual(kwargs['request_timeout'], 5)
+        self.assertGreater(kwargs['request_timeout'], 4)
+
+        f('a', __override={'timeout': 1})
+        self.assertLessEqual(mock_openai_api.call_args.kwargs['request_timeout'], 1)
+
+        f.definition.gpt_opts.timeout = None
+        f('a')
+        self.assertNotIn('request_timeout', mock_openai_api.call_args.kwargs)
+
+    @mock.patch('openai.ChatCompletion.create')
+    def test_network_timeout(self, mock_openai_api):
+        mock_openai_api.side_effect = openai.error.Timeout('read timeout')
+        f = LmFunction.create('do this', examples=[Example(input="i0", output='v1')])
+        with self.assertRaises(DeadlineExceededError) as ctx:
+            f('a', __override={'timeout': 1})
+        self.assertEqual('request', ctx.exception.stage)
+        with self.assertRaises(openai.error.Timeout):
+            f('a')
+
+    @mock.patch('openai.ChatCompletion.create')
+    def test_queue_timeout(self, mock_openai_api):
+        mock_openai_api.return_value = {'choices': [{'message': {'content': 'v0'}}]}
+        scheduler = Scheduler(max_concurrency=1, metrics=MetricsRegistry())
+        limiter = AdaptiveLimiter(initial_limit=1, metrics=MetricsRegistry())
+        f = LmFunction.create('do this', examples=[Example(input="i0", output='v1')])
+
+        f.scheduler = scheduler
+        scheduler.acquire()
+        start = time.monotonic()
+        with self.assertRaises(DeadlineExceededError) as ctx:
+            f('a', __override={'timeout': 0.05})
+        self.assertEqual('queue', ctx.exception.stage)
+        self.assertLess(time.monotonic() - start, 1)
+        scheduler.release('default')
+
+        f.scheduler = None
+        f.limiter = limiter
+        limiter.acquire('gpt-3.5-turbo')
+        with self.assertRaises(DeadlineExceededError) as ctx:
+            f('a', __override={'timeout': 0.05})
+        self.assertEqual('limiter', ctx.exception.stage)
+        limiter.release('gpt-3.5-turbo', 0.01)
+        self.assertEqual('v0', f('a', __override={'timeout': 1}))
+        mock_openai_api.assert_called_once()
+
+    @mock.patch('openai.ChatCompletion.create')
+    def test_hedging_timeout(self, mock_openai_api):
+        mock_openai_api.side_effect = slow_response
+        f = LmFunction.create('do this', examples=[Example(input="i0", output='v1')])
+        f.hedging = HedgingPolicy(delay=0.01, metrics=MetricsRegistry())
+        start = time.monotonic()
+        with self.assertRaises(DeadlineExceededError):
+            f('a', __override={'timeout': 0.05})
+        self.assertLess(time.monotonic() - start, 0.15)
+
+    @mock.patch('openai.ChatCompletion.create')
+    def test_cast_retries_share_budget(self, mock_openai_api):
+        def bad_output(*args, **kwargs):
+            time.sleep(0.03)
+            return {'choices': [{'message': {'content': 'not json'}}]}
+
+        mock_openai_api.side_effect = bad_output
+        f = LmFunction.create('do this', examples=[Example(input="i0", output={'a': 1})], cast_retries=100)
+        with self.assertRaises(DeadlineExceededError) as ctx:
+            f('a', __override={'timeout': 0.1})
+        self.assertEqual('retry', ctx.exception.stage)
+        self.assertLess(mock_openai_api.call_count, 10)
+
+
+class TestCircuitDeadline(TestCase):
+    @mock.patch('openai.ChatCompletion.create')
+    def test_upstream_timeout_opens_circuit(self, mock_openai_api):
+        mock_openai_api.side_effect = openai.error.Timeout('read timeout')
+        breaker = CircuitBreaker(failure_rate=0.5, min_calls=4, metrics=MetricsRegistry())
+        f = LmFunction.create('do this', examples=[Example(input="i0", output='v1')])
+        f.circuit_breaker = breaker
+        for _ in range(4):
+            with self.assertRaises(DeadlineExceededError):
+                f('a', __override={'timeout': 5})
+        with self.assertRaises(CircuitOpenError):
+            f('a', __override={'timeout': 5})
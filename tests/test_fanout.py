@@ -0,0 +1,53 @@
+import asyncio
+import time
+from unittest import TestCase, mock
+
+from slambda import LmFunction, Example
+from slambda.fanout import fanout, afanout
+
+
+def slow(value):
+    def fn(x):
+        time.sleep(0.1)
+        return f'{value}:{x}'
+
+    return fn
+
+
+def fail(x):
+    raise ValueError(x)
+
+
+class TestFanout(TestCase):
+    def test_fanout(self):
+        start = time.monotonic()
+        ret = fanout({'a': slow('a'), 'b': slow('b'), 'c': fail}, 'x')
+        self.assertLess(time.monotonic() - start, 0.25)
+        self.assertFalse(ret.ok)
+        self.assertEqual({'a': 'a:x', 'b': 'b:x'}, ret.outputs)
+        self.assertEqual('b:x', ret['b'])
+        with self.assertRaises(ValueError):
+            _ = ret['c']
+
+    def test_afanout(self):
+        async def run():
+            return await asyncio.gather(
+                afanout({'a': slow('a'), 'b': slow('b')}, 'x'),
+                afanout({'a': slow('a'), 'c': fail}, 'y'),
+            )
+
+        start = time.monotonic()
+        first, second = asyncio.run(run())
+        self.assertLess(time.monotonic() - start, 0.25)
+        self.assertEqual({'a': 'a:x', 'b': 'b:x'}, first.outputs)
+        self.assertIsInstance(second.errors['c'], ValueError)
+
+    @mock.patch('openai.ChatCompletion.create')
+    def test_lm_functions(self, mock_openai_api):
+        mock_openai_api.return_value = {'choices': [{'message': {'content': 'v0'}}]}
+        f = LmFunction.create('do this', examples=[Example(input="i0", output='v1')], name='f')
+        g = LmFunction.create('do that', examples=[Example(input="i0", output='v1')], name='g')
+        self.assertEqual({'f': 'v0', 'g': 'v0'}, fanout([f, g], 'a').outputs)
+        with self.assertRaises(ValueError):
+            fanout([f, f], 'a')
+        self.assertEqual('v0', asyncio.run(f.acall('a')))
@@ -0,0 +1,127 @@
+import csv
+import json
+import os
+import tempfile
+from unittest import TestCase, mock
+
+from slambda import LmFunction, Example
+from slambda.checkpoint import CheckpointMismatchError
+from slambda.files import process_file, read_records, record_to_input
+
+
+def upper(**kwargs):
+    content = kwargs['messages'][-1]['content']
+    if content == 'boom':
+        raise RuntimeError('boom')
+    return {'choices': [{'message': {'content': content.upper()}}]}
+
+
+class TestFiles(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.tmp.name, name)
+
+    def write_jsonl(self, name, rows):
+        with open(self.path(name), 'w') as out:
+            for row in rows:
+                out.write(json.dumps(row) + '\n')
+        return self.path(name)
+
+    def read_jsonl(self, name):
+        with open(self.path(name)) as fd:
+            return [json.loads(line) for line in fd]
+
+    def test_record_to_input(self):
+        unary = LmFunction.create('do this', examples=[Example(input="i0", output='v1')])
+        self.assertEqual('a', record_to_input(unary, 'a'))
+        self.assertEqual('a', record_to_input(unary, {'text': 'a'}, 'text'))
+        with self.assertRaises(ValueError):
+            record_to_input(unary, {'text': 'a'})
+
+        kw = LmFunction.create('do this', examples=[Example(input={'a': '1', 'b': '2'}, output='v1')],
+                               message_template='{a} and {b}')
+        self.assertEqual({'a': 1, 'b': 2}, record_to_input(kw, {'a': 1, 'b': 2, 'id': 3}))
+        with self.assertRaises(ValueError):
+            record_to_input(kw, {'a': 1})
+
+    @mock.patch('openai.ChatCompletion.create')
+    def test_process_jsonl(self, mock_openai_api):
+        mock_openai_api.side_effect = upper
+        f = LmFunction.create('do this', examples=[Example(input="i0", output='v1')])
+        inp = self.write_jsonl('in.jsonl', [{'id': i, 'text': t} for i, t in enumerate(['a', 'boom', 'c'])])
+        stats = process_file(f, inp, self.path('out.jsonl'), input_field='text', concurrency=2)
+        self.assertEqual((3, 2, 1), (stats.total, stats.succeeded, stats.failed))
+        rows = self.read_jsonl('out.jsonl')
+        self.assertEqual([0, 1, 2], [r['id'] for r in rows])
+        self.assertEqual(['A', None, 'C'], [r['output'] for r in rows])
+        self.assertEqual('RuntimeError: boom', rows[1]['error'])
+
+        with self.assertRaises(RuntimeError):
+            process_file(f, inp, self.path('out.jsonl'), input_field='text', raise_on_error=True)
+
+    @mock.patch('openai.ChatCompletion.create')
+    def test_process_csv(self, mock_openai_api):
+        mock_openai_api.side_effect = upper
+        f = LmFunction.create('do this', examples=[Example(input={'a': '1', 'b': '2'}, output='v1')],
+                              message_template='{a} and {b}')
+        with open(self.path('in.csv'), 'w', newline='') as out:
+            w = csv.writer(out)
+            w.writerow(['a', 'b'])
+            w.writerow(['x', 'y'])
+            w.writerow(['z', 'w'])
+        process_file(f, self.path('in.csv'), self.path('out.csv'))
+        with open(self.path('out.csv'), newline='') as fd:
+            rows = list(csv.DictReader(fd))
+        self.assertEqual(['X AND Y', 'Z AND W'], [r['output'] for r in rows])
+        self.assertEqual(['x', 'z'], [r['a'] for r in rows])
+
+    def test_read_records(self):
+        with open(self.path('in.txt'), 'w') as out:
+            out.write('a\nb\n')
+        self.assertEqual(['a', 'b'], list(read_records(self.path('in.txt'))))
+        with self.assertRaises(ValueError):
+            list(read_records(self.path('in.txt'), 'xml'))
+
+    @mock.patch('openai.ChatCompletion.create')
+    def test_checkpoint_resume(self, mock_openai_api):
+        calls = []
+        fail = {'c'}
+
+        def flaky(**kwargs):
+            content = kwargs['messages'][-1]['content']
+            calls.append(content)
+            if content in fail:
+                raise RuntimeError('quota')
+            return {'choices': [{'message': {'content': content.upper()}}]}
+
+        mock_openai_api.side_effect = flaky
+        f = LmFunction.create('do this', examples=[Example(input="i0", output='v1')])
+        inp = self.write_jsonl('in.jsonl', [{'text': t} for t in ['a', 'b', 'c', 'd']])
+        cp = self.path('job.db')
+
+        stats = process_file(f, inp, self.path('out.jsonl'), input_field='text', checkpoint=cp)
+        self.assertEqual((4, 3, 1), (stats.total, stats.succeeded, stats.failed))
+        self.assertEqual(['A', 'B', None, 'D'], [r['output'] for r in self.read_jsonl('out.jsonl')])
+
+        calls.clear()
+        fail.clear()
+        stats = process_file(f, inp, self.path('out.jsonl'), input_field='text', checkpoint=cp)
+        self.assertEqual(['c'], calls)
+        self.assertEqual((4, 4, 0), (stats.total, stats.succeeded, stats.failed))
+        self.assertEqual(['A', 'B', 'C', 'D'], [r['output'] for r in self.read_jsonl('out.jsonl')])
+
+        with self.assertRaises(CheckpointMismatchError):
+            process_file(f, inp, self.path('out.jsonl'), input_field='text', output_field='x', checkpoint=cp)
+        with self.assertRaises(CheckpointMismatchError):
+            process_file(f, inp, self.path('out.jsonl'), input_field='text', checkpoint=cp,
+                         __override={'temperature': 0})
+        # the input file changed.
+        self.write_jsonl('in.jsonl', [{'text': t} for t in ['a', 'b', 'c', 'd', 'e']])
+        with self.assertRaises(CheckpointMismatchError) as ctx:
+            process_file(f, inp, self.path('out.jsonl'), input_field='text', checkpoint=cp)
+        self.assertEqual('input_size', ctx.exception.key)
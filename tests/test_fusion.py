@@ -0,0 +1,86 @@
+import json
+from unittest import TestCase, mock
+
+import openai
+
+from slambda import LmFunction, Example
+from slambda.fusion import FusedFunction
+from slambda.metrics import metrics
+
+
+def resp(content):
+    return {'choices': [{'message': {'content': content}}]}
+
+
+class TestFusedFunction(TestCase):
+    def setUp(self):
+        metrics.reset()
+        self.sentiment = LmFunction.create('sentiment', examples=[Example(input='good', output='positive')],
+                                           name='sentiment')
+        self.aspects = LmFunction.create('aspects', examples=[Example(input='good camera', output=[
+            {'aspect': 'camera', 'sentiment': 'positive'}])], name='aspects')
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            FusedFunction([self.sentiment])
+        keyword = LmFunction.create('kw', examples=[Example(input={'a': 'b'}, output='c')], name='kw')
+        with self.assertRaises(ValueError):
+            FusedFunction([self.sentiment, keyword])
+
+    @mock.patch('openai.ChatCompletion.create')
+    def test_fused(self, mock_openai_api):
+        mock_openai_api.return_value = resp(json.dumps({
+            'sentiment': 'negative',
+            'aspects': [{'aspect': 'battery', 'sentiment': 'negative'}],
+        }))
+        fused = FusedFunction([self.sentiment, self.aspects])
+        ret = fused('bad battery')
+        self.assertTrue(ret.ok)
+        self.assertEqual('negative', ret['sentiment'])
+        self.assertEqual([{'aspect': 'battery', 'sentiment': 'negative'}], ret['aspects'])
+        mock_openai_api.assert_called_once()
+        system = mock_openai_api.call_args.kwargs['messages'][0]['content']
+        self.assertIn('Task sentiment: sentiment', system)
+        self.assertIn('Example answer: [{"aspect": "camera", "sentiment": "positive"}]', system)
+        self.assertEqual('bad battery', mock_openai_api.call_args.kwargs['messages'][-1]['content'])
+
+    @mock.patch('openai.ChatCompletion.create')
+    def test_fallback(self, mock_openai_api):
+        mock_openai_api.side_effect = [
+            resp(json.dumps({'s': 'negative', 'a': 'not a list'})),
+            resp('[{"aspect": "battery", "sentiment": "negative"}]'),
+        ]
+        fused = FusedFunction({'s': self.sentiment, 'a': self.aspects})
+        ret = fused('bad battery')
+        self.assertTrue(ret.ok)
+        self.assertEqual([{'aspect': 'battery', 'sentiment': 'negative'}], ret['a'])
+        self.assertEqual(2, mock_openai_api.call_count)
+        self.assertEqual(1, metrics.get('fused_fallback', function='a'))
+
+        def answer(messages, **kwargs):
+            return resp({'sentiment': 'positive', 'aspects': '[]'}.get(messages[0]['content'], 'not json'))
+
+        mock_openai_api.side_effect = answer
+        ret = fused('good')
+        self.assertEqual({'s': 'positive', 'a': []}, ret.outputs)
+
+    @mock.patch('openai.ChatCompletion.create')
+    def test_no_fallback(self, mock_openai_api):
+        mock_openai_api.return_value = resp(json.dumps({'sentiment': 'negative'}))
+        fused = FusedFunction([self.sentiment, self.aspects], fallback=False)
+        ret = fused('bad battery')
+        self.assertEqual({'sentiment': 'negative'}, ret.outputs)
+        self.assertIsInstance(ret.errors['aspects'], KeyError)
+        mock_openai_api.assert_called_once()
+
+    @mock.patch('openai.ChatCompletion.create')
+    def test_upstream_error(self, mock_openai_api):
+        mock_openai_api.side_effect = openai.error.RateLimitError('rate limited')
+        fused = FusedFunction([self.sentiment, self.aspects])
+        ret = fused('bad battery')
+        self.assertEqual({}, ret.outputs)
+        self.assertIsInstance(ret.errors['sentiment'], openai.error.RateLimitError)
+        self.assertIsInstance(ret.errors['aspects'], openai.error.RateLimitError)
+        # the functions are not called separately.
+        mock_openai_api.assert_called_once()
+        self.assertEqual(0, metrics.get('fused_fallback', function='sentiment'))
@@ -0,0 +1,129 @@
+import threading
+import time
+from unittest import TestCase, mock
+
+from slambda import LmFunction, Example
+from slambda.hedging import HedgingPolicy, LatencyTracker
+from slambda.metrics import MetricsRegistry
+
+
+class TestHedging(TestCase):
+    def test_latency_tracker(self):
+        t = LatencyTracker(window=10)
+        self.assertIsNone(t.percentile(50))
+        for i in range(1, 11):
+            t.observe(i)
+        self.assertEqual(5, t.percentile(50))
+        self.assertEqual(10, t.percentile(99))
+        t.observe(11)
+        self.assertEqual(10, len(t))
+        self.assertEqual(2, t.percentile(1))
+
+    def test_invalid_policy(self):
+        with self.assertRaises(ValueError):
+            HedgingPolicy()
+        with self.assertRaises(ValueError):
+            HedgingPolicy(percentile=0)
+
+    def test_adaptive_delay(self):
+        policy = HedgingPolicy(delay=1, percentile=50, min_samples=3, metrics=MetricsRegistry())
+        self.assertEqual(1, policy.hedge_delay('f'))
+        for v in [0.1, 0.2, 0.3]:
+            policy.tracker('f').observe(v)
+        self.assertEqual(0.2, policy.hedge_delay('f'))
+        self.assertEqual(1, policy.hedge_delay('g'))
+
+    def test_fast_response_not_hedged(self):
+        registry = MetricsRegistry()
+        policy = HedgingPolicy(delay=1, metrics=registry)
+        self.assertEqual('ok', policy.execute('f', lambda: 'ok'))
+        self.assertEqual(1, registry.get('hedge_requests', function='f'))
+        self.assertEqual(0, registry.get('hedge_fired', function='f'))
+
+    def test_hedge_wins(self):
+        registry = MetricsRegistry()
+        policy = HedgingPolicy(delay=0.01, max_extra_load=1, metrics=registry)
+        counter = {'n': 0}
+        lock = threading.Lock()
+        release = threading.Event()
+
+        def send():
+            with lock:
+                counter['n'] += 1
+                n = counter['n']
+            if n == 1:
+                release.wait(5)
+                return 'slow'
+            return 'fast'
+
+        self.assertEqual('fast', policy.execute('f', send))
+        release.set()
+        self.assertEqual(1, registry.get('hedge_fired', function='f'))
+        self.assertEqual(1, registry.get('hedge_won', function='f'))
+
+    def test_loser_latency_observed(self):
+        policy = HedgingPolicy(delay=0.01, max_extra_load=1, metrics=MetricsRegistry())
+        counter = {'n': 0}
+        lock = threading.Lock()
+
+        def send():
+            with lock:
+                counter['n'] += 1
+                n = counter['n']
+            time.sleep(0.1 if n == 1 else 0)
+            return n
+
+        self.assertEqual(2, policy.execute('f', send))
+        time.sleep(0.2)
+        # the latency of the slow primary is observed too.
+        self.assertEqual(2, len(policy.tracker('f')))
+        self.assertGreaterEqual(policy.tracker('f').percentile(100), 0.1)
+
+    def test_unbounded_concurrency(self):
+        policy = HedgingPolicy(delay=10, metrics=MetricsRegistry())
+        barrier = threading.Barrier(40, timeout=5)
+
+        def send():
+            barrier.wait()
+            return 'ok'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(policy.execute('f', send))) for _ in range(40)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(['ok'] * 40, results)
+
+    def test_extra_load_cap(self):
+        registry = MetricsRegistry()
+        policy = HedgingPolicy(delay=0, max_extra_load=0, metrics=registry)
+        policy._credit = 0
+
+        def send():
+            time.sleep(0.01)
+            return 'ok'
+
+        for _ in range(3):
+            self.assertEqual('ok', policy.execute('f', send))
+        self.assertEqual(0, registry.get('hedge_fired', function='f'))
+        self.assertEqual(3, registry.get('hedge_budget_exhausted', function='f'))
+
+    def test_error_propagates(self):
+        policy = HedgingPolicy(delay=1, metrics=MetricsRegistry())
+
+        def send():
+            raise RuntimeError('boom')
+
+        with self.assertRaises(RuntimeError):
+            policy.execute('f', send)
+
+    @mock.patch('openai.ChatCompletion.create')
+    def test_lm_function_hedging(self, mock_openai_api):
+        mock_openai_api.return_value = {'choices': [{'message': {'content': 'v0'}}]}
+        registry = MetricsRegistry()
+        f = LmFunction.create('do this', examples=[Example(input="i0", output='v1')], name='hedged')
+        f.hedging = HedgingPolicy(delay=1, metrics=registry)
+        self.assertEqual('v0', f('as'))
+        self.assertEqual(1, registry.get('hedge_requests', function='hedged'))
+        self.assertEqual(1, len(mock_openai_api.call_args_list))
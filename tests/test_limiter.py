@@ -0,0 +1,99 @@
+import threading
+from unittest import TestCase, mock
+
+import openai
+
+from slambda import LmFunction, Example
+from slambda.limiter import AdaptiveLimiter
+from slambda.metrics import MetricsRegistry
+
+
+class TestAdaptiveLimiter(TestCase):
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            AdaptiveLimiter(initial_limit=0)
+        with self.assertRaises(ValueError):
+            AdaptiveLimiter(decrease=1)
+
+    def test_additive_increase(self):
+        limiter = AdaptiveLimiter(initial_limit=2, max_limit=3, metrics=MetricsRegistry())
+        # 2 -> 2.5 -> 2.9 -> 3.24
+        for _ in range(3):
+            limiter.acquire('m')
+            limiter.release('m', 0.1)
+        self.assertEqual(3, limiter.limit('m'))
+        for _ in range(10):
+            limiter.acquire('m')
+            limiter.release('m', 0.1)
+        self.assertEqual(3, limiter.limit('m'))
+        self.assertEqual(3, limiter.metrics.get('adaptive_limit', model='m'))
+        self.assertEqual(2, limiter.limit('other'))
+
+    def test_multiplicative_decrease(self):
+        limiter = AdaptiveLimiter(initial_limit=8, cooldown=0, metrics=MetricsRegistry())
+        limiter.acquire('m')
+        limiter.release('m', 0.1, openai.error.RateLimitError('slow down'))
+        self.assertEqual(4, limiter.limit('m'))
+
+        limiter.acquire('m')
+        limiter.release('m', 0.1, ValueError())
+        self.assertEqual(4, limiter.limit('m'))
+        self.assertEqual(1, limiter.metrics.get('adaptive_decrease', model='m'))
+
+    def test_cooldown(self):
+        limiter = AdaptiveLimiter(initial_limit=8, cooldown=60, metrics=MetricsRegistry())
+        for _ in range(3):
+            limiter.acquire('m')
+            limiter.release('m', 0.1, openai.error.RateLimitError('slow down'))
+        self.assertEqual(4, limiter.limit('m'))
+
+    def test_latency_spike(self):
+        limiter = AdaptiveLimiter(initial_limit=8, cooldown=0, latency_factor=3, metrics=MetricsRegistry())
+        limiter.acquire('m')
+        limiter.release('m', 1.0)
+        limiter.acquire('m')
+        limiter.release('m', 10.0)
+        self.assertEqual(4, limiter.limit('m'))
+
+        limiter = AdaptiveLimiter(initial_limit=8, latency_threshold=0.5, metrics=MetricsRegistry())
+        limiter.acquire('m')
+        limiter.release('m', 1.0)
+        self.assertEqual(4, limiter.limit('m'))
+
+    def test_latency_shift(self):
+        limiter = AdaptiveLimiter(initial_limit=8, cooldown=0, latency_factor=3, metrics=MetricsRegistry())
+        limiter.acquire('m')
+        limiter.release('m', 1.0)
+        # the latency increases for good, the moving average follows it and the limit grows again.
+        for _ in range(3):
+            limiter.acquire('m')
+            limiter.release('m', 5.0)
+        self.assertEqual(1, limiter.limit('m'))
+        for _ in range(50):
+            limiter.acquire('m')
+            limiter.release('m', 5.0)
+        self.assertGreater(limiter.limit('m'), 4)
+
+    def test_blocks_at_limit(self):
+        limiter = AdaptiveLimiter(initial_limit=1, metrics=MetricsRegistry())
+        limiter.acquire('m')
+        with self.assertRaises(TimeoutError):
+            limiter.acquire('m', timeout=0.01)
+        t = threading.Timer(0.01, lambda: limiter.release('m', 0.01))
+        t.start()
+        limiter.acquire('m', timeout=2)
+        t.join()
+
+    @mock.patch('openai.ChatCompletion.create')
+    def test_lm_function(self, mock_openai_api):
+        mock_openai_api.side_effect = [
+            openai.error.RateLimitError('slow down'),
+            {'choices': [{'message': {'content': 'v0'}}]},
+        ]
+        limiter = AdaptiveLimiter(initial_limit=4, metrics=MetricsRegistry())
+        f = LmFunction.create('do this', examples=[Example(input="i0", output='v1')])
+        f.limiter = limiter
+        with self.assertRaises(openai.error.RateLimitError):
+            f('a')
+        self.assertEqual(2, limiter.limit('gpt-3.5-turbo'))
+        self.assertEqual('v0', f('a'))
@@ -1,6 +1,7 @@
 import unittest
 from unittest import TestCase
-from slambda import Role, Message
+from slambda import Role, Message, LmFunction, Example
+from slambda.gpt import wire_message
 
 
 class TestMessage(TestCase):
@@ -32,6 +33,35 @@ class TestMessage(TestCase):
         expected = Message(role=Role.system, content=content, name='example_assistant')
         self.assertEqual(expected, Message.example_assistant(content))
 
+    def test_to_wire(self):
+        for m in [
+            Message.user('a', name='n'),
+            Message.assistant('b'),
+            Message.system('c'),
+            Message.example_user('d'),
+            Message.example_assistant('e'),
+        ]:
+            self.assertEqual(m.model_dump(exclude_none=True, mode='json'), m.to_wire())
+        self.assertEqual({'role': 'user', 'content': 'x'}, wire_message(Role.user, 'x'))
+        self.assertEqual({'role': 'user', 'content': 'x', 'name': 'n'}, wire_message('user', 'x', 'n'))
+
+    def test_wire_message_stack(self):
+        f = LmFunction.create('do this', examples=[Example('a', 'b')])
+        stack = f.definition.wire_message_stack()
+        self.assertIs(stack, f.definition.wire_message_stack())
+        self.assertEqual([m.to_wire() for m in f.definition.message_stack], list(stack))
+
+        f.definition.message_stack.append(Message.user('extra'))
+        stack = f.definition.wire_message_stack()
+        self.assertEqual({'role': 'user', 'content': 'extra'}, stack[-1])
+
+        # in place edits that keep the length of the stack are seen.
+        f.definition.message_stack[-1] = Message.user('edited')
+        self.assertEqual({'role': 'user', 'content': 'edited'}, f.definition.wire_message_stack()[-1])
+        f.definition.message_stack[-1].content = 'changed'
+        self.assertEqual({'role': 'user', 'content': 'changed'}, f.definition.wire_message_stack()[-1])
+        self.assertIs(f.definition.wire_message_stack(), f.definition.wire_message_stack())
+
 
 if __name__ == '__main__':
     unittest.main()
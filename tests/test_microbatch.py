@@ -0,0 +1,134 @@
+import json
+from unittest import TestCase, mock
+
+import openai
+
+from slambda import LmFunction, Example
+from slambda.cache import MemoryCache
+from slambda.metrics import metrics
+from slambda.microbatch import MicroBatcher
+
+
+def resp(content):
+    return {'choices': [{'message': {'content': content}}]}
+
+
+def answer(messages, **kwargs):
+    """
+    Answer packed requests with the upper case of every input, and single requests with the upper case input.
+    """
+    if messages[0]['content'].startswith('Complete the task below'):
+        inputs = json.loads(messages[-1]['content'])
+        return resp(json.dumps({k: v.upper() for k, v in inputs.items()}))
+    return resp(messages[-1]['content'].upper())
+
+
+class TestMicroBatcher(TestCase):
+    def setUp(self):
+        metrics.reset()
+        self.fn = LmFunction.create('upper case', examples=[Example(input='a', output='A')], name='upper')
+
+    def test_invalid(self):
+        keyword = LmFunction.create('kw', examples=[Example(input={'a': 'b'}, output='c')])
+        with self.assertRaises(ValueError):
+            MicroBatcher(keyword)
+
+    @mock.patch('openai.ChatCompletion.create')
+    def test_packed(self, mock_openai_api):
+        mock_openai_api.side_effect = answer
+        with MicroBatcher(self.fn, max_batch_size=3, max_wait=1) as batcher:
+            futures = [batcher.submit(t) for t in ['x', 'y', 'z']]
+            self.assertEqual(['X', 'Y', 'Z'], [f.result(timeout=5) for f in futures])
+        mock_openai_api.assert_called_once()
+        system = mock_openai_api.call_args.kwargs['messages'][0]['content']
+        self.assertIn('Task upper: upper case', system)
+        packed_input = mock_openai_api.call_args.kwargs['messages'][-1]['content']
+        self.assertEqual({'0': 'x', '1': 'y', '2': 'z'}, json.loads(packed_input))
+        self.assertEqual(1, metrics.get('microbatch_packed', function=self.fn.key))
+        self.assertEqual(3, metrics.get('microbatch_calls', function=self.fn.key))
+
+    @mock.patch('openai.ChatCompletion.create')
+    def test_max_wait(self, mock_openai_api):
+        mock_openai_api.side_effect = answer
+        with MicroBatcher(self.fn, max_batch_size=16, max_wait=0.01) as batcher:
+            self.assertEqual('X', batcher('x'))
+        # a single call is sent as is.
+        self.assertEqual('x', mock_openai_api.call_args.kwargs['messages'][-1]['content'])
+        self.assertEqual(0, metrics.get('microbatch_packed', function=self.fn.key))
+
+    @mock.patch('openai.ChatCompletion.create')
+    def test_cache(self, mock_openai_api):
+        mock_openai_api.side_effect = answer
+        self.fn.cache = MemoryCache()
+        self.fn('x')
+        with MicroBatcher(self.fn, max_batch_size=3, max_wait=1) as batcher:
+            futures = [batcher.submit(t) for t in ['x', 'y', 'z']]
+            self.assertEqual(['X', 'Y', 'Z'], [f.result(timeout=5) for f in futures])
+        self.assertEqual(2, mock_openai_api.call_count)
+        packed_input = mock_openai_api.call_args.kwargs['messages'][-1]['content']
+        self.assertEqual({'0': 'y', '1': 'z'}, json.loads(packed_input))
+        # answers of the packed request are cached for batched calls only.
+        with MicroBatcher(self.fn, max_batch_size=2, max_wait=1) as batcher:
+            futures = [batcher.submit(t) for t in ['y', 'z']]
+            self.assertEqual(['Y', 'Z'], [f.result(timeout=5) for f in futures])
+        self.assertEqual(2, mock_openai_api.call_count)
+        self.assertEqual('Z', self.fn('z'))
+        self.assertEqual(3, mock_openai_api.call_count)
+        self.assertEqual('z', mock_openai_api.call_args.kwargs['messages'][-1]['content'])
+
+    @mock.patch('openai.ChatCompletion.create')
+    def test_fallback(self, mock_openai_api):
+        def partial_answer(messages, **kwargs):
+            if messages[0]['content'].startswith('Complete the task below'):
+                return resp(json.dumps({'0': 'X'}))
+            return resp(messages[-1]['content'].upper())
+
+        mock_openai_api.side_effect = partial_answer
+        with MicroBatcher(self.fn, max_batch_size=2, max_wait=1) as batcher:
+            futures = [batcher.submit(t) for t in ['x', 'y']]
+            self.assertEqual(['X', 'Y'], [f.result(timeout=5) for f in futures])
+        self.assertEqual(2, mock_openai_api.call_count)
+        self.assertEqual(1, metrics.get('microbatch_fallback', function=self.fn.key))
+
+        with MicroBatcher(self.fn, max_batch_size=2, max_wait=1, fallback=False) as batcher:
+            futures = [batcher.submit(t) for t in ['x', 'y']]
+            self.assertEqual('X', futures[0].result(timeout=5))
+            with self.assertRaises(KeyError):
+                futures[1].result(timeout=5)
+
+    @mock.patch('openai.ChatCompletion.create')
+    def test_invalid_input(self, mock_openai_api):
+        mock_openai_api.side_effect = answer
+        for cache in (None, MemoryCache()):
+            self.fn.cache = cache
+            with MicroBatcher(self.fn, max_batch_size=3, max_wait=0.1) as batcher:
+                futures = [batcher.submit('x'), batcher.submit(123), batcher.submit(None)]
+                self.assertEqual('X', futures[0].result(timeout=5))
+                for f in futures[1:]:
+                    with self.assertRaises(ValueError):
+                        f.result(timeout=5)
+        # only the valid call is sent.
+        self.assertEqual('x', mock_openai_api.call_args.kwargs['messages'][-1]['content'])
+
+    @mock.patch('openai.ChatCompletion.create')
+    def test_upstream_error(self, mock_openai_api):
+        mock_openai_api.side_effect = openai.error.APIError('server error')
+        with MicroBatcher(self.fn, max_batch_size=2, max_wait=1) as batcher:
+            futures = [batcher.submit(t) for t in ['x', 'y']]
+            for f in futures:
+                with self.assertRaises(openai.error.APIError):
+                    f.result(timeout=5)
+        # the calls are not sent separately.
+        self.assertEqual(1, mock_openai_api.call_count)
+        self.assertEqual(0, metrics.get('microbatch_fallback', function=self.fn.key))
+
+    @mock.patch('openai.ChatCompletion.create')
+    def test_override(self, mock_openai_api):
+        mock_openai_api.side_effect = answer
+        with MicroBatcher(self.fn, max_batch_size=2, max_wait=0.2) as batcher:
+            futures = [batcher.submit('x'), batcher.submit('y', __override={'temperature': 0}),
+                       batcher.submit('z', __override={'n': 2})]
+            self.assertEqual(['X', 'Y'], [f.result(timeout=5) for f in futures[:2]])
+            futures[2].result(timeout=5)
+        self.assertEqual(0, metrics.get('microbatch_packed', function=self.fn.key))
+        self.assertEqual(3, mock_openai_api.call_count)
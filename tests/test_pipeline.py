@@ -0,0 +1,99 @@
+import threading
+import time
+from unittest import TestCase, mock
+
+from slambda import LmFunction, Example
+from slambda.pipeline import Pipeline
+
+
+class TestPipeline(TestCase):
+    def test_invalid(self):
+        pipe = Pipeline()
+        with self.assertRaises(ValueError):
+            pipe.add('input', str.upper)
+        with self.assertRaises(ValueError):
+            pipe.add('a', str.upper, source='missing')
+        pipe.add('a', str.upper)
+        with self.assertRaises(ValueError):
+            pipe.add('a', str.upper)
+        with self.assertRaises(ValueError):
+            Pipeline().run([1])
+
+    def test_dag(self):
+        pipe = Pipeline()
+        pipe.add('info', lambda x: {'text': x.upper(), 'size': len(x)})
+        pipe.add('shout', lambda text: text + '!', source='info.text')
+        pipe.add('both', lambda text, size: f'{text}{size}', kwargs={'text': 'shout', 'size': 'info.size'})
+        pipe.add('kw', lambda text, size: size, source='info')
+        items = list(pipe.run(['a', 'bb', 'ccc']))
+        self.assertEqual([0, 1, 2], [item.index for item in items])
+        self.assertEqual('BB!', items[1].outputs['shout'])
+        self.assertEqual('CCC!3', items[2].outputs['both'])
+        self.assertEqual(1, items[0].outputs['kw'])
+        self.assertTrue(all(item.ok for item in items))
+        self.assertEqual('A!1', pipe('a').outputs['both'])
+
+    def test_errors(self):
+        def fail(x):
+            if x == 'bad':
+                raise ValueError(x)
+            return x
+
+        pipe = Pipeline()
+        pipe.add('a', fail)
+        pipe.add('b', str.upper, source='a')
+        pipe.add('c', str.lower)
+        good, bad = pipe.run(['good', 'bad'])
+        self.assertTrue(good.ok)
+        self.assertIsInstance(bad.errors['a'], ValueError)
+        self.assertEqual(['b'], bad.skipped)
+        self.assertEqual('bad', bad.outputs['c'])
+
+        item = Pipeline().add('a', lambda x: {}).add('b', str.upper, source='a.missing')('x')
+        self.assertIsInstance(item.errors['b'], KeyError)
+
+    def test_overlap(self):
+        def slow(x):
+            time.sleep(0.2 if x == 0 else 0.01)
+            return x
+
+        pipe = Pipeline()
+        pipe.add('a', slow, concurrency=4)
+        pipe.add('b', slow, source='a', concurrency=4)
+        start = time.monotonic()
+        items = list(pipe.run(range(4), ordered=False))
+        # fast items go through both stages without waiting for the slow one.
+        self.assertEqual(0, items[-1].index)
+        self.assertLess(time.monotonic() - start, 0.5)
+
+    def test_backpressure(self):
+        read = []
+        release = threading.Event()
+
+        def inputs():
+            for i in range(100):
+                read.append(i)
+                yield i
+
+        pipe = Pipeline()
+        pipe.add('a', lambda x: release.wait() and x, concurrency=1, queue_size=1)
+        it = pipe.run(inputs(), max_pending=4)
+        t = threading.Timer(0.1, release.set)
+        t.start()
+        self.assertEqual(0, next(it).outputs['a'])
+        self.assertLessEqual(len(read), 6)
+        self.assertEqual(99, list(it)[-1].outputs['a'])
+        t.join()
+
+    @mock.patch('openai.ChatCompletion.create')
+    def test_lm_function(self, mock_openai_api):
+        mock_openai_api.side_effect = [
+            {'choices': [{'message': {'content': 'short'}}]},
+            {'choices': [{'message': {'content': 'positive'}}]},
+        ]
+        summarize = LmFunction.create('summarize', examples=[Example(input='long text', output='text')])
+        sentiment = LmFunction.create('sentiment', examples=[Example(input='good', output='positive')])
+        pipe = Pipeline().add('summary', summarize).add('sentiment', sentiment, source='summary')
+        item = pipe('long input')
+        self.assertEqual({'summary': 'short', 'sentiment': 'positive'}, item.outputs)
+        self.assertEqual('short', mock_openai_api.call_args.kwargs['messages'][-1]['content'])
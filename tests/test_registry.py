@@ -0,0 +1,75 @@
+from unittest import TestCase, mock
+
+from slambda import LmFunction, Example, Message
+from slambda.cache import MemoryCache
+from slambda.registry import FunctionRegistry
+
+
+def create(name, output='v1', compact=False):
+    return LmFunction.create('do this', examples=[Example(input='i0', output=output)], name=name, compact=compact)
+
+
+class TestCompactDefinition(TestCase):
+    def test_compact(self):
+        full = create('f').definition
+        compact = full.to_compact()
+        self.assertTrue(compact.compact)
+        self.assertFalse(full.compact)
+        self.assertIsNone(compact.message_stack)
+        self.assertEqual(full.message_stack, compact.messages())
+        self.assertEqual(full.wire_message_stack(), compact.wire_message_stack())
+        self.assertEqual(full.fingerprint(), compact.fingerprint())
+
+    def test_interned(self):
+        a = create('a', output={'label': 'positive'}, compact=True).definition
+        b = create('b', output={'label': 'positive'}, compact=True).definition
+        self.assertIs(a.instruction, b.instruction)
+        self.assertIs(a.examples[0].input, b.examples[0].input)
+        self.assertIs(a.examples[0].output['label'], b.examples[0].output['label'])
+        # definitions with the same content share their message stack.
+        self.assertIs(a.wire_message_stack(), b.wire_message_stack())
+
+    def test_modified_stack(self):
+        definition = create('f').definition
+        definition.message_stack.append(Message.user('extra'))
+        with self.assertRaises(ValueError):
+            definition.to_compact()
+
+    @mock.patch('openai.ChatCompletion.create')
+    def test_call(self, mock_openai_api):
+        mock_openai_api.return_value = {'choices': [{'message': {'content': 'v0'}}]}
+        full = create('f')
+        full('a')
+        expected = mock_openai_api.call_args.kwargs['messages']
+        self.assertEqual('v0', create('f', compact=True)('a'))
+        self.assertEqual(expected, mock_openai_api.call_args.kwargs['messages'])
+
+
+class TestFunctionRegistry(TestCase):
+    def test_add_get(self):
+        cache = MemoryCache()
+        registry = FunctionRegistry(cache=cache)
+        self.assertEqual('f', registry.add(create('f')))
+        self.assertEqual('g', registry.add(create(None), name='g'))
+        self.assertEqual('g', registry.get('g').key)
+        self.assertEqual('h', registry.add(create('f'), name='h'))
+        self.assertEqual('h', registry.get('h').key)
+        self.assertEqual('f', registry.get('f').key)
+        registry.remove('h')
+        with self.assertRaises(ValueError):
+            registry.add(create(None))
+
+        self.assertEqual(2, len(registry))
+        self.assertIn('f', registry)
+        self.assertEqual(['f', 'g'], list(registry))
+        self.assertTrue(registry.definition('f').compact)
+        self.assertIs(cache, registry['f'].cache)
+
+        registry.remove('f')
+        with self.assertRaises(KeyError):
+            registry.get('f')
+
+    def test_not_compact(self):
+        registry = FunctionRegistry(compact=False)
+        registry.add(create('f'))
+        self.assertFalse(registry.definition('f').compact)
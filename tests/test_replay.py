@@ -0,0 +1,85 @@
+import os
+import tempfile
+import time
+from unittest import TestCase, mock
+
+from slambda import LmFunction, Example
+from slambda.deadline import DeadlineExceededError
+from slambda.replay import Recorder, Replayer, ReplayMissError, read_log
+from slambda.transport import get_default_transport, openai_transport, set_default_transport
+
+
+def resp(content):
+    return {'choices': [{'message': {'content': content}}]}
+
+
+class TestRecordReplay(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'log.jsonl')
+        self.fn = LmFunction.create('do this', examples=[Example(input="i0", output='v1')])
+
+    def tearDown(self):
+        set_default_transport(None)
+        self.tmp.cleanup()
+
+    @mock.patch('openai.ChatCompletion.create')
+    def test_record_replay(self, mock_openai_api):
+        mock_openai_api.side_effect = [resp('v0'), resp('v1'), resp('v2')]
+        with Recorder(self.path) as recorder:
+            self.fn.transport = recorder
+            self.assertEqual('v0', self.fn('a'))
+            self.assertEqual('v1', self.fn('a', __override={'timeout': 10}))
+            self.assertEqual('v2', self.fn('b'))
+        records = list(read_log(self.path))
+        self.assertEqual(3, len(records))
+        self.assertEqual(records[0]['key'], records[1]['key'])
+        self.assertNotIn('request_timeout', records[1]['request'])
+        self.assertEqual('v0', records[0]['response']['choices'][0]['message']['content'])
+
+        with open(self.path, 'a') as fp:
+            fp.write('{"key": "trunc')
+
+        replayer = Replayer(self.path)
+        self.assertEqual(3, len(replayer))
+        self.fn.transport = replayer
+        self.assertEqual('v0', self.fn('a'))
+        self.assertEqual('v1', self.fn('a'))
+        self.assertEqual('v0', self.fn('a'))
+        self.assertEqual('v2', self.fn('b'))
+        with self.assertRaises(ReplayMissError):
+            self.fn('c')
+        self.assertEqual(3, mock_openai_api.call_count)
+
+    @mock.patch('openai.ChatCompletion.create')
+    def test_reproduce_latency(self, mock_openai_api):
+        def slow(**kwargs):
+            time.sleep(0.1)
+            return resp('v0')
+
+        mock_openai_api.side_effect = slow
+        with Recorder(self.path) as recorder:
+            recorder(messages=[], model='m')
+
+        replayer = Replayer(self.path, reproduce_latency=True, latency_scale=0.5)
+        start = time.monotonic()
+        self.assertEqual(resp('v0'), replayer(messages=[], model='m'))
+        self.assertGreaterEqual(time.monotonic() - start, 0.05)
+
+        with Recorder(self.path) as recorder:
+            self.fn.transport = recorder
+            self.fn('a')
+        self.fn.transport = Replayer(self.path, reproduce_latency=True)
+        with self.assertRaises(DeadlineExceededError):
+            self.fn('a', __override={'timeout': 0.02})
+
+    @mock.patch('openai.ChatCompletion.create')
+    def test_default_transport(self, mock_openai_api):
+        mock_openai_api.return_value = resp('v0')
+        self.assertIs(openai_transport, get_default_transport())
+        with Recorder(self.path) as recorder:
+            set_default_transport(recorder)
+            self.fn('a')
+        set_default_transport(Replayer(self.path))
+        self.assertEqual('v0', self.fn('a'))
+        mock_openai_api.assert_called_once()
@@ -0,0 +1,122 @@
+import time
+from unittest import TestCase
+
+import openai
+
+from slambda import LmFunction, Example
+from slambda.metrics import MetricsRegistry
+from slambda.routing import Endpoint, EndpointRouter
+from slambda.standin import StandinServer
+
+
+class TestEndpointRouter(TestCase):
+    def setUp(self):
+        self.api_key = openai.api_key
+        openai.api_key = 'standin'
+        self.fn = LmFunction.create('do this', examples=[Example(input="i0", output={'label': 'v1'})])
+        self.metrics = MetricsRegistry()
+
+    def tearDown(self):
+        openai.api_key = self.api_key
+
+    def test_latency(self):
+        with StandinServer(latency=0) as fast, StandinServer(latency=0.05) as slow:
+            self.fn.transport = EndpointRouter([Endpoint(fast.url, name='fast'), Endpoint(slow.url, name='slow')],
+                                               outlier_factor=100, seed=0, metrics=self.metrics)
+            for _ in range(20):
+                self.assertEqual({'label': 'v1'}, self.fn('a'))
+            self.assertGreater(fast.stats.get('requests'), 3 * slow.stats.get('requests'))
+            self.assertGreater(self.metrics.get('router_latency', endpoint='slow'),
+                               self.metrics.get('router_latency', endpoint='fast'))
+
+    def test_latency_outlier(self):
+        with StandinServer(latency=0) as a, StandinServer(latency=0) as b, StandinServer(latency=1) as c:
+            router = EndpointRouter([Endpoint(s.url) for s in (a, b, c)], min_samples=1, outlier_factor=10, seed=0,
+                                    metrics=self.metrics)
+            self.fn.transport = router
+            for _ in range(20):
+                self.fn('a')
+            self.assertEqual(1, self.metrics.get('router_ejections', endpoint=c.url, reason='latency'))
+            self.assertEqual([a.url, b.url], [e.api_base for e in router.available()])
+
+    def test_failover(self):
+        with StandinServer(latency=0) as ok, StandinServer(latency=0, rate_limit_rate=1.0) as failing:
+            router = EndpointRouter([Endpoint(ok.url), Endpoint(failing.url)], failure_threshold=2,
+                                    error_penalty=0, seed=0, metrics=self.metrics)
+            self.fn.transport = router
+            for _ in range(10):
+                self.assertEqual({'label': 'v1'}, self.fn('a'))
+            self.assertEqual(2, failing.stats.get('requests'))
+            self.assertEqual(1, self.metrics.get('router_ejections', endpoint=failing.url, reason='failures'))
+            self.assertEqual([ok.url], [e.api_base for e in router.available()])
+
+    def test_probes(self):
+        router = EndpointRouter([Endpoint('http://a'), Endpoint('http://b')], seed=0, metrics=self.metrics)
+        a, b = router._states
+        a.latency = 1.0
+        # an endpoint without measurement is scored with the median latency, not as the best endpoint.
+        b.in_flight = 1
+        b.latency = None
+        self.assertGreater(router._score(b, 1.0), router._score(a, 1.0))
+        # and it gets at most max_probes requests in flight.
+        for _ in range(10):
+            self.assertIs(a, router._pick(set()))
+
+    def test_invalid_request(self):
+        def transport(**kwargs):
+            raise openai.error.InvalidRequestError('invalid', param=None)
+
+        calls = []
+        router = EndpointRouter([Endpoint('http://a'), Endpoint('http://b')], metrics=self.metrics,
+                                transport=lambda **kwargs: calls.append(kwargs) or transport(**kwargs))
+        with self.assertRaises(openai.error.InvalidRequestError):
+            router(model='m', messages=[])
+        self.assertEqual(1, len(calls))
+        self.assertEqual(2, len(router.available()))
+
+    def test_timeout(self):
+        calls = []
+
+        def transport(**kwargs):
+            calls.append(kwargs['request_timeout'])
+            time.sleep(0.1)
+            raise openai.error.Timeout('Request timed out')
+
+        router = EndpointRouter([Endpoint('http://a'), Endpoint('http://b'), Endpoint('http://c')], max_attempts=3,
+                                min_timeout=0.05, transport=transport, metrics=self.metrics)
+        with self.assertRaises(openai.error.Timeout):
+            router(model='m', messages=[], request_timeout=0.25)
+        # the second attempt gets the time left, and there is not enough time for a third one.
+        self.assertEqual(2, len(calls))
+        self.assertAlmostEqual(0.25, calls[0], delta=0.01)
+        self.assertLess(calls[1], 0.16)
+
+    def test_stream(self):
+        def transport(**kwargs):
+            for i in range(2):
+                time.sleep(0.05)
+                yield {'choices': [{'delta': {'content': str(i)}}]}
+            if kwargs['api_base'] == 'http://failing':
+                raise openai.error.APIError('stream interrupted')
+
+        router = EndpointRouter([Endpoint('http://ok')], transport=transport, metrics=self.metrics)
+        state = router._states[0]
+        # latency is measured at the end of the stream, not when it is opened.
+        self.assertEqual(2, len(list(router(model='m', messages=[], stream=True))))
+        self.assertEqual(0, state.in_flight)
+        self.assertGreaterEqual(state.latency, 0.1)
+
+        # streams closed early are not measured.
+        state.latency = None
+        stream = router(model='m', messages=[], stream=True)
+        next(stream)
+        stream.close()
+        self.assertEqual(0, state.in_flight)
+        self.assertIsNone(state.latency)
+
+        # errors raised while streaming are recorded as failures.
+        router = EndpointRouter([Endpoint('http://failing')], transport=transport, metrics=self.metrics)
+        with self.assertRaises(openai.error.APIError):
+            list(router(model='m', messages=[], stream=True))
+        self.assertEqual(1, self.metrics.get('router_errors', endpoint='http://failing'))
+        self.assertEqual(0, router._states[0].in_flight)
@@ -0,0 +1,83 @@
+import threading
+import time
+from unittest import TestCase, mock
+
+from slambda import LmFunction, Example
+from slambda.metrics import MetricsRegistry
+from slambda.scheduler import Scheduler, Priority
+
+
+def wait_for(cond, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not cond():
+        if time.monotonic() > deadline:
+            raise AssertionError('condition not met')
+        time.sleep(0.001)
+
+
+class TestScheduler(TestCase):
+    def start_waiters(self, scheduler, requests, order):
+        threads = []
+        for priority, flow in requests:
+            def run(priority=priority, flow=flow):
+                scheduler.acquire(priority, flow)
+                order.append((priority, flow))
+
+            t = threading.Thread(target=run)
+            t.start()
+            threads.append(t)
+            # make enqueue order deterministic
+            wait_for(lambda: sum(len(q) for q in scheduler._queues.values()) == len(threads))
+        return threads
+
+    def test_invalid_reservations(self):
+        with self.assertRaises(ValueError):
+            Scheduler(max_concurrency=1, reservations={'interactive': 2})
+
+    def test_priority_order(self):
+        scheduler = Scheduler(max_concurrency=1, metrics=MetricsRegistry())
+        scheduler.acquire(Priority.BATCH)
+        order = []
+        threads = self.start_waiters(scheduler, [
+            (Priority.BATCH, 'b'),
+            (Priority.DEFAULT, 'd'),
+            (Priority.INTERACTIVE, 'i'),
+        ], order)
+        self.assertEqual(3, scheduler.metrics.get('scheduler_queued', priority='batch') +
+                         scheduler.metrics.get('scheduler_queued', priority='default') +
+                         scheduler.metrics.get('scheduler_queued', priority='interactive'))
+        for expected in range(1, 4):
+            scheduler.release(order[-1][0] if order else Priority.BATCH)
+            wait_for(lambda: len(order) == expected)
+        for t in threads:
+            t.join()
+        self.assertEqual([Priority.INTERACTIVE, Priority.DEFAULT, Priority.BATCH], [p for p, _ in order])
+
+    def test_reservation(self):
+        scheduler = Scheduler(max_concurrency=2, reservations={'interactive': 1}, metrics=MetricsRegistry())
+        scheduler.acquire(Priority.BATCH)
+        with self.assertRaises(TimeoutError):
+            scheduler.acquire(Priority.BATCH, timeout=0.01)
+        scheduler.acquire(Priority.INTERACTIVE, timeout=0.01)
+
+    def test_weighted_fair_queuing(self):
+        scheduler = Scheduler(max_concurrency=1, weights={'a': 2}, metrics=MetricsRegistry())
+        scheduler.acquire(Priority.BATCH)
+        order = []
+        threads = self.start_waiters(scheduler, [(Priority.BATCH, 'a')] * 4 + [(Priority.BATCH, 'b')] * 2, order)
+        for expected in range(1, 7):
+            scheduler.release(Priority.BATCH)
+            wait_for(lambda: len(order) == expected)
+        for t in threads:
+            t.join()
+        self.assertEqual(['a', 'a', 'b', 'a', 'a', 'b'], [f for _, f in order])
+
+    @mock.patch('openai.ChatCompletion.create')
+    def test_lm_function(self, mock_openai_api):
+        mock_openai_api.return_value = {'choices': [{'message': {'content': 'v0'}}]}
+        scheduler = Scheduler(max_concurrency=1, metrics=MetricsRegistry())
+        f = LmFunction.create('do this', examples=[Example(input="i0", output='v1')], name='f')
+        f.scheduler = scheduler
+        self.assertEqual('v0', f('a', __override={'priority': 'interactive'}))
+        self.assertEqual(['v0', 'v0'], list(f.map(['a', 'b'])))
+        self.assertEqual(0, sum(scheduler._in_flight.values()))
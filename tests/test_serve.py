@@ -0,0 +1,276 @@
+import asyncio
+import http.client
+import json
+import threading
+import time
+from unittest import TestCase, mock
+
+import openai
+
+from slambda import LmFunction, Example
+from slambda.metrics import MetricsRegistry
+from slambda.serve import FunctionServer, validate_input
+from slambda.usage import usage_tracker
+from slambda.standin import StandinServer
+
+
+def completion(content):
+    return {'choices': [{'message': {'role': 'assistant', 'content': content}}]}
+
+
+def request(port, method, path, body=None, conn=None):
+    conn = conn or http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+    conn.request(method, path, body=json.dumps(body) if body is not None else None,
+                 headers={'Content-Type': 'application/json'})
+    resp = conn.getresponse()
+    data = resp.read()
+    return resp.status, json.loads(data) if data else None, dict(resp.getheaders())
+
+
+class TestFunctionServer(TestCase):
+    def setUp(self):
+        self.unary = LmFunction.create('do this', examples=[Example(input="i0", output={'label': 'v1'})])
+        self.keyword = LmFunction.create('do that', required_args=['a', 'b'], examples=[
+            Example(input={'a': '1', 'b': '2'}, output={'label': 'v1'})
+        ])
+
+    def serve(self, test, **kwargs):
+        async def run():
+            server = FunctionServer({'unary': self.unary, 'keyword': self.keyword},
+                                    metrics=MetricsRegistry(), **kwargs)
+            await server.start(port=0)
+            try:
+                await test(server)
+            finally:
+                await server.close()
+
+        asyncio.run(run())
+
+    def test_validate_input(self):
+        validate_input(self.unary.definition, 'a')
+        with self.assertRaises(ValueError):
+            validate_input(self.unary.definition, {'a': '1'})
+        with self.assertRaises(ValueError):
+            validate_input(self.keyword.definition, {'a': '1'})
+
+    @mock.patch('openai.ChatCompletion.create')
+    def test_call(self, mock_create):
+        mock_create.return_value = completion('{"label": "v2"}')
+
+        async def test(server):
+            loop = asyncio.get_running_loop()
+            conn = http.client.HTTPConnection('127.0.0.1', server.port, timeout=5)
+            # requests share the same keep-alive connection.
+            status, body, _ = await loop.run_in_executor(
+                None, request, server.port, 'POST', '/functions/unary', {'input': 'a'}, conn)
+            self.assertEqual((200, {'output': {'label': 'v2'}}), (status, body))
+            status, body, _ = await loop.run_in_executor(
+                None, request, server.port, 'POST', '/functions/keyword',
+                {'input': {'a': '1', 'b': '2'}, 'override': {'temperature': 0}}, conn)
+            self.assertEqual(200, status)
+            self.assertEqual(0, mock_create.call_args.kwargs['temperature'])
+
+            status, body, _ = await loop.run_in_executor(
+                None, request, server.port, 'POST', '/functions/keyword', {'input': {'a': '1'}}, conn)
+            self.assertEqual(400, status)
+            self.assertIn('b is required', body['error'])
+            status, _, _ = await loop.run_in_executor(
+                None, request, server.port, 'POST', '/functions/missing', {'input': 'a'}, conn)
+            self.assertEqual(404, status)
+            conn.close()
+
+            status, body, _ = await loop.run_in_executor(None, request, server.port, 'GET', '/functions')
+            self.assertEqual(['unary', 'keyword'], [f['name'] for f in body['functions']])
+            status, body, _ = await loop.run_in_executor(None, request, server.port, 'GET', '/health')
+            self.assertEqual('ok', body['status'])
+            self.assertEqual(2, server.metrics.get('server_requests', function='unary', status=200) +
+                             server.metrics.get('server_requests', function='keyword', status=200))
+            self.assertEqual(1, server.metrics.get('server_requests', function='keyword', status=400))
+
+        self.serve(test)
+
+    @mock.patch('openai.ChatCompletion.create')
+    def test_error(self, mock_create):
+        mock_create.return_value = completion('not json')
+
+        async def test(server):
+            loop = asyncio.get_running_loop()
+            status, body, _ = await loop.run_in_executor(
+                None, request, server.port, 'POST', '/functions/unary', {'input': 'a'})
+            self.assertEqual(502, status)
+            self.assertIn('LmOutputCastingError', body['error'])
+
+            # only API parameters can be overridden by clients.
+            status, body, _ = await loop.run_in_executor(
+                None, request, server.port, 'POST', '/functions/unary',
+                {'input': 'a', 'override': {'tenant': 'other', 'priority': 0}})
+            self.assertEqual(400, status)
+            self.assertIn('priority, tenant', body['error'])
+
+            reader, writer = await asyncio.open_connection('127.0.0.1', server.port)
+            writer.write(b'POST /functions/unary HTTP/1.1\r\nContent-Length: abc\r\n\r\n')
+            await writer.drain()
+            self.assertIn(b' 400 ', await reader.readline())
+            writer.close()
+
+            # header lines over the limit of the stream reader.
+            reader, writer = await asyncio.open_connection('127.0.0.1', server.port)
+            writer.write(b'POST /functions/unary HTTP/1.1\r\nX-Long: ' + b'a' * 100000 + b'\r\n\r\n')
+            await writer.drain()
+            self.assertIn(b' 431 ', await reader.readline())
+            writer.close()
+
+        self.serve(test)
+
+    @mock.patch('openai.ChatCompletion.create')
+    def test_load_shedding(self, mock_create):
+        release = threading.Event()
+
+        def create(**kwargs):
+            release.wait(5)
+            return completion('{"label": "v2"}')
+
+        mock_create.side_effect = create
+
+        async def test(server):
+            loop = asyncio.get_running_loop()
+            first = loop.run_in_executor(None, request, server.port, 'POST', '/functions/unary', {'input': 'a'})
+            while server.pending == 0:
+                await asyncio.sleep(0.01)
+            status, _, headers = await loop.run_in_executor(
+                None, request, server.port, 'POST', '/functions/unary', {'input': 'b'})
+            self.assertEqual(503, status)
+            self.assertEqual('1', headers['Retry-After'])
+            release.set()
+            status, _, _ = await first
+            self.assertEqual(200, status)
+            self.assertEqual(1, server.metrics.get('server_shed', function='unary'))
+
+        self.serve(test, max_pending=1)
+
+
+def stream_events(port, body):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+    conn.request('POST', '/playground/run', body=json.dumps(body), headers={'Content-Type': 'application/json'})
+    resp = conn.getresponse()
+    if resp.status != 200:
+        return resp.status, json.loads(resp.read())
+    events = []
+    for block in resp.read().decode('utf-8').split('\n\n'):
+        if block.strip():
+            event, data = block.split('\n')
+            events.append((event[len('event: '):], json.loads(data[len('data: '):])))
+    return resp.status, events
+
+
+class TestPlayground(TestCase):
+    def setUp(self):
+        self.api_base, self.api_key = openai.api_base, openai.api_key
+        openai.api_key = 'standin'
+        fn = LmFunction.create('do this', examples=[Example(input="i0", output={'label': 'v1'})])
+        usage_tracker.reset()
+        # the shape of functions extracted by utils/extract_defs.py
+        self.template = fn.definition.model_dump(mode='json', exclude_none=True)
+
+    def tearDown(self):
+        openai.api_base, openai.api_key = self.api_base, self.api_key
+
+    def serve(self, test, **kwargs):
+        async def run():
+            server = FunctionServer({}, metrics=MetricsRegistry(), **kwargs)
+            await server.start(port=0)
+            try:
+                await test(server)
+            finally:
+                await server.close()
+
+        asyncio.run(run())
+
+    def test_disabled(self):
+        async def test(server):
+            loop = asyncio.get_running_loop()
+            status, _, _ = await loop.run_in_executor(
+                None, request, server.port, 'POST', '/playground/run', {'template': self.template, 'input': 'a'})
+            self.assertEqual(404, status)
+
+        self.serve(test)
+
+    def test_stream(self):
+        async def test(server):
+            loop = asyncio.get_running_loop()
+            status, events = await loop.run_in_executor(
+                None, stream_events, server.port, {'template': self.template, 'input': 'a'})
+            self.assertEqual(200, status)
+            self.assertEqual('{"label": "v1"}', ''.join(e[1]['content'] for e in events if e[0] == 'token'))
+            self.assertEqual(('done', {'output': {'label': 'v1'}}), events[-1])
+
+            # the definition is compiled once.
+            status, events = await loop.run_in_executor(
+                None, stream_events, server.port, {'definition': self.template, 'input': 'b'})
+            self.assertEqual('done', events[-1][0])
+            self.assertEqual(1, server.metrics.get('playground_definitions', cached=False))
+            self.assertEqual(1, server.metrics.get('playground_definitions', cached=True))
+            self.assertEqual(2, server.metrics.get('server_requests', function='playground', status=200))
+            # runs of unnamed definitions share one usage label.
+            self.assertEqual(2, usage_tracker.get('playground').requests)
+
+            status, body = await loop.run_in_executor(
+                None, stream_events, server.port, {'template': {'instruction': 1}, 'input': 'a'})
+            self.assertEqual(400, status)
+            status, body = await loop.run_in_executor(
+                None, stream_events, server.port, {'template': self.template, 'input': {'a': 1}})
+            self.assertEqual(400, status)
+
+            status, _, headers = await loop.run_in_executor(None, request, server.port, 'OPTIONS', '/playground/run')
+            self.assertEqual(204, status)
+            self.assertEqual('*', headers['Access-Control-Allow-Origin'])
+
+        with StandinServer(latency=0, chunk_interval=0) as standin:
+            openai.api_base = standin.url
+            self.serve(test, playground=True, allow_origin='*')
+
+    def test_error(self):
+        async def test(server):
+            loop = asyncio.get_running_loop()
+            status, events = await loop.run_in_executor(
+                None, stream_events, server.port, {'template': self.template, 'input': 'a'})
+            self.assertEqual(200, status)
+            self.assertEqual('error', events[-1][0])
+            self.assertEqual(502, events[-1][1]['status'])
+
+        with StandinServer(latency=0, chunk_interval=0, content='not json') as standin:
+            openai.api_base = standin.url
+            self.serve(test, playground=True)
+
+    @mock.patch('openai.ChatCompletion.create')
+    def test_disconnect(self, mock_create):
+        pulled = []
+        closed = threading.Event()
+
+        def chunks():
+            try:
+                for i in range(100):
+                    pulled.append(i)
+                    time.sleep(0.01)
+                    yield {'choices': [{'index': 0, 'delta': {'content': 'x'}}]}
+            finally:
+                closed.set()
+
+        mock_create.side_effect = lambda **kwargs: chunks()
+
+        async def test(server):
+            reader, writer = await asyncio.open_connection('127.0.0.1', server.port)
+            body = json.dumps({'template': self.template, 'input': 'a'}).encode('utf-8')
+            writer.write(b'POST /playground/run HTTP/1.1\r\nContent-Length: %d\r\n\r\n' % len(body) + body)
+            await writer.drain()
+            while b'event: token' not in await reader.readline():
+                pass
+            writer.close()
+            # the stream is closed soon after the client is gone.
+            loop = asyncio.get_running_loop()
+            self.assertTrue(await loop.run_in_executor(None, closed.wait, 5))
+            self.assertLess(len(pulled), 100)
+            while server.pending:
+                await asyncio.sleep(0.01)
+
+        self.serve(test, playground=True)
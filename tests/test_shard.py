@@ -0,0 +1,78 @@
+import json
+import multiprocessing
+import os
+import tempfile
+from unittest import TestCase, mock
+
+from slambda.contrib.summarize import summarize
+from slambda.discovery import resolve_function
+from slambda.shard import shard_of, iter_shard, run_shard, merge_shards, run_sharded
+
+
+def upper(**kwargs):
+    content = kwargs['messages'][-1]['content']
+    return {'choices': [{'message': {'content': content.upper()}}]}
+
+
+class TestShard(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.input_path = os.path.join(self.tmp.name, 'in.jsonl')
+        with open(self.input_path, 'w') as out:
+            for i in range(20):
+                out.write(json.dumps({'id': f"r{i}", 'text': f"t{i}"}) + '\n')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def read_output(self, path):
+        with open(path) as fd:
+            return [json.loads(line) for line in fd]
+
+    def test_shard_of(self):
+        self.assertEqual(shard_of('abc', 7), shard_of('abc', 7))
+        self.assertEqual({0, 1, 2}, {shard_of(i, 3) for i in range(100)})
+
+    def test_iter_shard_partition(self):
+        records = [{'id': i} for i in range(50)]
+        seen = []
+        for i in range(4):
+            seen.extend(index for index, _ in iter_shard(records, i, 4, key_field='id'))
+        self.assertEqual(list(range(50)), sorted(seen))
+        with self.assertRaises(ValueError):
+            list(iter_shard(records, 4, 4))
+
+    def test_resolve_function(self):
+        self.assertIs(summarize, resolve_function('slambda.contrib.summarize:summarize'))
+        with self.assertRaises(ValueError):
+            resolve_function('slambda.contrib.summarize')
+        with self.assertRaises(ValueError):
+            resolve_function('slambda.contrib.summarize:examples')
+
+    @mock.patch('openai.ChatCompletion.create')
+    def test_run_and_merge(self, mock_openai_api):
+        mock_openai_api.side_effect = upper
+        out_dir = os.path.join(self.tmp.name, 'parts')
+        total = 0
+        for i in range(3):
+            total += run_shard(summarize, self.input_path, out_dir, i, 3, input_field='text').total
+        self.assertEqual(20, total)
+
+        out = os.path.join(self.tmp.name, 'out.jsonl')
+        stats = merge_shards(out_dir, 3, out)
+        self.assertEqual(20, stats.succeeded)
+        rows = self.read_output(out)
+        self.assertEqual([f"r{i}" for i in range(20)], [r['id'] for r in rows])
+        self.assertEqual([f"T{i}" for i in range(20)], [r['output'] for r in rows])
+
+        with self.assertRaises(FileNotFoundError):
+            merge_shards(out_dir, 4, out)
+
+    @mock.patch('openai.ChatCompletion.create')
+    def test_run_sharded(self, mock_openai_api):
+        mock_openai_api.side_effect = upper
+        out = os.path.join(self.tmp.name, 'out.jsonl')
+        stats = run_sharded('slambda.contrib.summarize:summarize', self.input_path, out, shard_count=2,
+                            input_field='text', key_field='id', mp_context=multiprocessing.get_context('fork'))
+        self.assertEqual(20, stats.total)
+        self.assertEqual([f"r{i}" for i in range(20)], [r['id'] for r in self.read_output(out)])
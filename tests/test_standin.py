@@ -0,0 +1,86 @@
+import io
+import time
+from contextlib import redirect_stdout
+from unittest import TestCase
+
+import openai
+
+from slambda import LmFunction, Example
+from slambda.loadtest import main, percentile, run_load
+from slambda.standin import StandinServer
+
+
+class TestStandinServer(TestCase):
+    def setUp(self):
+        self.api_base, self.api_key = openai.api_base, openai.api_key
+        openai.api_key = 'standin'
+        self.fn = LmFunction.create('do this', examples=[Example(input="i0", output={'label': 'v1'})])
+
+    def tearDown(self):
+        openai.api_base, openai.api_key = self.api_base, self.api_key
+
+    def test_completion(self):
+        with StandinServer(latency=0) as server:
+            openai.api_base = server.url
+            self.assertEqual({'label': 'v1'}, self.fn('a'))
+            self.assertEqual(2, len(self.fn('a', __override={'n': 2})))
+            chunks = list(self.fn('a', __override={'stream': True}))
+            self.assertEqual('{"label": "v1"}', ''.join(c['choices'][0]['delta'].get('content', '') for c in chunks))
+            self.assertEqual(3, server.stats.get('requests'))
+
+    def test_rate_limit(self):
+        with StandinServer(latency=0, rate_limit_rate=1.0) as server:
+            openai.api_base = server.url
+            with self.assertRaises(openai.error.RateLimitError):
+                self.fn('a')
+        with StandinServer(latency=0, max_rps=2) as server:
+            openai.api_base = server.url
+            report = run_load(self.fn, ['a'], concurrency=1, max_requests=5)
+            self.assertEqual(5, report.requests)
+            self.assertGreaterEqual(report.errors['RateLimitError'], 2)
+            self.assertEqual(report.errors['RateLimitError'], server.stats.get('rate_limited'))
+
+
+class TestLoadTest(TestCase):
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(50, percentile(values, 50))
+        self.assertEqual(99, percentile(values, 99))
+        self.assertEqual(0.0, percentile([], 50))
+
+    def test_run_load(self):
+        with self.assertRaises(ValueError):
+            run_load(str.upper, ['a'])
+        report = run_load(str.upper, ['a', 'b'], rps=200, duration=0.1)
+        self.assertGreater(report.requests, 10)
+        self.assertEqual(0, report.error_rate)
+
+        def fail(x):
+            raise ValueError(x)
+
+        report = run_load(fail, ['a'], concurrency=2, max_requests=10)
+        self.assertEqual({'ValueError': 10}, dict(report.errors))
+        self.assertEqual(1.0, report.error_rate)
+
+    def test_run_load_queueing(self):
+        def slow(x):
+            time.sleep(0.05)
+            return x
+
+        # calls wait for the single worker, the wait is part of their latency.
+        report = run_load(slow, ['a'], rps=100, max_requests=4, max_workers=1)
+        self.assertEqual(4, report.requests)
+        self.assertGreater(max(report.latencies), 0.12)
+
+    def test_main(self):
+        api_base, api_key = openai.api_base, openai.api_key
+        out = io.StringIO()
+        try:
+            with redirect_stdout(out):
+                report = main(['slambda.contrib.sentiment:sentiment', '--input', 'great', '--concurrency', '2',
+                               '--requests', '6', '--standin', '--standin-latency', '0'])
+        finally:
+            openai.api_base, openai.api_key = api_base, api_key
+        self.assertEqual(6, report.requests)
+        self.assertEqual(0, report.error_rate)
+        self.assertIn('throughput', out.getvalue())
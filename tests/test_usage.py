@@ -1,7 +1,7 @@
 from unittest import TestCase, mock
 from unittest.mock import call
 
-from slambda import LmFunction, Example, GptApiOptions, Message
+from slambda import LmFunction, Example, GptApiOptions, Message, LmOutputCastingError
 
 
 def gpt_text(**kwargs):
@@ -379,3 +379,46 @@ class TestLogEntryController(TestCase):
             ]
             }
             , o)
+
+
+class TestCastRetries(TestCase):
+    @mock.patch('openai.ChatCompletion.create')
+    def test_repaired_output(self, mock_openai_api):
+        mock_openai_api.return_value = {'choices': [{'message': {'content': '```json\n{"k1": "v0",}\n```'}}]}
+        f = LmFunction.create(
+            'do this',
+            examples=[
+                Example(input="i0", output={'k1': 'v1'}),
+            ]
+        )
+        self.assertEqual({'k1': 'v0'}, f('as'))
+        self.assertEqual(1, len(mock_openai_api.call_args_list))
+
+    @mock.patch('openai.ChatCompletion.create')
+    def test_cast_retries(self, mock_openai_api):
+        mock_openai_api.side_effect = [
+            {'choices': [{'message': {'content': 'no json here'}}]},
+            {'choices': [{'message': {'content': '{"k1": "v0"}'}}]},
+        ]
+        f = LmFunction.create(
+            'do this',
+            examples=[
+                Example(input="i0", output={'k1': 'v1'}),
+            ],
+            cast_retries=1
+        )
+        self.assertEqual({'k1': 'v0'}, f('as'))
+        self.assertEqual(2, len(mock_openai_api.call_args_list))
+
+    @mock.patch('openai.ChatCompletion.create')
+    def test_cast_retries_exhausted(self, mock_openai_api):
+        mock_openai_api.return_value = {'choices': [{'message': {'content': 'no json here'}}]}
+        f = LmFunction.create(
+            'do this',
+            examples=[
+                Example(input="i0", output={'k1': 'v1'}),
+            ]
+        )
+        with self.assertRaises(LmOutputCastingError):
+            f('as', __override={'cast_retries': 2})
+        self.assertEqual(3, len(mock_openai_api.call_args_list))
@@ -1,6 +1,6 @@
 import unittest
 
-from slambda.utils import extract_required_keywords, try_parse_json
+from slambda.utils import extract_required_keywords, try_parse_json, repair_json
 from slambda.core import InputCounter, OutputCounter, FunctionOutputConfig, FunctionInputConfig
 
 
@@ -209,5 +209,77 @@ class TestUtils(unittest.TestCase):
             OutputCounter(0, 0).to_config()
 
 
+class TestJsonRepair(unittest.TestCase):
+    def test_valid_json(self):
+        self.assertEqual(({'k': 0}, 'none'), repair_json('{"k": 0}'))
+
+    def test_code_fence(self):
+        v, name = repair_json('```json\n{"k": [1, 2]}\n```')
+        self.assertEqual({'k': [1, 2]}, v)
+        self.assertEqual('strip_code_fence', name)
+
+        # backticks inside the document are not a fence.
+        v, name = repair_json('{"a": "```"', truncated=True)
+        self.assertEqual({'a': '```'}, v)
+        self.assertEqual('close_truncated', name)
+
+        v, name = repair_json('```json\n{"a": "```"}\n```')
+        self.assertEqual({'a': '```'}, v)
+
+    def test_leading_prose(self):
+        v, name = repair_json('Sure! Here is the answer: [{"k": "v"}] Hope it helps.')
+        self.assertEqual([{'k': 'v'}], v)
+        self.assertEqual('extract_json_span', name)
+
+    def test_trailing_comma(self):
+        v, name = repair_json('{"k": [1, 2,], "s": "a,]",}')
+        self.assertEqual({'k': [1, 2], 's': 'a,]'}, v)
+        self.assertEqual('remove_trailing_commas', name)
+
+    def test_single_quotes(self):
+        v, name = repair_json("{'k': 'it\\'s \"quoted\"'}")
+        self.assertEqual({'k': 'it\'s "quoted"'}, v)
+        self.assertEqual('replace_single_quotes', name)
+
+    def test_truncated_array(self):
+        v, name = repair_json('[{"name": "a", "url": "u1"}, {"name": "b", "url": "ht', truncated=True)
+        self.assertEqual([{'name': 'a', 'url': 'u1'}], v)
+        self.assertEqual('close_truncated', name)
+
+        v, name = repair_json('{"k": [1, 2', truncated=True)
+        self.assertEqual({'k': [1, 2]}, v)
+
+        v, name = repair_json('{"k": "abc', truncated=True)
+        self.assertEqual({'k': 'abc'}, v)
+
+        # keys after a closed bracket are kept.
+        v, name = repair_json('{"k":[1,2],"m":"x', truncated=True)
+        self.assertEqual({'k': [1, 2], 'm': 'x'}, v)
+
+    def test_truncated_opt_in(self):
+        self.assertEqual(('{"k":[1,2],"m":"x', None), repair_json('{"k":[1,2],"m":"x'))
+        self.assertEqual(('{"k": [1, 2', None), repair_json('{"k": [1, 2'))
+
+    def test_layered(self):
+        v, name = repair_json("Result:\n```\n[{'k': 1,}, {'k': 2", truncated=True)
+        self.assertEqual([{'k': 1}], v)
+        self.assertEqual('close_truncated', name)
+
+    def test_cannot_repair(self):
+        self.assertEqual(('hello', None), repair_json('hello'))
+
+    def test_try_parse_json_repair(self):
+        d, parsed = try_parse_json('{"k": 0', repair=True, truncated=True)
+        self.assertDictEqual({"k": 0}, d)
+        self.assertTrue(parsed)
+
+        d, parsed = try_parse_json('{"k": 0', repair=True)
+        self.assertFalse(parsed)
+
+        d, parsed = try_parse_json('not json', repair=True)
+        self.assertEqual('not json', d)
+        self.assertFalse(parsed)
+
+
 if __name__ == '__main__':
     unittest.main()
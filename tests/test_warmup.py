@@ -0,0 +1,113 @@
+import json
+import os
+import tempfile
+from unittest import TestCase, mock
+
+from slambda import LmFunction, Example
+from slambda.cache import MemoryCache, SqliteCache
+from slambda.checkpoint import CheckpointMismatchError
+from slambda.files import process_file
+from slambda.replay import Recorder
+from slambda.warmup import warm_from_checkpoint, warm_from_file, warm_from_logs, warm_from_rows
+
+
+def upper(**kwargs):
+    content = kwargs['messages'][-1]['content']
+    if content == 'boom':
+        raise RuntimeError('boom')
+    return {'choices': [{'message': {'content': content.upper()}}]}
+
+
+class TestWarmup(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.fn = LmFunction.create('do this', examples=[Example(input="i0", output='v1')])
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.tmp.name, name)
+
+    @mock.patch('openai.ChatCompletion.create')
+    def test_from_logs(self, mock_openai_api):
+        mock_openai_api.side_effect = upper
+        with Recorder(self.path('log.jsonl')) as recorder:
+            self.fn.transport = recorder
+            self.fn('a')
+            self.fn('b')
+            other = LmFunction.create('old prompt', examples=[Example(input="i0", output='v1')])
+            other.transport = recorder
+            other('c')
+        self.fn.transport = None
+
+        cache = SqliteCache(self.path('cache.db'))
+        stats = warm_from_logs(cache, [self.path('log.jsonl')], definitions=[self.fn.definition], batch_size=1)
+        self.assertEqual((2, 1), (stats.loaded, stats.skipped))
+        self.fn.cache = cache
+        self.assertEqual('A', self.fn('a'))
+        self.assertEqual(3, mock_openai_api.call_count)
+        cache.close()
+
+        stats = warm_from_logs(MemoryCache(), [self.path('log.jsonl')])
+        self.assertEqual(3, stats.loaded)
+
+    @mock.patch('openai.ChatCompletion.create')
+    def test_from_checkpoint(self, mock_openai_api):
+        mock_openai_api.side_effect = upper
+        with open(self.path('in.jsonl'), 'w') as fp:
+            for text in ['a', 'boom', 'c']:
+                fp.write(json.dumps({'text': text}) + '\n')
+        process_file(self.fn, self.path('in.jsonl'), self.path('out.jsonl'), input_field='text',
+                     checkpoint=self.path('job.db'))
+        self.assertEqual(3, mock_openai_api.call_count)
+
+        cache = MemoryCache()
+        stats = warm_from_checkpoint(cache, self.fn, self.path('job.db'))
+        self.assertEqual((2, 1), (stats.loaded, stats.skipped))
+        self.fn.cache = cache
+        self.assertEqual('C', self.fn('c'))
+        self.assertEqual(3, mock_openai_api.call_count)
+
+        fingerprint = self.fn.definition.fingerprint()
+        cache = MemoryCache()
+        stats = warm_from_file(cache, self.fn, self.path('out.jsonl'), fingerprint, input_field='text')
+        self.assertEqual(2, stats.loaded)
+
+        changed = LmFunction.create('do that', examples=[Example(input="i0", output='v1')])
+        with self.assertRaises(CheckpointMismatchError):
+            warm_from_checkpoint(MemoryCache(), changed, self.path('job.db'))
+
+    @mock.patch('openai.ChatCompletion.create')
+    def test_checkpoint_override(self, mock_openai_api):
+        mock_openai_api.side_effect = upper
+        with open(self.path('in.jsonl'), 'w') as fp:
+            fp.write(json.dumps({'text': 'a'}) + '\n')
+        override = {'model': 'gpt-4'}
+        process_file(self.fn, self.path('in.jsonl'), self.path('out.jsonl'), input_field='text',
+                     checkpoint=self.path('job.db'), __override=override)
+
+        cache = MemoryCache()
+        self.assertEqual(1, warm_from_checkpoint(cache, self.fn, self.path('job.db')).loaded)
+        self.fn.cache = cache
+        # outputs are cached under the request of the batch run, not the default model.
+        self.assertEqual('A', self.fn('a', __override=override))
+        self.assertEqual(1, mock_openai_api.call_count)
+        self.fn('a')
+        self.assertEqual(2, mock_openai_api.call_count)
+
+        with self.assertRaises(CheckpointMismatchError):
+            warm_from_checkpoint(MemoryCache(), self.fn, self.path('job.db'), __override={'model': 'gpt-3.5-turbo'})
+        self.assertEqual(1, warm_from_checkpoint(MemoryCache(), self.fn, self.path('job.db'),
+                                                 __override=override).loaded)
+
+    @mock.patch('openai.ChatCompletion.create')
+    def test_json_outputs(self, mock_openai_api):
+        fn = LmFunction.create('do this', examples=[Example(input={'a': 'x'}, output={'b': 'y'})])
+        cache = MemoryCache()
+        rows = [{'a': '1', 'output': {'b': '2'}, 'error': None}]
+        stats = warm_from_rows(cache, fn, rows, fn.definition.fingerprint())
+        self.assertEqual(1, stats.loaded)
+        fn.cache = cache
+        self.assertEqual({'b': '2'}, fn(a='1'))
+        mock_openai_api.assert_not_called()